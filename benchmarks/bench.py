@@ -0,0 +1,437 @@
+#!/usr/bin/env python
+""" Benchmark parsing, identity resolution and country matching
+
+Run benchmarks on synthetic inputs at one of the scales in ``SCALES``, and
+report time and peak (Python) memory for each.  Store results in
+``benchmarks/results/<sha7>.json``, keyed by git commit, so we can compare
+runs across commits::
+
+    python benchmarks/bench.py --scale small
+    python benchmarks/bench.py --scale small --compare 1a7ad81
+
+Run from the repository root.
+"""
+
+import sys
+import json
+import time
+import tracemalloc
+from os import makedirs
+from os.path import join as pjoin, abspath, dirname, exists
+from subprocess import check_output
+from tempfile import TemporaryDirectory
+from argparse import ArgumentParser
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+from tabulate import tabulate
+
+HERE = dirname(abspath(__file__))
+ROOT = dirname(HERE)
+sys.path.append(ROOT)
+
+from gputils import (parse_sl_line, parse_shortlog, RepoContributor,
+                     IdentityIndex, Repo, get_sha7)
+from synth_repo import make_repo, make_authors, zipf_authors, TZ_OFFSETS
+import contrib_countries as cc
+import commit_analysis as ca
+from find_gh_users import save_all, df2gh_map
+
+RESULTS_DIR = pjoin(HERE, 'results')
+
+# Numbers of commits and location strings for each scale.
+SCALES = {
+    'small': dict(n_commits=10_000, n_locations=10_000),
+    'medium': dict(n_commits=1_000_000, n_locations=100_000),
+    'large': dict(n_commits=10_000_000, n_locations=100_000),
+}
+
+# Repositories to share synthetic contributors between.
+N_REPOS = 10
+
+START_EPOCH = 1_000_000_000
+
+
+def tz_suffix(offset):
+    sign = '-' if offset < 0 else '+'
+    hours, minutes = divmod(abs(int(offset)), 60)
+    return f'{sign}{hours:02d}:{minutes:02d}'
+
+
+def synth_shortlog(n_commits, n_authors=None, alias_frac=0.2,
+                   noreply_frac=0.1, seed=0):
+    """ Text as output by ``git shortlog -n`` with ``SL_FORMAT``
+
+    Spread `n_commits` over `n_authors` (default one per 50 commits) with
+    Zipf-like weights.  A fraction `alias_frac` of commits use an unmapped
+    name and email, and a fraction `noreply_frac` of authors have Github
+    noreply emails.
+    """
+    rng = np.random.default_rng(seed)
+    n_authors = max(1, n_commits // 50) if n_authors is None else n_authors
+    synth_authors = make_authors(n_authors, noreply_frac, rng=rng)
+    authors = zipf_authors(n_commits, n_authors, rng=rng)
+    tzs = np.array([a.tz_offset for a in synth_authors])[authors]
+    travel = rng.random(n_commits) < 0.05
+    tzs[travel] = rng.choice(TZ_OFFSETS, travel.sum())
+    epochs = START_EPOCH + np.sort(rng.integers(0, 10 ** 9, n_commits))
+    stamps = np.datetime_as_string(
+        (epochs + tzs * 60).astype('datetime64[s]'))
+    suffixes = {tz: tz_suffix(tz) for tz in TZ_OFFSETS}
+    aliased = rng.random(n_commits) < alias_frac
+    counts = np.bincount(authors, minlength=n_authors)
+    by_author = np.argsort(authors, kind='stable')
+    starts = np.concatenate([[0], np.cumsum(counts)])
+    out = []
+    for k in np.argsort(-counts, kind='stable'):
+        if counts[k] == 0:
+            break
+        name, email, alias_name, alias_email = synth_authors[k][:4]
+        alias = (alias_name, alias_email)
+        out.append(f'{name} ({counts[k]}):')
+        for i in by_author[starts[k]:starts[k + 1]]:
+            o_name, o_email = alias if aliased[i] else (name, email)
+            out.append(f'      {i:040x}||{name}||{email}||{o_name}||'
+                       f'{o_email}||{stamps[i]}{suffixes[tzs[i]]}')
+        out.append('')
+    return '\n'.join(out) + '\n'
+
+
+def synth_locations(n_locations, seed=0):
+    """ List of `n_locations` location strings
+
+    Build from real locations, and variants on these, with extra words and
+    changed case, as in Github profiles.  Some strings repeat, as do real
+    locations.
+    """
+    rng = np.random.default_rng(seed)
+    users = pd.read_csv(pjoin(ROOT, 'users_locations.csv'))
+    real = sorted(set(users['location'].dropna()) |
+                  set(cc.GH_USER2LOCATION.values()))
+    extras = ['', ' ', 'Earth', 'Remote', 'Planet {}', 'District {}',
+              'PO Box {}']
+    out = []
+    for i in range(n_locations):
+        location = real[rng.integers(len(real))]
+        extra = extras[rng.integers(len(extras))].format(i)
+        if rng.random() < 0.5:
+            location = f'{extra}, {location}'
+        if rng.random() < 0.2:
+            location = location.upper()
+        out.append(location)
+    return out
+
+
+class Inputs:
+    """ Synthetic inputs for benchmarks, made on first use
+    """
+
+    def __init__(self, n_commits, n_locations, seed=0):
+        self.n_commits = n_commits
+        self.n_locations = n_locations
+        self.seed = seed
+
+    @cached_property
+    def shortlog(self):
+        return synth_shortlog(self.n_commits, seed=self.seed)
+
+    @cached_property
+    def sl_lines(self):
+        return [L for L in self.shortlog.splitlines() if L.startswith(' ')]
+
+    @cached_property
+    def views(self):
+        return parse_shortlog(self.shortlog)
+
+    def contributors(self):
+        """ New contributors, without cached properties
+        """
+        return [RepoContributor(commits, None) for commits in self.views]
+
+    @cached_property
+    def contrib_map(self):
+        rng = np.random.default_rng(self.seed)
+        contrib_map = {f'repo{i}': [] for i in range(N_REPOS)}
+        for c in self.contributors():
+            c.gh_user = c.name.replace(' ', '-').lower()
+            contrib_map[f'repo{rng.integers(N_REPOS)}'].append(c)
+        return contrib_map
+
+    @cached_property
+    def users(self):
+        """ Data frame like ``users_locations.csv``
+        """
+        rng = np.random.default_rng(self.seed)
+        codes = cc.COUNTRY_CODES.values
+        rows = [(repo_name, len(c), c.name, c.email, c.gh_user)
+                for repo_name, contribs in self.contrib_map.items()
+                for c in contribs]
+        df = pd.DataFrame(
+            rows, columns=['repo', 'n_commits', 'name', 'email', 'gh_user'])
+        # Most people are in a few countries.
+        df['country_code'] = codes[zipf_authors(len(df), len(codes),
+                                                rng=rng)]
+        return df
+
+    @cached_property
+    def repo(self):
+        """ :class:`Repo` for synthetic git repository, made with fast-import
+        """
+        self._tmpdir = TemporaryDirectory()
+        path = pjoin(self._tmpdir.name, 'synth')
+        make_repo(path, self.n_commits, seed=self.seed)
+        return Repo('synth', 'synth', path=path)
+
+    @cached_property
+    def locations(self):
+        return synth_locations(self.n_locations, self.seed)
+
+    @cached_property
+    def country_candidates(self):
+        return [L.split(',')[-1].strip() for L in self.locations]
+
+
+# Benchmarks, by name.  Each takes :class:`Inputs` and returns a function
+# to time, so setup does not count.
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+@benchmark
+def parse_sl_lines(inputs):
+    lines = inputs.sl_lines
+    return lambda: [parse_sl_line(L) for L in lines]
+
+
+@benchmark
+def parse_shortlog_text(inputs):
+    text = inputs.shortlog
+    return lambda: parse_shortlog(text)
+
+
+@benchmark
+def contributor_properties(inputs):
+    contribs = inputs.contributors()
+
+    def func():
+        for c in contribs:
+            c.name, c.email, c.names, c.emails
+            c.timezone_counts, c.shas_by_email
+
+    return func
+
+
+@benchmark
+def repo_contributors(inputs):
+    repo = inputs.repo
+    return repo.contributors
+
+
+@benchmark
+def merge_prs(inputs):
+    repo = inputs.repo
+
+    def func():
+        repo._merge_prs = None
+        return repo.merge_prs
+
+    return func
+
+
+@benchmark
+def identity_index(inputs):
+    known = [c for cs in inputs.contrib_map.values() for c in cs]
+
+    def func():
+        index = IdentityIndex()
+        for c in known:
+            index.add(c, c.gh_user)
+        return [index.lookup(c) for c in known]
+
+    return func
+
+
+@benchmark
+def location2country(inputs):
+    locations = inputs.locations
+
+    def func():
+        # Cold cache, in memory.
+        saved = cc.LOCATION_CACHE
+        cc.LOCATION_CACHE = cc.LocationCache(
+            cc.resolve_location, {}, lambda: 'bench')
+        try:
+            return [cc.location2country(L) for L in locations]
+        finally:
+            cc.LOCATION_CACHE = saved
+
+    return func
+
+
+@benchmark
+def locations2countries(inputs):
+    locations = pd.Series(inputs.locations, dtype=object)
+
+    def func():
+        # Cold cache, in memory, resolving all locations in one pass.
+        saved = cc.LOCATION_CACHE
+        cc.LOCATION_CACHE = cc.LocationCache(
+            cc.resolve_location, {}, lambda: 'bench',
+            batch_func=cc.resolve_locations)
+        try:
+            return list(cc.locations2countries(locations))
+        finally:
+            cc.LOCATION_CACHE = saved
+
+    return func
+
+
+@benchmark
+def find_country(inputs):
+    candidates = inputs.country_candidates
+    return lambda: [cc.find_country(c) for c in candidates]
+
+
+@benchmark
+def df2gh_map_users(inputs):
+    users = inputs.users
+    return lambda: df2gh_map(users)
+
+
+@benchmark
+def save_all_users(inputs):
+    contrib_map = inputs.contrib_map
+    for contribs in contrib_map.values():
+        for c in contribs:
+            c.name, c.email
+
+    def func():
+        with TemporaryDirectory() as tmpdir:
+            save_all(contrib_map, pjoin(tmpdir, 'gh_user_map.csv'))
+
+    return func
+
+
+@benchmark
+def commit_analysis(inputs):
+    users = inputs.users
+    country_data = cc.country_data
+    return lambda: ca.country_table(ca.by_country(ca.by_gh_user(users)),
+                                    country_data)
+
+
+def run_benchmark(func_maker, inputs, repeat=3):
+    """ Best time over `repeat` runs, and peak memory in bytes, for benchmark
+    """
+    times = []
+    for i in range(repeat):
+        func = func_maker(inputs)
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    func = func_maker(inputs)
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'time': min(times), 'times': times, 'peak': peak}
+
+
+def run_benchmarks(scale, names=None, repeat=3, inputs=None):
+    """ Dict of results for benchmarks `names` (default all) at `scale`
+    """
+    inputs = Inputs(**SCALES[scale]) if inputs is None else inputs
+    names = list(BENCHMARKS) if names is None else names
+    results = {}
+    for name in names:
+        # Make inputs outside timing, and memory tracing.
+        BENCHMARKS[name](inputs)
+        results[name] = run_benchmark(BENCHMARKS[name], inputs, repeat)
+        print(f'{name}: {results[name]["time"]:.3f}s, '
+              f'{results[name]["peak"] / 2 ** 20:.1f} MiB')
+    return results
+
+
+def results_fname(sha7):
+    return pjoin(RESULTS_DIR, f'{sha7}.json')
+
+
+def load_results(sha7):
+    fname = results_fname(sha7)
+    if not exists(fname):
+        return {}
+    with open(fname, 'rt') as fobj:
+        return json.load(fobj)
+
+
+def save_results(scale, results, sha7=None):
+    """ Merge `results` for `scale` into results file for commit `sha7`
+    """
+    sha7 = get_sha7(cwd=ROOT) if sha7 is None else sha7
+    all_results = load_results(sha7)
+    dirty = bool(check_output(
+        ['git', 'status', '--porcelain', '--untracked-files=no'],
+        cwd=ROOT, text=True).strip())
+    all_results.setdefault(scale, {}).update(
+        {name: dict(result, dirty=dirty) for name, result in results.items()})
+    makedirs(RESULTS_DIR, exist_ok=True)
+    with open(results_fname(sha7), 'wt') as fobj:
+        json.dump(all_results, fobj, indent=2)
+    return sha7
+
+
+def compare(scale, results, other_sha7):
+    """ Table comparing `results` with results at commit `other_sha7`
+    """
+    other = load_results(other_sha7).get(scale, {})
+    rows = []
+    for name, result in results.items():
+        row = [name, result['time'], result['peak'] / 2 ** 20]
+        if name in other:
+            row += [other[name]['time'], other[name]['peak'] / 2 ** 20,
+                    result['time'] / other[name]['time']]
+        rows.append(row)
+    return tabulate(rows,
+                    headers=['Benchmark', 'Time (s)', 'Peak (MiB)',
+                             f'{other_sha7} time', f'{other_sha7} peak',
+                             'Time ratio'],
+                    tablefmt='pipe',
+                    floatfmt='0.3f')
+
+
+def get_parser():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-s', '--scale', choices=list(SCALES),
+                        default='small', help='Size of synthetic inputs')
+    parser.add_argument('-b', '--benchmark', action='append',
+                        choices=list(BENCHMARKS), dest='names',
+                        help='Benchmark to run (default all); can repeat')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Number of timed runs; report best')
+    parser.add_argument('--compare', metavar='SHA7',
+                        help='Compare with stored results for this commit')
+    parser.add_argument('--no-save', action='store_true',
+                        help='Do not store results')
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    results = run_benchmarks(args.scale, args.names, args.repeat)
+    # Compare before saving, in case we are comparing with this commit.
+    if args.compare:
+        print(compare(args.scale, results, args.compare))
+    if not args.no_save:
+        sha7 = save_results(args.scale, results)
+        print(f'Saved results for {sha7}')
+
+
+if __name__ == '__main__':
+    main()
@@ -5,48 +5,61 @@ import pandas as pd
 
 from tabulate import tabulate
 
-# Load user data
-users = pd.read_csv('users_locations.csv')
-users.head()
-
-# Load country data
-country_data = pd.read_csv('country_data.csv')
-
-# Aggregate over Github user:
 
 def aggregate_user(sub_df):
-    first = sub_df.iloc[0]
+    """ Aggregate rows for one Github user over repositories
+    """
     out = sub_df.iloc[0][['name', 'country_code']]
     out['n_commits'] = sub_df['n_commits'].sum()
     out['repos'] = '; '.join(f"{row['repo']}: {row['n_commits']}"
                     for i, row in sub_df.iterrows())
     return out
 
-by_gh_user = users.groupby('gh_user').apply(aggregate_user)
-by_gh_user = by_gh_user.sort_values('n_commits', ascending=False)
-
-by_country = (by_gh_user.groupby('country_code').sum()
-              .sort_values('n_commits', ascending=False))
-
-# Merge population in millions.
-population = country_data[['country_code', 'country_name', 'population']]
-by_country_pop = by_country.merge(population, on='country_code')
-by_country_pop = by_country_pop[
-    ['country_name', 'n_commits', 'population']]
-
-# Calculate commits per million in population
-by_country_pop['commits_per_million'] = (by_country_pop['n_commits'] /
-                                         by_country_pop['population'])
-
-# Top 10 countries by commit numbers, ordered by commits per million.
-by_country_pop = (by_country_pop
-                  .head(10)
-                  .sort_values('commits_per_million', ascending=False))
-
-# Make nice Markdown table therefrom
-tab = tabulate(by_country_pop,
-         headers='Country,Commits,Population (millions),Commits/million'.split(','),
-         tablefmt='pipe', 
-         floatfmt='0.1f',
-        showindex=False)
-print(tab)
+
+def by_gh_user(users):
+    """ Aggregate `users` over Github user, sorted by number of commits
+    """
+    out = users.groupby('gh_user').apply(aggregate_user)
+    return out.sort_values('n_commits', ascending=False)
+
+
+def by_country(user_commits):
+    """ Commits per country from :func:`by_gh_user` output `user_commits`
+    """
+    return (user_commits.groupby('country_code')[['n_commits']].sum()
+            .sort_values('n_commits', ascending=False))
+
+
+def country_table(country_commits, country_data, n=10):
+    """ Top `n` countries by commits, ordered by commits per million
+    """
+    # Merge population in millions.
+    population = country_data[['country_code', 'country_name', 'population']]
+    by_country_pop = country_commits.merge(population, on='country_code')
+    by_country_pop = by_country_pop[
+        ['country_name', 'n_commits', 'population']]
+    # Calculate commits per million in population
+    by_country_pop['commits_per_million'] = (by_country_pop['n_commits'] /
+                                             by_country_pop['population'])
+    return (by_country_pop
+            .head(n)
+            .sort_values('commits_per_million', ascending=False))
+
+
+def main():
+    # Load user data
+    users = pd.read_csv('users_locations.csv')
+    # Load country data
+    country_data = pd.read_csv('country_data.csv')
+    table = country_table(by_country(by_gh_user(users)), country_data)
+    # Make nice Markdown table therefrom
+    tab = tabulate(table,
+             headers='Country,Commits,Population (millions),Commits/million'.split(','),
+             tablefmt='pipe',
+             floatfmt='0.1f',
+            showindex=False)
+    print(tab)
+
+
+if __name__ == '__main__':
+    main()
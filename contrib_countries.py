@@ -2,7 +2,13 @@
 """
 
 import re
+import json
+import asyncio
 import github3
+from os.path import exists, join as pjoin
+from hashlib import sha1
+from collections import OrderedDict
+from argparse import ArgumentParser
 from subprocess import check_call
 from pprint import pprint
 
@@ -10,11 +16,24 @@ import numpy as np
 
 import pandas as pd
 
-from gputils import (GH, lupdate, gh_user2ev_emails, get_last_gh_users,
-                     RepoGetter, UserGetter)
+from gazetteer import fold, load_gazetteer, GEONAMES_DIR
+from kvstore import SQLiteStore
+from gputils import (get_gh, lupdate, get_last_gh_users,
+                     RepoGetter, UserGetter, REPO_CACHE_DIR, AsyncGitHub,
+                     run_sync)
+
+# Maximum number of Github profiles to fetch at the same time.
+DEFAULT_MAX_CONCURRENCY = 8
 
 # Country data from various sources.  See process_countries.py
-country_data = pd.read_csv('country_data.csv')
+COUNTRY_DATA_FNAME = 'country_data.csv'
+country_data = pd.read_csv(COUNTRY_DATA_FNAME)
+
+# Database for cache of location to country results.
+LOCATION_CACHE_FNAME = '.location_cache.sqlite'
+
+# Increase when changing the code of `resolve_location`, to clear old results.
+LOCATION_CODE_VERSION = 2
 
 # Variables as shortcuts
 COUNTRY_NAMES = country_data['country_name']
@@ -848,6 +867,76 @@ COUNTRY_REGEXPS = (
 )
 
 
+def required_literal(regex):
+    """ Text that must be in string matching `regex`, or None if unknown
+
+    Handles patterns from :func:`tw`, and plain text, with optional ``$``.
+    """
+    prefix, suffix = tw('\0').split('\0')
+    if regex.startswith(prefix) and regex.endswith(suffix):
+        regex = regex[len(prefix):-len(suffix)]
+    elif regex.endswith('$'):
+        regex = regex[:-1]
+    return regex if re.escape(regex).replace('\\ ', ' ') == regex else None
+
+
+class LocationMatcher:
+    """ Find first matching rule for location strings
+
+    `rules` is a sequence of (regex, country) pairs.  We compile each regex
+    once, and find the text each regex needs, if we can.  For each location,
+    we run only the regexes for which the needed text is present, in rule
+    order.  The first rule, in list order, that matches anywhere in the
+    string, wins, as for running ``re.search`` for each rule in turn.
+    """
+
+    def __init__(self, rules):
+        self.rules = tuple(rules)
+        self._checks = [(required_literal(reg), re.compile(reg))
+                        for reg, country in self.rules]
+
+    def rule_index(self, location):
+        """ Index of first rule matching `location`, or None
+        """
+        for i, (literal, regex) in enumerate(self._checks):
+            if literal is not None and literal not in location:
+                continue
+            if regex.search(location):
+                return i
+
+    def __call__(self, location):
+        """ Country for first rule matching `location`, or None
+        """
+        index = self.rule_index(location)
+        return None if index is None else self.rules[index][1]
+
+    def rule_series(self, locations):
+        """ Index of first matching rule for each value in `locations`
+
+        `locations` is a pandas Series of strings or None.  We match each
+        distinct location once.  Values are None where no rule matches.
+        """
+        uniques = locations.dropna().unique()
+        indices = dict(zip(uniques, map(self.rule_index, uniques)))
+        return pd.Series([indices.get(L) for L in locations],
+                         index=locations.index, dtype=object)
+
+    def match_series(self, locations):
+        """ Country for first matching rule for each value in `locations`
+
+        `locations` is a pandas Series of strings or None.  We match each
+        distinct location once.
+        """
+        countries = [country for reg, country in self.rules]
+        indices = self.rule_series(locations)
+        return pd.Series([None if i is None else countries[i]
+                          for i in indices], index=indices.index,
+                         dtype=object)
+
+
+LOCATION_MATCHER = LocationMatcher(COUNTRY_REGEXPS)
+
+
 def location2countrish(location):
     """ Get last word as first guess at country from location string
     """
@@ -861,33 +950,269 @@ def location2countrish(location):
     return last
 
 
-def location2country(location):
-    """ Estimate country from location string
+def normalize_location(location):
+    """ Location with single spaces, and no leading or trailing spaces
     """
-    if location is None:
-        return None
-    for reg, country in COUNTRY_REGEXPS:
-        if re.search(reg, location):
-            return country
+    return ' '.join(location.split())
+
+
+def resolve_location(location):
+    """ Estimate country from location string, and say how we found it
+
+    Try `COUNTRY_REGEXPS`, then the last part of the location as a country,
+    then place names in the last part of the location, from the offline
+    gazetteer.  We only use the gazetteer if it has GeoNames cities or
+    regions; country names alone too often match other things, as in
+    "Chad Smith" or "Lebanon, NH".
+
+    Returns
+    -------
+    country : str or None
+        ISO 3-letter country code, 'N/K' or 'N/A', or None if not found.
+    rule : str or None
+        Regular expression from `COUNTRY_REGEXPS` that matched, or 'country'
+        for a country in the last part of the location, or 'gazetteer', or
+        None if not found.
+    """
+    index = LOCATION_MATCHER.rule_index(location)
+    if index is not None:
+        return COUNTRY_REGEXPS[index][1], COUNTRY_REGEXPS[index][0]
     country = location2countrish(location)
     if country in ('N/K', 'N/A'):
-        return country
+        return country, 'country'
     found = find_country(country)
     if found:
-        return found
+        return found, 'country'
+    gazetteer = get_gazetteer()
+    found = gazetteer(country) if gazetteer.has_places else None
+    return (found, 'gazetteer') if found else (None, None)
+
+
+def resolve_locations(locations):
+    """ Country and rule for each location in pandas Series `locations`
+
+    As for :func:`resolve_location`, but running each step once over all
+    locations still unresolved, using :meth:`LocationMatcher.rule_series`,
+    :meth:`CountryResolver.resolve` and :meth:`gazetteer.Gazetteer.resolve`.
+
+    Returns list of (country, rule) pairs, one per value in `locations`.
+    """
+    locations = locations.astype(object)
+    countries = pd.Series([None] * len(locations), index=locations.index,
+                          dtype=object)
+    rules = countries.copy()
+    indices = LOCATION_MATCHER.rule_series(locations)
+    matched = indices.notna()
+    countries[matched] = [COUNTRY_REGEXPS[i][1] for i in indices[matched]]
+    rules[matched] = [COUNTRY_REGEXPS[i][0] for i in indices[matched]]
+    last = locations[~matched & locations.notna()].map(location2countrish)
+    found = COUNTRY_RESOLVER.resolve(last)
+    unknown = last.isin(['N/K', 'N/A'])
+    found[unknown] = last[unknown]
+    is_found = found.notna()
+    countries[found.index[is_found]] = found[is_found]
+    rules[found.index[is_found]] = 'country'
+    gazetteer = get_gazetteer()
+    if gazetteer.has_places:
+        found = gazetteer.resolve(last[~is_found])
+        is_found = found.notna()
+        countries[found.index[is_found]] = found[is_found]
+        rules[found.index[is_found]] = 'gazetteer'
+    return list(zip(countries, rules))
+
+
+def location_fingerprint(fnames=None):
+    """ Hash of rules and data files determining location results
+
+    `fnames` default to the country data, and the files for the gazetteer.
+    """
+    if fnames is None:
+        fnames = [COUNTRY_DATA_FNAME, 'pop_surface.csv',
+                  'un_stats_division_countries.csv'] + [
+                      pjoin(GEONAMES_DIR, fname) for fname in
+                      ('countryInfo.txt', 'admin1CodesASCII.txt',
+                       'cities15000.txt')]
+    hasher = sha1(json.dumps([LOCATION_CODE_VERSION, COUNTRY_REGEXPS,
+                              EXTRA_COUNTRIES]).encode())
+    for fname in fnames:
+        hasher.update(fname.encode())
+        if exists(fname):
+            with open(fname, 'rb') as fobj:
+                hasher.update(fobj.read())
+    return hasher.hexdigest()
+
+
+class LocationCache:
+    """ Memoize function of location, in memory and in persistent store
+
+    Keep up to `maxsize` most recently used results in memory, and all
+    results in `store`, a mapping such as :class:`kvstore.SQLiteStore`.  Key
+    results by normalized location (see :func:`normalize_location`).  On
+    first use, we clear `store` if `fingerprint()` has changed since we
+    filled it.  If not None, `batch_func` takes a pandas Series of locations
+    and returns a result for each, for :meth:`resolve`.
+    """
+
+    # Key for fingerprint; normalized locations do not start with space.
+    fingerprint_key = ' fingerprint'
+
+    def __init__(self, func, store, fingerprint, maxsize=10000,
+                 batch_func=None):
+        self.func = func
+        self.store = store
+        self.fingerprint = fingerprint
+        self.maxsize = maxsize
+        self.batch_func = batch_func
+        self._lru = OrderedDict()
+        self._checked = False
+
+    def _check_store(self):
+        if self._checked:
+            return
+        self._checked = True
+        fingerprint = self.fingerprint()
+        if self.store.get(self.fingerprint_key) != fingerprint:
+            self.store.clear()
+            self.store[self.fingerprint_key] = fingerprint
+
+    def __call__(self, location):
+        key = normalize_location(location)
+        if key in self._lru:
+            self._lru.move_to_end(key)
+            return self._lru[key]
+        self._check_store()
+        value = self.store.get(key)
+        if value is None:
+            value = self.func(key)
+            self.store[key] = value
+        value = tuple(value)
+        self._lru[key] = value
+        if len(self._lru) > self.maxsize:
+            self._lru.popitem(last=False)
+        return value
+
+    def resolve(self, locations):
+        """ Result for each value in pandas Series `locations`
+
+        Look up each distinct location once.  Compute all results missing
+        from `store` in one call to `batch_func`, if set.  Values are None
+        for missing locations.
+        """
+        self._check_store()
+        keys = locations.dropna().map(normalize_location)
+        results = {}
+        missing = []
+        for key in keys.unique():
+            value = self.store.get(key)
+            if value is None:
+                missing.append(key)
+            else:
+                results[key] = tuple(value)
+        if missing:
+            values = (map(self.func, missing) if self.batch_func is None
+                      else self.batch_func(pd.Series(missing, dtype=object)))
+            new = {key: tuple(value) for key, value in zip(missing, values)}
+            self.store.update(new)
+            results.update(new)
+        out = pd.Series([results[key] for key in keys], index=keys.index,
+                        dtype=object).reindex(locations.index)
+        return out.where(out.notna(), None)
+
+    def clear(self):
+        self._lru.clear()
+        self.store.clear()
+        self._checked = False
+
+
+LOCATION_CACHE = LocationCache(
+    resolve_location,
+    SQLiteStore(LOCATION_CACHE_FNAME, 'locations'),
+    location_fingerprint,
+    batch_func=resolve_locations)
+
+
+def location2country(location):
+    """ Estimate country from location string
+
+    See :func:`resolve_location`.  We remember results for each location,
+    between runs; see :class:`LocationCache`.
+    """
+    if location is None:
+        return None
+    return LOCATION_CACHE(location)[0]
+
+
+def locations2countries(locations):
+    """ Estimate country for each location string in pandas Series `locations`
+
+    As for :func:`location2country`, but resolving all new locations in one
+    pass; see :func:`resolve_locations`.
+    """
+    values = LOCATION_CACHE.resolve(locations)
+    return pd.Series([None if value is None else value[0]
+                      for value in values], index=values.index, dtype=object)
+
+
+class CountryResolver:
+    """ Map country codes and names to ISO 3-letter country codes
+
+    We first look for an exact match to an ISO code, then a country name,
+    then a key in `extra`, a dict mapping other names to codes.  Failing
+    that, we match names and `extra` keys ignoring case, accents and
+    repeated spaces (see :func:`fold`).
+    """
+
+    def __init__(self, codes, names, extra=None):
+        extra = {} if extra is None else extra
+        self._exact = {}
+        self._folded = {}
+        named = list(zip(names, codes)) + list(extra.items())
+        for key, code in list(zip(codes, codes)) + named:
+            self._exact.setdefault(key, code)
+        for key, code in named:
+            self._folded.setdefault(fold(key), code)
+
+    def __call__(self, candidate):
+        """ Country code for `candidate` string, or None
+        """
+        if not isinstance(candidate, str):
+            return None
+        code = self._exact.get(candidate)
+        return self._folded.get(fold(candidate)) if code is None else code
+
+    def resolve(self, candidates):
+        """ Country codes for pandas Series `candidates`, None if not found
+        """
+        codes = candidates.map(self._exact)
+        missing = codes.isna() & candidates.notna()
+        folded = candidates[missing].drop_duplicates()
+        codes[missing] = candidates[missing].map(
+            dict(zip(folded, map(self, folded))))
+        return codes.astype(object).where(codes.notna(), None)
+
+
+COUNTRY_RESOLVER = CountryResolver(COUNTRY_CODES, COUNTRY_NAMES,
+                                   EXTRA_COUNTRIES)
+
+
+# Objects we load on first use.
+_STATE = {}
+
+
+def get_gazetteer():
+    """ Offline gazetteer, loaded on first use
+
+    See :func:`gazetteer.load_gazetteer`.
+    """
+    if 'gazetteer' not in _STATE:
+        _STATE['gazetteer'] = load_gazetteer(country_data, EXTRA_COUNTRIES)
+    return _STATE['gazetteer']
 
 
 def find_country(candidate):
     """ Estimate country from `candidate` string
     """
-    is_iso = COUNTRY_CODES == candidate
-    if np.any(is_iso):
-        return COUNTRY_CODES.loc[is_iso].item()
-    is_country = COUNTRY_NAMES == candidate
-    if np.any(is_country):
-        return COUNTRY_CODES.loc[is_country].item()
-    if candidate in EXTRA_COUNTRIES:
-        return EXTRA_COUNTRIES[candidate]
+    return COUNTRY_RESOLVER(candidate)
 
 
 def gh_user2location(gh_user):
@@ -920,7 +1245,44 @@ def gh_user2country(gh_user):
     return country
 
 
-REPO_GETTER = RepoGetter()
+def prefetch_users(gh_users, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+    """ Fetch Github data for `gh_users` into ``USER_GETTER``, concurrently
+
+    Skip users with locations in ``GH_USER2LOCATION``.
+    """
+    to_fetch = [u for u in gh_users if u not in GH_USER2LOCATION]
+    run_sync(AsyncGitHub(max_concurrency).map(USER_GETTER, to_fetch))
+
+
+def locate_users(gh_users, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+    """ Location and country for each Github user in Series `gh_users`
+
+    Fetch data for each distinct user once, concurrently, then find the
+    countries for all distinct locations in one pass (see
+    :func:`locations2countries`).  Print helpful information for missing
+    locations or invalid countries, as for :func:`gh_user2country`.
+
+    Returns
+    -------
+    locations : Series
+        Location string for each value in `gh_users`.
+    countries : Series
+        Country code for each value in `gh_users`.
+    """
+    uniques = gh_users.dropna().unique()
+    prefetch_users(uniques, max_concurrency)
+    user_locations = pd.Series([gh_user2location(u) for u in uniques],
+                               index=uniques, dtype=object)
+    user_countries = locations2countries(user_locations)
+    for gh_user, location in user_locations.items():
+        if location is None:
+            print(f'{gh_user} has no location')
+        elif user_countries[gh_user] is None:
+            print(f'{gh_user} has location {location} but no country')
+    return gh_users.map(user_locations), gh_users.map(user_countries)
+
+
+REPO_GETTER = RepoGetter(REPO_CACHE_DIR)
 
 USER_GETTER = UserGetter('.user_cache.json')
 
@@ -982,47 +1344,57 @@ class FieldDict(dict):
         return '\n'.join(lines)
 
 
+def gh_pages_repo(gh_user, ext):
+    """ Name of Github Pages repository for `gh_user`, or None if none
+    """
+    repo = f'{gh_user}.github.{ext}'
+    try:
+        get_gh().repository(gh_user, repo)
+    except github3.exceptions.NotFoundError:
+        return None
+    return repo
+
+
+async def fetch_report_data(gh_user):
+    """ Fetch Github data for :func:`user_report` concurrently
+    """
+    agh = AsyncGitHub()
+    return await asyncio.gather(
+        agh.run(USER_GETTER, gh_user),
+        agh.run(gh_pages_repo, gh_user, 'io'),
+        agh.run(gh_pages_repo, gh_user, 'com'),
+        agh.gh_user2ev_emails(gh_user))
+
+
 def user_report(gh_user, user_df, browser=False):
     """ Report available data for `gh_user`, maybe open relevant pages
 
     Prints information to console.  If `browser==True` then open the user's
-    Github page in the browser, and any detected Github Pages site.
+    Github page in the browser, and any detected Github Pages site.  From
+    async code, use :func:`fetch_report_data` directly for the Github data.
     """
     if gh_user is None or gh_user.startswith('+'):
         print(f'Invalid gh_user {gh_user}')
         return
+    gh_data, *pages, ev_emails = run_sync(fetch_report_data(gh_user))
     user_data = FieldDict()
-    gh_data = USER_GETTER(gh_user)
     if gh_data:
         lupdate(user_data, gh_data)
     print(user_data)
-    # Get repository data
-    # Add to user_data
-    gh_pages = []
-    for ext in ('io', 'com'):
-        repo = f'{gh_user}.github.{ext}'
-        try:
-            GH.repository(gh_user, repo)
-        except github3.exceptions.NotFoundError:
-            pass
-        else:
-            gh_pages.append(repo)
+    gh_pages = [repo for repo in pages if repo is not None]
     print('GH pages:')
     for ghp in gh_pages:
         print(f'    {ghp}')
     print('GH event emails:')
-    pprint(dict(gh_user2ev_emails(gh_user).items()))
+    pprint(dict(ev_emails.items()))
     print('Repository data')
     user_rows = user_df[user_df['gh_user'] == gh_user]
     for i in range(len(user_rows)):
         row = user_rows.iloc[i]
         repo_name = row['repo']
         print(f'For {repo_name}:')
-        name = row['name']
-        contribs = [c for c in REPO_GETTER.get_contributors(repo_name)
-                    if c.name == name]
-        assert len(contribs) == 1
-        contrib = contribs[0]
+        contrib = REPO_GETTER.find_contributor(repo_name, row['name'])
+        assert contrib is not None
         print(f'N commits: {len(contrib)}')
         print('Names:')
         print('\n'.join(contrib.names))
@@ -1033,24 +1405,51 @@ def user_report(gh_user, user_df, browser=False):
     if browser:
         check_call(['open', f'https://github.com/{gh_user}'])
         for ghp in gh_pages:
-            check_call(['open', 'https:' + gh_pages[0]])
+            check_call(['open', f'https://{ghp}'])
+
+
+def get_parser():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--refresh-oldest',
+        type=int,
+        default=0,
+        metavar='N',
+        help='Refresh stale Github data for up to N users, oldest first')
+    parser.add_argument(
+        '--refresh',
+        nargs='+',
+        default=[],
+        metavar='GH_USER',
+        help='Refresh Github data for these users')
+    parser.add_argument(
+        '-c', '--max-concurrency',
+        type=int,
+        default=DEFAULT_MAX_CONCURRENCY,
+        help='Maximum number of Github profiles to fetch at the same time')
+    return parser
 
 
 def main():
+    args = get_parser().parse_args()
+    # Refresh some cached user data; stale data refresh in the background
+    # as we use them.
+    USER_GETTER.refresh_oldest(args.refresh_oldest)
+    USER_GETTER.refresh(args.refresh)
+
     # Read estimated Github usernames and other user data.
     users = pd.read_csv(get_last_gh_users())
 
-    # Get location from manual input, or from Github user profiles.
-    users['location'] = users['gh_user'].apply(gh_user2location)
-    # Estimate country from the location data.  The function will print helpful
-    # information for missing locations or invalid countries.
-    users['country_code'] = users['gh_user'].apply(gh_user2country)
+    # Get location from manual input, or from Github user profiles, and
+    # estimate country from the location data.  The function will print
+    # helpful information for missing locations or invalid countries.
+    users['location'], users['country_code'] = locate_users(
+        users['gh_user'], args.max_concurrency)
 
     # Write country data to CSV
     users.to_csv('users_locations.csv', index=False)
-    # Save cached Github user data, to save Github queries.
-    USER_GETTER.save_cache()
-
+    # Let background refreshes finish, for next run.
+    USER_GETTER.wait()
     # Generate report for first user without country
     # This allows me to re-run the file from IPython, to review date for users with
     # missing countries, and edit the GH_USER2LOCATION data.
@@ -3,15 +3,28 @@
 See the `guess_gh_user` method of :class:`RepoContributor` for the algorithm.
 """
 
+import asyncio
+import inspect
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
 
 import pandas as pd
 
-from gputils import (Repo, REPO2ORG, merge_dicts, update_subdicts, get_sha7,
-                     get_last_gh_users)
+from gputils import (RepoGetter, REPO2ORG, REPO_CACHE_DIR, merge_dicts,
+                     update_subdicts, get_sha7, get_last_gh_users,
+                     guess_gh_users, compact_contributors, AsyncGitHub,
+                     IdentityResolver)
 
 DEFAULT_MIN_COMMITS=25
 
+# Maximum number of contributors to look up on Github at the same time.
+DEFAULT_MAX_CONCURRENCY=8
+
+# Number of processes parsing repositories at the same time.
+DEFAULT_WORKERS=4
+
+REPO_GETTER = RepoGetter(REPO_CACHE_DIR)
+
 
 # For contributors where automated detection of Github user fails.
 # Name via mailmap from git shortlog
@@ -195,29 +208,118 @@ merge_dicts(NAME2GH_USER['scipy'], NAME2GH_USER['numpy'])
 merge_dicts(NAME2GH_USER['numpy'], NAME2GH_USER['scipy'])
 
 
-def contributors_for(repo_name, org_name=None,
-                     start_from=None,
-                     min_commits=DEFAULT_MIN_COMMITS):
+def repo_contributors(repo_name, org_name=None,
+                      min_commits=DEFAULT_MIN_COMMITS):
+    """ Contributors to `repo_name` with at least `min_commits` commits
+    """
+    contribs = REPO_GETTER.get_contributors(repo_name, org_name)
+    return [c for c in contribs if len(c) >= min_commits]
+
+
+def _parse_repo(repo_name, org_name, min_commits):
+    # Run in worker process; return compact table for pickling.
+    return compact_contributors(
+        repo_contributors(repo_name, org_name, min_commits))
+
+
+def set_known_gh_users(contribs, repo_name, start_from=None, index=None):
+    """ Set `gh_user` for `contribs` from known mappings
+
+    Known mappings are those in `start_from`, and ``NAME2GH_USER``.  Add
+    contributors with known Github users to :class:`IdentityIndex` `index`.
+
+    Returns list of contributors with no known Github user.
+    """
     start_from = {} if start_from is None else start_from
     update_subdicts(start_from, NAME2GH_USER)
-    repo = Repo(repo_name, org_name)
-    contribs = repo.contributors()
-    contribs = [c for c in contribs if len(c) >= min_commits]
     repo_map = start_from.get(repo_name, {})
     for c in contribs:
         c.gh_user = repo_map.get(c.name)
-        if c.gh_user is None:
-            c.gh_user = c.guess_gh_user()
+        if index is not None:
+            index.add(c, c.gh_user)
+    return [c for c in contribs if c.gh_user is None]
+
+
+def contributors_for(repo_name, org_name=None,
+                     start_from=None,
+                     min_commits=DEFAULT_MIN_COMMITS,
+                     max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                     index=None):
+    contribs = repo_contributors(repo_name, org_name, min_commits)
+    unknown = set_known_gh_users(contribs, repo_name, start_from, index)
+    if index is not None:
+        for c in unknown:
+            c.gh_user = index.lookup(c)
+        unknown = [c for c in unknown if c.gh_user is None]
+    for c, gh_user in zip(unknown, guess_gh_users(
+        unknown, max_concurrency=max_concurrency)):
+        c.gh_user = gh_user
+        if index is not None:
+            index.add(c, gh_user)
     return contribs
 
 
-def all_contributors(start_from=None, min_commits=DEFAULT_MIN_COMMITS):
-    all_contribs = {}
-    for repo_name in REPO2ORG:
-        all_contribs[repo_name] = contributors_for(repo_name,
-                                                   start_from=start_from,
-                                                   min_commits=min_commits)
-    return all_contribs
+async def resolve_all(contrib_map, start_from=None, resolver=None):
+    """ Set `gh_user` for contributors in dict `contrib_map`
+
+    Values in `contrib_map` are lists of contributors, or awaitables, such as
+    parsing futures, returning these lists.  We take each repository in
+    `contrib_map` order, as soon as it and all earlier repositories are
+    ready.  We set users known for the repository (see
+    :func:`set_known_gh_users`), and look up the rest with
+    :class:`IdentityResolver` `resolver`.  Last, we fill in users for
+    contributors matching identities found for later repositories.  The
+    result does not depend on the order in which repositories or lookups
+    finish.
+
+    Returns dict of repository name, contributor list pairs.
+    """
+    resolver = (IdentityResolver(AsyncGitHub()) if resolver is None
+                else resolver)
+    out = {}
+    for repo_name, contribs in contrib_map.items():
+        if inspect.isawaitable(contribs):
+            contribs = await contribs
+        unknown = set_known_gh_users(contribs, repo_name, start_from,
+                                     resolver.index)
+        for c, gh_user in zip(unknown,
+                              await resolver.guess_gh_users(unknown)):
+            c.gh_user = gh_user
+        out[repo_name] = contribs
+    for contribs in out.values():
+        for c in contribs:
+            if c.gh_user is None:
+                c.gh_user = resolver.index.lookup(c)
+    return out
+
+
+async def _pipeline(start_from, min_commits, workers, max_concurrency):
+    loop = asyncio.get_running_loop()
+    # One lookup stage, shared by all repositories.
+    resolver = IdentityResolver(AsyncGitHub(max_concurrency))
+    with ProcessPoolExecutor(workers) as pool:
+        # Look up users for each repository while later repositories parse.
+        return await resolve_all(
+            {repo_name: loop.run_in_executor(pool, _parse_repo, repo_name,
+                                             REPO2ORG[repo_name],
+                                             min_commits)
+             for repo_name in REPO2ORG}, start_from, resolver)
+
+
+def all_contributors(start_from=None, min_commits=DEFAULT_MIN_COMMITS,
+                     workers=DEFAULT_WORKERS,
+                     max_concurrency=DEFAULT_MAX_CONCURRENCY):
+    """ Contributors with Github users for all repositories
+
+    Parse repositories in `workers` processes.  As parsing finishes, look up
+    contributors in a shared Github lookup stage, running up to
+    `max_concurrency` lookups at a time.  The lookup stage shares Github
+    users between repositories, so we look up each person once, by email or
+    name, whichever repositories they contributed to.  Returns dict with
+    repositories in ``REPO2ORG`` order; see :func:`resolve_all`.
+    """
+    return asyncio.run(_pipeline(start_from, min_commits, workers,
+                                 max_concurrency))
 
 
 def save_all(contrib_map, fname=None):
@@ -256,13 +358,25 @@ def main():
         '-s', '--start-from',
         help='Path to CSV file with established mappings to start from'
         'or LAST to start from most recent in Git history')
+    parser.add_argument(
+        '-j', '--workers',
+        type=int,
+        default=DEFAULT_WORKERS,
+        help='Number of processes parsing repositories')
+    parser.add_argument(
+        '-c', '--max-concurrency',
+        type=int,
+        default=DEFAULT_MAX_CONCURRENCY,
+        help='Maximum number of Github lookups at the same time')
     args = parser.parse_args()
     start_from = args.start_from
     if start_from == 'LAST':
         start_from = get_last_gh_users()
     start_from = df2gh_map(start_from) if start_from else None
     repo_contribs = all_contributors(start_from=start_from,
-                                     min_commits=args.min_commits)
+                                     min_commits=args.min_commits,
+                                     workers=args.workers,
+                                     max_concurrency=args.max_concurrency)
     save_all(repo_contribs, fname=args.out_fname)
 
 
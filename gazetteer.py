@@ -0,0 +1,281 @@
+""" Offline gazetteer to find countries in free-text locations
+
+Build a :class:`Gazetteer` from place names, such as country names, and
+optionally cities and administrative regions from GeoNames
+(https://download.geonames.org/export/dump), and find the most likely
+country for a location string such as "Logan, Utah; USA".
+"""
+
+import re
+import unicodedata
+from collections import namedtuple, Counter
+from os.path import join as pjoin, exists
+
+import pandas as pd
+
+# Default directory for GeoNames files.
+GEONAMES_DIR = 'geonames'
+
+# Kinds of place.
+COUNTRY, ADMIN, CITY = 'country', 'admin', 'city'
+
+Place = namedtuple('Place', ('country_code', 'population', 'kind'))
+
+# Key for places ending at trie node; tokens are never empty.
+_PLACES = ''
+
+
+def fold(text):
+    """ Case-folded `text` without accents, and with single spaces
+    """
+    decomposed = unicodedata.normalize('NFKD', text)
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return ' '.join(stripped.casefold().split())
+
+
+def tokenize(text):
+    """ List of folded word tokens in `text`
+    """
+    return re.findall(r'\w+', fold(text))
+
+
+class Gazetteer:
+    """ Token trie of place names, giving candidate countries
+
+    Each node of the trie is a dict, keyed by token.  A node where a place
+    name ends has a list of :class:`Place` under key ``''``.
+
+    To resolve a location, we find the longest place name starting at each
+    token.  If we find names of regions, such as US states, we ignore names
+    that can only be countries, so "Lebanon, New Hampshire" is in the USA.
+    Otherwise, if we find names that can only be countries, the last one
+    wins; "Georgia" only decides the country if it is not also the name of a
+    region or city in the gazetteer.  Otherwise each matching place name
+    votes for its countries, sharing one vote between countries in
+    proportion to population.  For a place without population, we use the
+    population of its country (see :func:`load_country_populations`).
+
+    Parameters
+    ----------
+    country_populations : None or dict, optional
+        Population for each ISO 3-letter country code.
+    """
+
+    def __init__(self, country_populations=None):
+        self.country_populations = ({} if country_populations is None
+                                    else country_populations)
+        self._root = {}
+        self.n_names = 0
+        self.kind_counts = Counter()
+
+    def add(self, name, country_code, population=0, kind=CITY):
+        """ Add place `name` in country `country_code`
+        """
+        tokens = tokenize(name)
+        if not tokens:
+            return
+        node = self._root
+        for token in tokens:
+            node = node.setdefault(token, {})
+        places = node.setdefault(_PLACES, [])
+        place = Place(country_code, population, kind)
+        if place not in places:
+            places.append(place)
+            self.n_names += 1
+            self.kind_counts[kind] += 1
+
+    @property
+    def has_places(self):
+        """ True if gazetteer has names of cities or regions
+        """
+        return bool(self.kind_counts[CITY] or self.kind_counts[ADMIN])
+
+    def matches(self, location):
+        """ List of (start, stop, places) for longest names in `location`
+
+        `start` and `stop` index into the tokens of `location`.
+        """
+        tokens = tokenize(location)
+        out = []
+        start = 0
+        while start < len(tokens):
+            node = self._root
+            found = None
+            for i in range(start, len(tokens)):
+                node = node.get(tokens[i])
+                if node is None:
+                    break
+                if _PLACES in node:
+                    found = (start, i + 1, node[_PLACES])
+            if found is None:
+                start += 1
+                continue
+            out.append(found)
+            start = found[1]
+        return out
+
+    def _weight(self, place):
+        if place.population:
+            return place.population
+        return self.country_populations.get(place.country_code, 0)
+
+    def scores(self, location):
+        """ Dict of country code, score pairs for `location`
+        """
+        matches = self.matches(location)
+        # Names that can only be countries.
+        country_only = [places for _, _, places in matches
+                        if all(p.kind == COUNTRY for p in places)]
+        if any(p.kind == ADMIN for _, _, places in matches for p in places):
+            # Region names, as in "Lebanon, NH", outvote country names.
+            matches = [m for m in matches if m[2] not in country_only]
+        else:
+            countries = [places[0].country_code for places in country_only
+                         if len({p.country_code for p in places}) == 1]
+            if countries:
+                return {countries[-1]: 1.}
+        scores = {}
+        for _, _, places in matches:
+            weights = {}
+            for place in places:
+                code = place.country_code
+                weights[code] = max(weights.get(code, 0), self._weight(place))
+            total = sum(weights.values())
+            for code, weight in weights.items():
+                share = weight / total if total else 1 / len(weights)
+                scores[code] = scores.get(code, 0) + share
+        return scores
+
+    def __call__(self, location):
+        """ Most likely ISO 3-letter country code for `location`, or None
+        """
+        scores = self.scores(location)
+        if not scores:
+            return None
+        best = max(scores.values())
+        codes = [code for code, score in scores.items() if score == best]
+        return codes[0] if len(codes) == 1 else None
+
+    def resolve(self, locations):
+        """ Country codes for pandas Series `locations`
+
+        Resolve each distinct location once.
+        """
+        uniques = locations.dropna().unique()
+        codes = locations.map(dict(zip(uniques, map(self, uniques))))
+        return codes.astype(object).where(codes.notna(), None)
+
+
+def load_country_populations(pop_fname, un_fname):
+    """ Latest population for each ISO 3-letter country code
+
+    Parameters
+    ----------
+    pop_fname : str
+        UN population data, as in ``pop_surface.csv``.
+    un_fname : str
+        UN statistics division countries, with M49 and ISO codes, as in
+        ``un_stats_division_countries.csv``.
+
+    Returns
+    -------
+    populations : dict
+        Populations, keyed by country code.
+    """
+    pop_data = pd.read_csv(pop_fname,
+                           header=1,
+                           thousands=',',
+                           encoding='latin1')
+    pop_data = pop_data[
+        pop_data['Series'] == 'Population mid-year estimates (millions)']
+    latest = pop_data.sort_values('Year').groupby(
+        'Region/Country/Area')['Value'].last()
+    un_countries = pd.read_csv(un_fname, encoding='utf-8-sig')
+    m49_to_iso = dict(zip(un_countries['M49 Code'],
+                          un_countries['ISO-alpha3 Code']))
+    return {m49_to_iso[m49]: float(value) * 1e6
+            for m49, value in latest.items() if m49 in m49_to_iso}
+
+
+def add_countries(gazetteer, country_data, extra=None):
+    """ Add country names from `country_data` and dict `extra` to `gazetteer`
+
+    `country_data` is a data frame like ``country_data.csv``.  `extra` maps
+    other country names to codes.
+    """
+    for name, code in zip(country_data['country_name'],
+                          country_data['country_code']):
+        gazetteer.add(name, code, kind=COUNTRY)
+    for name, code in ({} if extra is None else extra).items():
+        gazetteer.add(name, code, kind=COUNTRY)
+
+
+def read_geonames_countries(fname):
+    """ Dict mapping ISO 2-letter to ISO 3-letter country codes
+
+    From GeoNames ``countryInfo.txt``.
+    """
+    iso2_to_iso3 = {}
+    with open(fname, 'rt', encoding='utf-8') as fobj:
+        for line in fobj:
+            if line.startswith('#'):
+                continue
+            fields = line.rstrip('\n').split('\t')
+            iso2_to_iso3[fields[0]] = fields[1]
+    return iso2_to_iso3
+
+
+def add_geonames_cities(gazetteer, fname, iso2_to_iso3, min_population=0):
+    """ Add cities from GeoNames file `fname`, such as ``cities15000.txt``
+
+    Add name and ASCII name of each city, but not alternate names, which
+    are noisy.
+    """
+    with open(fname, 'rt', encoding='utf-8') as fobj:
+        for line in fobj:
+            fields = line.rstrip('\n').split('\t')
+            code = iso2_to_iso3.get(fields[8])
+            population = int(fields[14] or 0)
+            if code is None or population < min_population:
+                continue
+            for name in {fields[1], fields[2]}:
+                gazetteer.add(name, code, population, CITY)
+
+
+def add_geonames_admin1(gazetteer, fname, iso2_to_iso3):
+    """ Add regions from GeoNames ``admin1CodesASCII.txt`` file `fname`
+    """
+    with open(fname, 'rt', encoding='utf-8') as fobj:
+        for line in fobj:
+            fields = line.rstrip('\n').split('\t')
+            code = iso2_to_iso3.get(fields[0].split('.')[0])
+            if code is None:
+                continue
+            for name in {fields[1], fields[2]}:
+                gazetteer.add(name, code, 0, ADMIN)
+
+
+def load_gazetteer(country_data, extra=None,
+                   pop_fname='pop_surface.csv',
+                   un_fname='un_stats_division_countries.csv',
+                   geonames_dir=GEONAMES_DIR,
+                   min_population=0):
+    """ Build gazetteer from country data, and GeoNames files if present
+
+    Use ``countryInfo.txt``, ``cities15000.txt`` and ``admin1CodesASCII.txt``
+    from `geonames_dir`, where these exist.
+    """
+    gazetteer = Gazetteer(load_country_populations(pop_fname, un_fname))
+    add_countries(gazetteer, country_data, extra)
+    info_fname = pjoin(geonames_dir, 'countryInfo.txt')
+    if not exists(info_fname):
+        return gazetteer
+    iso2_to_iso3 = read_geonames_countries(info_fname)
+    admin1_fname = pjoin(geonames_dir, 'admin1CodesASCII.txt')
+    if exists(admin1_fname):
+        add_geonames_admin1(gazetteer, admin1_fname, iso2_to_iso3)
+    cities_fname = pjoin(geonames_dir, 'cities15000.txt')
+    if exists(cities_fname):
+        add_geonames_cities(gazetteer, cities_fname, iso2_to_iso3,
+                            min_population)
+    return gazetteer
@@ -0,0 +1,296 @@
+""" Transport layer for Github requests
+
+Mount :class:`GitHubAdapter` on a ``requests`` session, such as the session of
+a github3 ``GitHub`` object, to send all requests through a shared
+:class:`RateLimitScheduler`, and optionally an :class:`HTTPCache`.
+"""
+
+import time
+import threading
+from base64 import b64encode, b64decode
+
+from requests.adapters import HTTPAdapter
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+
+
+def url_resource(url):
+    """ Github rate limit resource for request to `url`
+    """
+    path = url.split('?')[0].rstrip('/')
+    if path.endswith('/graphql'):
+        return 'graphql'
+    if '/search/' in path:
+        return 'search'
+    return 'core'
+
+
+def is_rate_limited(response):
+    """ True if `response` says we have hit a primary or secondary rate limit
+    """
+    if response.status_code not in (403, 429):
+        return False
+    headers = response.headers
+    return ('Retry-After' in headers or
+            headers.get('X-RateLimit-Remaining') == '0' or
+            b'rate limit' in response.content.lower())
+
+
+class RateLimitScheduler:
+    """ Choose tokens and pace requests to stay within Github rate limits
+
+    We track the remaining budget for each token and rate limit resource
+    (``core``, ``graphql``, ``search``) from the ``X-RateLimit-*`` response
+    headers.  Each request goes to the token with the soonest free slot.
+    While a token has more than `pace_below` of its budget left, we send
+    requests as soon as they arrive.  Below that, we space requests for the
+    token so its remaining budget lasts until the budget resets.  We never
+    start two requests less than `min_interval` seconds apart, to avoid
+    Github's secondary rate limits.
+
+    Parameters
+    ----------
+    tokens : sequence
+        Github tokens.  If empty, send requests without authentication.
+    min_interval : float, optional
+        Minimum time in seconds between starts of any two requests.
+    pace_below : float, optional
+        Fraction of budget limit below which we start spacing requests.
+    clock : callable, optional
+        Function returning current time in seconds since the epoch.
+    sleep : callable, optional
+        Function to sleep for given number of seconds.
+    """
+
+    # Wait this long after a secondary rate limit without a Retry-After
+    # header, as recommended by the Github documentation.
+    default_retry_after = 60
+
+    def __init__(self, tokens, min_interval=0.05, pace_below=0.1,
+                 clock=time.time, sleep=time.sleep):
+        self.tokens = tuple(tokens) if tokens else (None,)
+        self.min_interval = min_interval
+        self.pace_below = pace_below
+        self.clock = clock
+        self.sleep = sleep
+        self._states = {}
+        self._last_start = -float('inf')
+        self._lock = threading.Lock()
+
+    def _state(self, token, resource):
+        key = (token, resource)
+        if key not in self._states:
+            self._states[key] = dict(limit=None, remaining=None, reset=None,
+                                     next_time=-float('inf'),
+                                     blocked_until=-float('inf'))
+        state = self._states[key]
+        if state['reset'] is not None and state['reset'] <= self.clock():
+            # Budget has reset; we don't know the new budget yet.
+            state.update(remaining=None, reset=None)
+        return state
+
+    def _blocked_until(self, state):
+        # Time until which budget is blocked or exhausted.
+        if state['remaining'] is not None and state['remaining'] <= 0:
+            return max(state['reset'], state['blocked_until'])
+        return state['blocked_until']
+
+    def _available(self, state):
+        return max(state['next_time'], self._blocked_until(state))
+
+    def reserve(self, resource='core'):
+        """ Reserve slot for request to `resource`
+
+        Returns
+        -------
+        token : str or None
+            Token to use for request.
+        wait : float
+            Seconds to wait before sending request.
+        """
+        with self._lock:
+            now = self.clock()
+            token = min(self.tokens, key=lambda t: self._available(
+                self._state(t, resource)))
+            state = self._state(token, resource)
+            if self._blocked_until(state) > now:
+                # Waiting for budget; space requests for this budget only,
+                # so we don't hold up requests to other budgets.
+                start = self._available(state)
+                state['next_time'] = start + self.min_interval
+            else:
+                start = max(now, self._available(state),
+                            self._last_start + self.min_interval)
+                self._last_start = start
+                state['next_time'] = start
+            remaining, reset = state['remaining'], state['reset']
+            if remaining:
+                if remaining <= self.pace_below * state['limit']:
+                    # Spread the remaining budget until the reset time.
+                    state['next_time'] += max(reset - start, 0) / remaining
+                state['remaining'] = remaining - 1
+            return token, start - now
+
+    def acquire(self, resource='core'):
+        """ Wait for slot for request to `resource`, return token to use
+        """
+        token, wait = self.reserve(resource)
+        if wait > 0:
+            self.sleep(wait)
+        return token
+
+    def update(self, token, response, resource=None):
+        """ Update budget for `token` from headers of `response`
+        """
+        if token not in self.tokens:
+            return
+        headers = response.headers
+        resource = headers.get('X-RateLimit-Resource',
+                               resource or url_resource(response.url))
+        with self._lock:
+            state = self._state(token, resource)
+            if 'X-RateLimit-Remaining' in headers:
+                state.update(limit=int(headers['X-RateLimit-Limit']),
+                             remaining=int(headers['X-RateLimit-Remaining']),
+                             reset=float(headers['X-RateLimit-Reset']))
+            if not is_rate_limited(response):
+                return
+            if 'Retry-After' in headers:
+                wait = float(headers['Retry-After'])
+            elif state['remaining'] == 0:
+                return
+            else:
+                wait = self.default_retry_after
+            state['blocked_until'] = self.clock() + wait
+
+    def budget(self):
+        """ Current known budget, for monitoring
+
+        Returns dict with keys of form ``...abcd`` (last four characters of
+        each token), and values that are dicts keyed by resource, with
+        values of dicts with keys ``limit``, ``remaining`` and ``reset``.
+        """
+        out = {}
+        with self._lock:
+            for (token, resource), state in self._states.items():
+                label = '...' + token[-4:] if token else None
+                out.setdefault(label, {})[resource] = {
+                    k: state[k] for k in ('limit', 'remaining', 'reset')}
+        return out
+
+
+class HTTPCache:
+    """ Cache of GET responses, with validators for conditional requests
+
+    Store responses that have an ``ETag`` or ``Last-Modified`` header in
+    `store`, a mapping such as :class:`kvstore.SQLiteStore`.  Github does not
+    count ``304 Not Modified`` replies to conditional requests against the
+    rate limit, so revalidating cached responses is cheap.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    @staticmethod
+    def key(request):
+        # github3 varies the Accept header for some API previews.
+        return f"{request.url} {request.headers.get('Accept', '')}"
+
+    def add_validators(self, request):
+        """ Add conditional headers to `request` if we have a cached response
+
+        Returns cached entry, or None.
+        """
+        entry = self.store.get(self.key(request))
+        if entry is None:
+            return None
+        if entry['etag']:
+            request.headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            request.headers['If-Modified-Since'] = entry['last_modified']
+        return entry
+
+    def save(self, request, response):
+        """ Store `response` to `request` if it can be revalidated later
+        """
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if response.status_code != 200 or not (etag or last_modified):
+            return
+        self.store[self.key(request)] = {
+            'etag': etag,
+            'last_modified': last_modified,
+            'headers': dict(response.headers),
+            'encoding': response.encoding,
+            'content': b64encode(response.content).decode('ascii')}
+
+    @staticmethod
+    def build_response(entry, request, not_modified):
+        """ Build response to `request` from cached `entry`
+
+        Update headers, such as rate limit headers, from `not_modified`, the
+        ``304`` response.
+        """
+        response = Response()
+        response.status_code = 200
+        response.reason = 'OK'
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.headers.update(not_modified.headers)
+        response.encoding = entry['encoding']
+        response._content = b64decode(entry['content'])
+        response.url = request.url
+        response.request = request
+        response.connection = not_modified.connection
+        response.from_cache = True
+        return response
+
+
+class GitHubAdapter(HTTPAdapter):
+    """ HTTP adapter sending requests through a :class:`RateLimitScheduler`
+
+    The scheduler chooses the token for each request, replacing any
+    ``Authorization`` header that uses one of the scheduler tokens.  If a
+    request has an ``Authorization`` header with some other token, we leave
+    it as is.  We resend requests that hit a rate limit up to
+    `max_limit_retries` times.  If `cache` is an :class:`HTTPCache`, make GET
+    requests conditional on cached responses, and reply from the cache for
+    ``304 Not Modified``.
+    """
+
+    def __init__(self, scheduler, cache=None, max_limit_retries=5,
+                 **kwargs):
+        super().__init__(**kwargs)
+        self.scheduler = scheduler
+        self.cache = cache
+        self.max_limit_retries = max_limit_retries
+
+    def _use_scheduler(self, request):
+        auth = request.headers.get('Authorization')
+        return (auth is None or
+                auth.split()[-1] in self.scheduler.tokens)
+
+    def send(self, request, **kwargs):
+        use_cache = self.cache is not None and request.method == 'GET'
+        entry = self.cache.add_validators(request) if use_cache else None
+        response = self._send(request, **kwargs)
+        if not use_cache:
+            return response
+        if response.status_code == 304 and entry is not None:
+            response.close()
+            return self.cache.build_response(entry, request, response)
+        self.cache.save(request, response)
+        return response
+
+    def _send(self, request, **kwargs):
+        resource = url_resource(request.url)
+        if not self._use_scheduler(request):
+            return super().send(request, **kwargs)
+        for attempt in range(self.max_limit_retries + 1):
+            token = self.scheduler.acquire(resource)
+            if token is not None:
+                request.headers['Authorization'] = f'token {token}'
+            response = super().send(request, **kwargs)
+            self.scheduler.update(token, response, resource)
+            if not is_rate_limited(response):
+                break
+        return response
@@ -1,16 +1,30 @@
 """ Utilities for github places processing.
 """
 
-from os.path import abspath, exists
+import os
+import time
+import asyncio
+import threading
+from weakref import WeakKeyDictionary
+from concurrent.futures import ThreadPoolExecutor
+from os.path import abspath, exists, splitext, join as pjoin
+import shutil
+from hashlib import sha1
 import requests
 import json
 import re
-from subprocess import check_output, PIPE, CalledProcessError
+from subprocess import (check_output, call, Popen, PIPE, DEVNULL,
+                        CalledProcessError)
 from collections import namedtuple, OrderedDict, Counter
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
 
 from github3 import login
 
+from ghtransport import RateLimitScheduler, GitHubAdapter, HTTPCache
+from kvstore import SQLiteStore
+
 GRAPHQL_URL = 'https://api.github.com/graphql'
 
 ORGS_REPOS = (
@@ -28,55 +42,405 @@ ORGS_REPOS = (
 
 REPO2ORG = {repo: org for org, repo in ORGS_REPOS}
 
+# Format for git shortlog commit lines; see `parse_sl_line`.
+SL_FORMAT = '--format=%H||%aN||%aE||%an||%ae||%aI'
+
+# Shortlog author header line, e.g. "Andrew Collette (233):"
+SL_HEADER_RE = re.compile(r'^.*\s+\(\d+\):$')
+
 GH_TOKEN_FNAME = '.gh_token'
 
+# Default directory for on-disk cache of parsed contributors.
+REPO_CACHE_DIR = '.repo_cache'
 
-def get_gh_token(fname):
+# Database for HTTP cache of Github responses.
+HTTP_CACHE_FNAME = '.http_cache.sqlite'
+
+# Database for record of Github lookups that did not find a user.
+PROBE_CACHE_FNAME = '.probe_cache.sqlite'
+
+# Time in seconds before we try a fruitless lookup again.
+PROBE_TTL = 30 * 24 * 60 * 60
+
+# Database for emails from Github push events.
+EMAIL_INDEX_FNAME = '.email_index.sqlite'
+
+# Fraction of sightings for which email must belong to one user.
+EMAIL_MIN_SHARE = 0.9
+
+# Minimum number of sightings before email can belong to a user.
+EMAIL_MIN_COUNT = 2
+
+
+def get_gh_tokens(fname):
+    """ Return list of Github tokens from file `fname`, one per line
+    """
+    tokens = []
     with open(fname, 'rt') as fobj:
         for line in fobj:
             line = line.strip()
             if line == '' or line.startswith('#'):
                 continue
-            return line
+            tokens.append(line)
+    return tokens
+
+
+def get_gh_token(fname):
+    tokens = get_gh_tokens(fname)
+    return tokens[0] if tokens else None
+
+
+class OfflineError(RuntimeError):
+    """ Error for attempted network access in offline mode
+    """
+
 
+# Offline mode; see `set_offline`.  Start in offline mode by setting
+# environment variable GPUTILS_OFFLINE=1.
+OFFLINE = os.environ.get('GPUTILS_OFFLINE', '0') not in ('', '0')
 
-GH_TOKEN = get_gh_token(GH_TOKEN_FNAME)
-GH = login(token=GH_TOKEN)
+
+def set_offline(offline=True):
+    """ Set offline mode; in offline mode, network access raises OfflineError
+    """
+    global OFFLINE
+    OFFLINE = offline
+
+
+def check_online():
+    if OFFLINE:
+        raise OfflineError('Github access attempted in offline mode')
+
+
+# GET responses from Github, for revalidation with conditional requests.
+GH_HTTP_CACHE = HTTPCache(SQLiteStore(HTTP_CACHE_FNAME, 'http'))
+
+# Github tokens, scheduler, sessions, made on first use.
+_GH_STATE = {}
+_GH_LOCK = threading.RLock()
+
+
+def gh_tokens():
+    """ Github tokens from ``GH_TOKEN_FNAME``, read on first call
+    """
+    with _GH_LOCK:
+        if 'tokens' not in _GH_STATE:
+            _GH_STATE['tokens'] = (get_gh_tokens(GH_TOKEN_FNAME)
+                                   if exists(GH_TOKEN_FNAME) else [])
+        return _GH_STATE['tokens']
+
+
+def gh_token():
+    """ First Github token; raise ValueError if there are no tokens
+    """
+    tokens = gh_tokens()
+    if not tokens:
+        raise ValueError(
+            f'Need Github token in {GH_TOKEN_FNAME} for Github access')
+    return tokens[0]
+
+
+def gh_scheduler():
+    """ Scheduler for all Github requests, rotating across tokens
+    """
+    with _GH_LOCK:
+        if 'scheduler' not in _GH_STATE:
+            _GH_STATE['scheduler'] = RateLimitScheduler(gh_tokens())
+        return _GH_STATE['scheduler']
+
+
+def get_gh():
+    """ Github3 ``GitHub`` object, logging in on first call
+    """
+    check_online()
+    with _GH_LOCK:
+        if 'gh' not in _GH_STATE:
+            gh = login(token=gh_token())
+            gh.session.mount('https://',
+                             GitHubAdapter(gh_scheduler(), GH_HTTP_CACHE))
+            _GH_STATE['gh'] = gh
+        return _GH_STATE['gh']
+
+
+def get_gql_session():
+    """ Session for GraphQL queries, made on first call
+    """
+    check_online()
+    with _GH_LOCK:
+        if 'gql_session' not in _GH_STATE:
+            session = requests.Session()
+            # GraphQL queries are POST requests, so HTTP cache does not apply.
+            session.mount('https://', GitHubAdapter(gh_scheduler()))
+            _GH_STATE['gql_session'] = session
+        return _GH_STATE['gql_session']
+
+
+def __getattr__(name):
+    # Lazy module attributes, for compatibility.
+    if name == 'GH':
+        return get_gh()
+    if name == 'GH_TOKEN':
+        return gh_token()
+    if name == 'GH_TOKENS':
+        return gh_tokens()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def gh_budget():
+    """ Current rate limit budget per token; see `RateLimitScheduler.budget`
+    """
+    return gh_scheduler().budget()
 
 
 def get_repo(repo_name, org=None):
     org = org if org else REPO2ORG[repo_name]
-    return GH.repository(org, repo_name)
+    return get_gh().repository(org, repo_name)
 
 
 def graphql_query(query, token=None):
-    token = token if token else GH_TOKEN
-    headers = {'Authorization': f'token {GH_TOKEN}'}
-    answer = requests.post(url=GRAPHQL_URL,
-                           json={'query': query},
-                           headers=headers)
+    session = get_gql_session()
+    token = token if token else gh_token()
+    headers = {'Authorization': f'token {token}'}
+    answer = session.post(url=GRAPHQL_URL,
+                          json={'query': query},
+                          headers=headers)
     return json.loads(answer.text)
 
 
 
 def ordered_unique(sequence, out=None):
-    out = [] if out is None else list(out)
+    # Dicts keep first insertion order; elements must be hashable.
+    out = dict.fromkeys(() if out is None else out)
     for e in sequence:
-        if e not in out:
-            out.append(e)
+        out.setdefault(e)
     return tuple(out)
 
 
+class ContributorIndex:
+    """ Summaries of a contributor's commits, built in one pass over commits
+    """
+
+    def __init__(self, commits):
+        self.n_commits = len(commits)
+        c_names, c_emails, o_names, o_emails = {}, {}, {}, {}
+        tz_counts = Counter()
+        shas_by_o_email = {}
+        for sha, c_name, c_email, o_name, o_email, tz in commit_fields(commits):
+            c_names.setdefault(c_name)
+            c_emails.setdefault(c_email)
+            o_names.setdefault(o_name)
+            o_emails.setdefault(o_email)
+            tz_counts[tz] += 1
+            shas_by_o_email.setdefault(o_email, []).append(sha)
+        self.names = ordered_unique(o_names, c_names)
+        self.emails = ordered_unique(o_emails, c_emails)
+        # Counter keeps order of first appearance.
+        self.timezone_counts = tuple(tz_counts.items())
+        self._shas_by_o_email = shas_by_o_email
+        self.shas = frozenset(
+            sha for shas in shas_by_o_email.values() for sha in shas)
+
+    @property
+    def shas_by_email(self):
+        """ New ordered dict of SHA lists, keyed by email, in `emails` order
+        """
+        return OrderedDict((e, list(self._shas_by_o_email[e]))
+                           for e in self.emails
+                           if e in self._shas_by_o_email)
+
+
+def commit_fields(commits):
+    """ Iterate over SHA, names, emails and timezone name for `commits`
+    """
+    if isinstance(commits, CommitView):
+        return commits.iter_fields()
+    return ((c.sha, c.c_name, c.c_email, c.o_name, c.o_email, c.dt.tzname())
+            for c in commits)
+
+
+class ProbeCache:
+    """ Record of Github lookups for commits that did not give a user
+
+    A probe is a lookup of kind `kind` for commit `sha` in repository `repo`,
+    authored with email `email`.  Kinds are ``login``, for the Github user of
+    the commit, and ``pr``, for the author of the commit's pull request.  We
+    record fruitless probes in `store`, a mapping such as
+    :class:`kvstore.SQLiteStore`, and forget them after `ttl` seconds, in
+    case the user has since added their email to Github.
+    """
+
+    def __init__(self, store, ttl=PROBE_TTL, clock=time.time):
+        self.store = store
+        self.ttl = ttl
+        self.clock = clock
+
+    @staticmethod
+    def key(kind, repo, email, sha):
+        return f'{kind} {repo.org}/{repo.name} {email} {sha}'
+
+    def is_fruitless(self, kind, repo, email, sha):
+        """ True if probe failed within the last `ttl` seconds
+        """
+        entry = self.store.get(self.key(kind, repo, email, sha))
+        return (entry is not None and
+                self.clock() - entry['checked'] <= self.ttl)
+
+    def add(self, kind, repo, email, sha):
+        """ Record fruitless probe
+        """
+        self.store[self.key(kind, repo, email, sha)] = {
+            'checked': self.clock()}
+
+    def untried(self, kind, repo, email, shas):
+        """ SHAs from `shas` without a recent fruitless probe, in order
+        """
+        return [sha for sha in shas
+                if not self.is_fruitless(kind, repo, email, sha)]
+
+
+PROBE_CACHE = ProbeCache(SQLiteStore(PROBE_CACHE_FNAME, 'probes'))
+
+
+class EmailIndex:
+    """ Reverse index from commit emails to Github users, from push events
+
+    For each normalized email, we count the commits with that author email
+    in the push events of each Github user we have fetched.  Push events
+    often contain other people's commits, so we only count commits where the
+    author name matches the user's login or profile name.  We remember the
+    latest event we have seen for each user, so we only count new events
+    when we fetch events again.
+
+    Parameters
+    ----------
+    emails : mapping
+        Mapping from email to dict of Github user, count pairs, such as a
+        :class:`kvstore.SQLiteStore`.
+    users : mapping
+        Mapping from Github user to dict with keys ``latest``, for latest
+        event id, and ``emails``, for dict of email, count pairs.
+    """
+
+    def __init__(self, emails, users):
+        self.emails = emails
+        self.users = users
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_fname(cls, fname):
+        return cls(SQLiteStore(fname, 'email_users'),
+                   SQLiteStore(fname, 'user_emails'))
+
+    def user_emails(self, gh_user):
+        """ Counter of emails in push events for `gh_user`
+        """
+        return Counter(self.users.get(gh_user, {}).get('emails', {}))
+
+    def latest_event(self, gh_user):
+        """ Id of latest event recorded for `gh_user`, or None
+        """
+        return self.users.get(gh_user, {}).get('latest')
+
+    def add_events(self, gh_user, events, names=()):
+        """ Add push events for `gh_user`, skipping events seen already
+
+        `events` is a sequence of (event_id, authors) pairs, where event ids
+        are integers, and `authors` lists the (name, email) author pair of
+        each commit.  `names` are other names for `gh_user`, such as their
+        profile name.  We record all emails for :meth:`user_emails`, but only
+        index emails for commits with author name matching `gh_user` or one
+        of `names`.
+        """
+        with self._lock:
+            self._add_events(gh_user, events, names)
+
+    def _add_events(self, gh_user, events, names):
+        latest = self.latest_event(gh_user)
+        new = [(eid, authors) for eid, authors in events
+               if latest is None or eid > latest]
+        if len(new) == 0:
+            return
+        counts = Counter(email for eid, authors in new
+                         for name, email in authors if email)
+        entry = {'latest': max(eid for eid, authors in new),
+                 'emails': dict(self.user_emails(gh_user) + counts)}
+        own_names = {normalize_name(n) for n in (gh_user, *names) if n}
+        by_email = Counter(
+            normalize_email(email) for eid, authors in new
+            for name, email in authors
+            if email and name and normalize_name(name) in own_names)
+        by_email.pop(None, None)
+        updates = {}
+        for email, count in by_email.items():
+            logins = self.emails.get(email, {})
+            logins[gh_user] = logins.get(gh_user, 0) + count
+            updates[email] = logins
+        self.emails.update(updates)
+        self.users[gh_user] = entry
+
+    def logins(self, email):
+        """ Dict of Github user, count pairs for `email`
+        """
+        email = normalize_email(email)
+        return {} if email is None else self.emails.get(email, {})
+
+    def lookup(self, emails, min_share=EMAIL_MIN_SHARE,
+               min_count=EMAIL_MIN_COUNT):
+        """ Github user owning `emails`, or None
+
+        A user owns an email if they have at least `min_count` sightings, and
+        at least `min_share` of all sightings, of that email.  Return None
+        unless all owned emails in `emails` have the same owner.
+        """
+        owners = set()
+        for email in emails:
+            logins = self.logins(email)
+            if not logins:
+                continue
+            gh_user, count = max(logins.items(), key=lambda item: item[1])
+            if (count >= min_count and
+                count >= min_share * sum(logins.values())):
+                owners.add(gh_user)
+        return owners.pop() if len(owners) == 1 else None
+
+
+EMAIL_INDEX = EmailIndex.from_fname(EMAIL_INDEX_FNAME)
+
+
 class RepoContributor:
 
     # Number of PRs to try when searching for GH user
     n_prs = 10
 
+    # Record of fruitless Github lookups; None to always look up.
+    probe_cache = PROBE_CACHE
+
+    # Emails of Github users from push events; None to skip.
+    email_index = EMAIL_INDEX
+
     def __init__(self, commits, repo, gh_user=None):
         self.commits = commits
         self.repo = repo
         self.gh_user = gh_user
 
+    @property
+    def commits(self):
+        return self._commits
+
+    @commits.setter
+    def commits(self, commits):
+        self._commits = commits
+        self._index = None
+
+    @property
+    def index(self):
+        """ :class:`ContributorIndex` for commits, rebuilt if commits change
+        """
+        # Also catch in-place changes to the length of the commit list.
+        if self._index is None or self._index.n_commits != len(self.commits):
+            self._index = ContributorIndex(self.commits)
+        return self._index
+
     def __eq__(self, other):
         return (self.commits == self.commits)
 
@@ -90,49 +454,114 @@ class RepoContributor:
 
     @property
     def names(self):
-        names = ordered_unique(c.c_name for c in self.commits)
-        return ordered_unique([c.o_name for c in self.commits], names)
+        return self.index.names
 
     @property
     def emails(self):
-        emails = ordered_unique(c.c_email for c in self.commits)
-        return ordered_unique([c.o_email for c in self.commits], emails)
+        return self.index.emails
 
     @property
     def timezone_counts(self):
-        timezones = [c.dt.tzname() for c in self.commits]
-        unique = ordered_unique(timezones)
-        return tuple((tz, timezones.count(tz)) for tz in unique)
+        return self.index.timezone_counts
 
     @property
     def shas_by_email(self):
-        shas_emails = OrderedDict()
-        for email in self.emails:
-            shas = [c.sha for c in self.commits if c.o_email == email]
-            if shas:
-                shas_emails[email] = shas
-        return shas_emails
-
-    def shas2gh_user(self):
+        return self.index.shas_by_email
+
+    def _untried(self, kind, email, shas):
+        if self.probe_cache is None:
+            return list(shas)
+        return self.probe_cache.untried(kind, self.repo, email, shas)
+
+    def _add_probe(self, kind, email, sha):
+        if self.probe_cache is not None:
+            self.probe_cache.add(kind, self.repo, email, sha)
+
+    def _login_probes(self):
+        # First SHA for each email, unless we know it gives no user.
+        probes = {}
+        for email, shas in self.shas_by_email.items():
+            untried = self._untried('login', email, shas[:1])
+            if untried:
+                probes[email] = untried[0]
+        return probes
+
+    def shas2gh_user(self, token=None):
+        # Github user for first SHA for each email.
+        probes = self._login_probes()
+        sha_info = self.repo.resolve_shas(list(probes.values()), token)
+        for email, sha in probes.items():
+            if sha_info[sha]['login']:
+                return sha_info[sha]['login']
+            self._add_probe('login', email, sha)
+
+    def _pr_shas_by_email(self):
+        # SHAs for each email, without those giving no PR author before, and
+        # without those in PRs from local merge commits.
+        merge_prs = self.repo.merge_prs
+        return OrderedDict(
+            (email, self._untried('pr', email, [
+                sha for sha in shas if merge_prs.pr_for(sha) is None]))
+            for email, shas in self.shas_by_email.items())
+
+    def local_prs2gh_user(self):
+        """ Github user from PRs in local merge commits, or None
+
+        As for :meth:`sha_prs2gh_user`, but using PRs from
+        :attr:`Repo.merge_prs`, with no Github queries.
+        """
+        merge_prs = self.repo.merge_prs
+        author_shas = self.index.shas
         for shas in self.shas_by_email.values():
-            gh_user = sha2gh_user(shas[0], self.repo.gh_repo)
-            if gh_user:
-                return gh_user
+            shas = [sha for sha in shas if merge_prs.pr_for(sha)]
+            while shas:
+                # Modifies shas in-place
+                gh_user = track_pr_info(
+                    shas, merge_prs.sha_info(shas[0]), author_shas)
+                if gh_user:
+                    return gh_user
+
+    def candidate_shas(self, n_prs=None):
+        """ SHAs we expect to look up on Github for this contributor
+
+        The first SHA for each email, and the first `n_prs` SHAs for each
+        email that we have not already tried, without success, to track to a
+        PR.
+        """
+        n_prs = self.n_prs if n_prs is None else n_prs
+        if self.local_prs2gh_user():
+            return []
+        return (list(self._login_probes().values()) +
+                [sha for shas in self._pr_shas_by_email().values()
+                 for sha in shas[:n_prs]])
 
     def sha_prs2gh_user(self, n_prs=None, token=None):
-        # Try tracking PRs for commits.
+        # Try tracking PRs for commits, first from local merge commits.
+        gh_user = self.local_prs2gh_user()
+        if gh_user:
+            return gh_user
         # Try a few PRs for each email address
         n_prs = self.n_prs if n_prs is None else n_prs
-        author_shas = tuple(c.sha for c in self.commits)
-        repo = self.repo.gh_repo
-        for shas in self.shas_by_email.values():
-            for i in range(self.n_prs):
-                # Modifies shas in-place
-                pr = track_pr(shas, repo, author_shas, token)
+        author_shas = self.index.shas
+        shas_by_email = self._pr_shas_by_email()
+        # Resolve likely SHAs in as few queries as possible.
+        self.repo.resolve_shas([sha for shas in shas_by_email.values()
+                                for sha in shas[:n_prs]], token)
+        for email, shas in shas_by_email.items():
+            for i in range(n_prs):
                 if len(shas) == 0:
                     break
-                elif pr:
-                    return pr.user.login
+                # Only resolve SHAs we may still probe.
+                sha_info = self.repo.resolve_shas(shas[:n_prs - i], token)
+                before = list(shas)
+                # Modifies shas in-place
+                gh_user = track_pr_info(shas, sha_info[shas[0]], author_shas)
+                if gh_user:
+                    return gh_user
+                # Record all SHAs covered by this PR lookup.
+                for sha in before:
+                    if sha not in shas:
+                        self._add_probe('pr', email, sha)
 
     def guess_gh_user(self, n_prs=None, token=None):
         """ Guess Github user from various data sources
@@ -158,23 +587,43 @@ class RepoContributor:
 
         * If any contributor email is a Github no-reply email, it gives the
           Github user name, otherwise:
+        * Look for PRs in local "Merge pull request" commits, as for PRs on
+          Github below, otherwise:
         * Query on Github for commit SHA of most recent commit matching each email
           to see whether it gives a username, otherwise:
+        * If we have seen the contributor's emails in the push events of one
+          Github user (see :class:`EmailIndex`), return that user.  Pushers
+          can push other people's commits, so this comes after Github's own
+          record of the commit author.  Otherwise:
         * Go through SHAs for each email, to find matching Pull Request (PR)
           on Github. If all commits for that PR match one a commit from this
           contributor, return Github user of PR, otherwise:
         * Repeat step above nine times (by default) to look for more PRs,
           otherwise:
         * Return None
+
+        We resolve SHAs in batched GraphQL queries; see :func:`shas2info` and
+        :func:`prefetch_sha_info`.  We skip lookups that recently failed for
+        the same repository, email and SHA; see :class:`ProbeCache`.  The PR
+        search starts from SHAs we have not tried before.
         """
         # Look for a github email address
         gh_user = emails2gh_user(self.emails)
+        if gh_user:
+            return gh_user
+        # PRs from local merge commits
+        gh_user = self.local_prs2gh_user()
         if gh_user:
             return gh_user
         # Search for login attached to most recent SHA for each email address
-        gh_user = self.shas2gh_user()
+        gh_user = self.shas2gh_user(token)
         if gh_user:
             return gh_user
+        # Emails in push events
+        if self.email_index is not None:
+            gh_user = self.email_index.lookup(self.emails)
+            if gh_user:
+                return gh_user
         return self.sha_prs2gh_user(n_prs, token)
 
     def __len__(self):
@@ -191,15 +640,322 @@ Commit = namedtuple('Commit', ('sha', 'c_name', 'c_email', 'o_name', 'o_email',
                                'dt'))
 
 
-def parse_shortlog(output):
-    res = re.split(r'^.*\s+\(\d+\):$', output, flags=re.M)
-    contribs = []
-    for auth_info in res[1:]:
-        contribs.append([parse_sl_line(L) for L in auth_info.splitlines() if L])
-    return contribs
+def parse_shortlog(output, table=None):
+    """ Parse shortlog `output` string to list of commit views, one per author
+
+    All commits go into the same :class:`CommitTable`; pass `table` to use an
+    existing table.
+    """
+    table = CommitTable() if table is None else table
+    return list(iter_shortlog(output.splitlines(), table))
+
+
+def iter_shortlog(lines, table=None):
+    """ Yield :class:`CommitView`, one per author block, from shortlog `lines`
+
+    `lines` can be any iterable of lines, such as an open pipe, so we only
+    need to hold one author block in memory at a time.  If `table` is None,
+    make a new :class:`CommitTable` for each author block, otherwise append
+    all commits to `table`.
+    """
+    block = None
+    for line in lines:
+        # Commit lines are indented; only check other lines for headers.
+        if not line[:1].isspace() and SL_HEADER_RE.match(line.rstrip('\n')):
+            if block is not None:
+                yield _block_view(block, table)
+            block = []
+        elif block is not None and line.strip():
+            block.append(line)
+    if block is not None:
+        yield _block_view(block, table)
+
+
+def _block_view(lines, table=None):
+    # View of commits from author block `lines`, added to `table`.
+    table = CommitTable() if table is None else table
+    start = len(table)
+    table.extend_lines(lines)
+    return table.view(start)
+
+
+class StringTable:
+    """ Interned strings, each with an integer id
+    """
+
+    def __init__(self, strings=()):
+        self.strings = []
+        self._ids = {}
+        for s in strings:
+            self.intern(s)
+
+    def intern(self, s):
+        """ Return id for string `s`, adding `s` to table if necessary
+        """
+        if s not in self._ids:
+            self._ids[s] = len(self.strings)
+            self.strings.append(s)
+        return self._ids[s]
+
+    def __getitem__(self, i):
+        return self.strings[i]
+
+    def __len__(self):
+        return len(self.strings)
+
+
+class CommitTable:
+    """ Column store for commits
+
+    Columns are NumPy arrays: ``sha`` (ASCII bytes), ``c_name``, ``c_email``,
+    ``o_name``, ``o_email`` (integer ids into the ``names`` and ``emails``
+    string tables), ``epoch`` (seconds since the Unix epoch) and
+    ``tz_offset`` (UTC offset in minutes).  Indexing gives a
+    :class:`Commit`.
+    """
+
+    columns = (('sha', 'S40'),
+               ('c_name', np.int32),
+               ('c_email', np.int32),
+               ('o_name', np.int32),
+               ('o_email', np.int32),
+               ('epoch', np.int64),
+               ('tz_offset', np.int16))
+
+    def __init__(self, capacity=1024):
+        self.names = StringTable()
+        self.emails = StringTable()
+        self._n = 0
+        self._cols = {name: np.zeros(capacity, dtype)
+                      for name, dtype in self.columns}
+
+    def __len__(self):
+        return self._n
+
+    def __getattr__(self, name):
+        # Columns, trimmed to the number of filled rows.
+        if name.startswith('_') or name not in self._cols:
+            raise AttributeError(name)
+        return self._cols[name][:self._n]
+
+    @classmethod
+    def from_columns(cls, columns, names, emails):
+        """ Make table from dict of column arrays, and string sequences
+
+        Column arrays can be memory maps; we only copy them if we later need
+        to append to the table.
+        """
+        table = cls(capacity=0)
+        table.names = StringTable(names)
+        table.emails = StringTable(emails)
+        table._cols = {name: columns[name] for name, dtype in cls.columns}
+        table._n = len(table._cols['sha'])
+        return table
+
+    @classmethod
+    def from_views(cls, views):
+        """ Make new table with copies of commits in sequence of `views`
+        """
+        views = list(views)
+        table = cls(capacity=sum(len(v) for v in views))
+        for view in views:
+            table.extend(view)
+        return table
+
+    def extend(self, commits):
+        """ Append copies of `commits`, a :class:`CommitView` or sequence
+        """
+        if not isinstance(commits, CommitView):
+            for commit in commits:
+                self.append(*commit)
+            return
+        n = len(commits)
+        while self._n + n > len(self._cols['sha']):
+            self._grow()
+        rows = slice(self._n, self._n + n)
+        for name, dtype in self.columns:
+            values = getattr(commits, name)
+            if name.endswith('_name'):
+                values = _remap_ids(values, commits.table.names, self.names)
+            elif name.endswith('_email'):
+                values = _remap_ids(values, commits.table.emails, self.emails)
+            self._cols[name][rows] = values
+        self._n += n
+
+    def __getstate__(self):
+        # Drop unused capacity when pickling.
+        state = self.__dict__.copy()
+        state['_cols'] = {name: col[:self._n].copy()
+                          for name, col in self._cols.items()}
+        return state
+
+    def _grow(self):
+        for name, col in self._cols.items():
+            new_col = np.zeros(max(len(col) * 2, 1), col.dtype)
+            new_col[:len(col)] = col
+            self._cols[name] = new_col
+
+    def append(self, sha, c_name, c_email, o_name, o_email, dt):
+        if self._n == len(self._cols['sha']):
+            self._grow()
+        i, cols = self._n, self._cols
+        cols['sha'][i] = sha.encode('ascii')
+        cols['c_name'][i] = self.names.intern(c_name)
+        cols['c_email'][i] = self.emails.intern(c_email)
+        cols['o_name'][i] = self.names.intern(o_name)
+        cols['o_email'][i] = self.emails.intern(o_email)
+        cols['epoch'][i] = dt.timestamp()
+        cols['tz_offset'][i] = dt.utcoffset() // timedelta(minutes=1)
+        self._n += 1
+
+    def append_line(self, line):
+        """ Append commit from shortlog line; see :func:`parse_sl_line`
+        """
+        fields = line.strip().split('||')
+        fields[-1] = datetime.fromisoformat(fields[-1])
+        self.append(*fields)
+
+    def extend_lines(self, lines):
+        """ Append commits from sequence of shortlog `lines`
+
+        As for :meth:`append_line` on each line, but faster, because we fill
+        each column in one go, and parse dates with NumPy.
+        """
+        rows = [line.strip().split('||') for line in lines]
+        n = len(rows)
+        if n == 0:
+            return
+        while self._n + n > len(self._cols['sha']):
+            self._grow()
+        shas, c_names, c_emails, o_names, o_emails, dts = zip(*rows)
+        rows = slice(self._n, self._n + n)
+        cols = self._cols
+        # Intern each distinct string once.
+        names = {name: self.names.intern(name)
+                 for name in dict.fromkeys(c_names + o_names)}
+        emails = {email: self.emails.intern(email)
+                  for email in dict.fromkeys(c_emails + o_emails)}
+        cols['sha'][rows] = [sha.encode('ascii') for sha in shas]
+        cols['c_name'][rows] = [names[name] for name in c_names]
+        cols['c_email'][rows] = [emails[email] for email in c_emails]
+        cols['o_name'][rows] = [names[name] for name in o_names]
+        cols['o_email'][rows] = [emails[email] for email in o_emails]
+        cols['epoch'][rows], cols['tz_offset'][rows] = _parse_iso_dates(dts)
+        self._n += n
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._n
+        if not 0 <= i < self._n:
+            raise IndexError('commit index out of range')
+        cols = self._cols
+        tz = timezone(timedelta(minutes=int(cols['tz_offset'][i])))
+        return Commit(cols['sha'][i].decode('ascii'),
+                      self.names[cols['c_name'][i]],
+                      self.emails[cols['c_email'][i]],
+                      self.names[cols['o_name'][i]],
+                      self.emails[cols['o_email'][i]],
+                      datetime.fromtimestamp(int(cols['epoch'][i]), tz))
+
+    def view(self, start=0, stop=None):
+        """ Return :class:`CommitView` for rows `start` up to `stop`
+        """
+        return CommitView(self, start, len(self) if stop is None else stop)
+
+
+def _parse_iso_dates(dts):
+    """ Seconds since epoch, UTC offsets in minutes, for ISO 8601 `dts`
+
+    Fast path for strings of form ``2018-08-28T23:27:25-04:00``, as from
+    git's ``%aI`` format.
+    """
+    as_bytes = np.array(dts, dtype='S')
+    chars = (as_bytes.view(np.uint8).reshape(len(dts), -1).astype(np.int64)
+             if as_bytes.dtype.itemsize == 25 else None)
+    if chars is None or not (np.all((chars[:, 19] == ord('+')) |
+                                    (chars[:, 19] == ord('-'))) and
+                             np.all(chars[:, 22] == ord(':'))):
+        dts = [datetime.fromisoformat(dt) for dt in dts]
+        return ([dt.timestamp() for dt in dts],
+                [dt.utcoffset() // timedelta(minutes=1) for dt in dts])
+    digit = ord('0')
+    offsets = ((chars[:, 20] - digit) * 600 + (chars[:, 21] - digit) * 60 +
+               (chars[:, 23] - digit) * 10 + chars[:, 24] - digit)
+    offsets[chars[:, 19] == ord('-')] *= -1
+    local = as_bytes.astype('S19').astype('datetime64[s]').astype(np.int64)
+    return local - offsets * 60, offsets
+
+
+def _remap_ids(ids, source, target):
+    """ Map string `ids` from StringTable `source` to StringTable `target`
+    """
+    id_map = np.zeros(len(source), dtype=np.int32)
+    for i in np.unique(ids).tolist():
+        id_map[i] = target.intern(source[i])
+    return id_map[ids]
+
+
+class CommitView:
+    """ Sequence of commits for a contiguous range of rows in a CommitTable
+
+    Attribute access for column names gives the column values for this range.
+    """
+
+    def __init__(self, table, start, stop):
+        self.table = table
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name not in self.table._cols:
+            raise AttributeError(name)
+        return getattr(self.table, name)[self.start:self.stop]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(len(self))[i]]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('commit index out of range')
+        return self.table[self.start + i]
+
+    def __iter__(self):
+        for i in range(self.start, self.stop):
+            yield self.table[i]
 
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def iter_fields(self):
+        """ Iterate over SHA, names, emails and timezone name for commits
 
-def emails2gh_user(emails):
+        Faster than iterating over commits, because we don't build datetimes.
+        """
+        names, emails = self.table.names, self.table.emails
+        tznames = {}
+        for sha, c_name, c_email, o_name, o_email, tz in zip(
+            self.sha.tolist(), self.c_name.tolist(), self.c_email.tolist(),
+            self.o_name.tolist(), self.o_email.tolist(),
+            self.tz_offset.tolist()):
+            if tz not in tznames:
+                tznames[tz] = timezone(timedelta(minutes=tz)).tzname(None)
+            yield (sha.decode('ascii'), names[c_name], emails[c_email],
+                   names[o_name], emails[o_email], tznames[tz])
+
+    def __repr__(self):
+        return f'<CommitView rows {self.start}:{self.stop}>'
+
+
+def emails2gh_user(emails, email_index=None):
+    """ Github user from Github no-reply email in `emails`, or None
+
+    If there is no no-reply email, and `email_index` is an
+    :class:`EmailIndex`, use it to look for a Github user owning `emails`.
+    """
     gh_emails = [e for e in emails
                 if e.endswith('@users.noreply.github.com')]
     if gh_emails:
@@ -207,6 +963,70 @@ def emails2gh_user(emails):
         if '+' in gh_user:
             gh_user = gh_user.split('+')[1]
         return gh_user
+    if email_index is not None:
+        return email_index.lookup(emails)
+
+
+def normalize_email(email):
+    """ Normalized `email` for matching, or None if not a useful email
+    """
+    email = email.strip().lower()
+    return email if '@' in email else None
+
+
+def normalize_name(name):
+    """ Normalized `name` for matching
+    """
+    return ' '.join(name.casefold().split())
+
+
+class IdentityIndex:
+    """ Map emails and names of contributors to Github users, across repos
+
+    Add contributors with known Github users from any repository, then look
+    up contributors from other repositories.  We match on any normalized
+    email.  If no email matches, we match on normalized name, but only if
+    that name belongs to a single Github user.  We don't return a user if
+    emails or names point to more than one.
+    """
+
+    def __init__(self):
+        self._by_email = {}
+        self._by_name = {}
+
+    def __len__(self):
+        return len(self._by_email)
+
+    def add(self, contrib, gh_user):
+        """ Record that `contrib` has Github user `gh_user`
+
+        Ignore missing users; they may well be found from another repository.
+        """
+        if not isinstance(gh_user, str) or gh_user == 'None':
+            return
+        for email in self.emails(contrib):
+            self._by_email.setdefault(email, set()).add(gh_user)
+        for name in contrib.names:
+            self._by_name.setdefault(normalize_name(name), set()).add(gh_user)
+
+    @staticmethod
+    def emails(contrib):
+        """ Normalized useful emails for `contrib`
+        """
+        return ordered_unique(e for e in map(normalize_email, contrib.emails)
+                              if e is not None)
+
+    def lookup(self, contrib):
+        """ Github user for `contrib`, or None if no unique match
+        """
+        gh_users = set()
+        for email in self.emails(contrib):
+            gh_users.update(self._by_email.get(email, ()))
+        if not gh_users:
+            for name in contrib.names:
+                gh_users.update(
+                    self._by_name.get(normalize_name(name), ()))
+        return gh_users.pop() if len(gh_users) == 1 else None
 
 
 class Repo:
@@ -218,6 +1038,8 @@ class Repo:
         self.org = org if org else REPO2ORG[name]
         self.path = abspath(path if path else name)
         self._gh_repo = None
+        self._sha_info = {}
+        self._merge_prs = None
 
     @property
     def gh_repo(self):
@@ -230,12 +1052,70 @@ class Repo:
                             cwd=self.path,
                             text=True)
 
-    def contributors(self):
-        out = self.cmd_in_repo(
-            ['git', 'shortlog', '-n', "--format=%H||%aN||%aE||%an||%ae||%aI"])
+    def resolve_shas(self, shas, token=None):
+        """ Return dict with Github information for each SHA in `shas`
+
+        See :func:`shas2info` for the information.  Query Github only for SHAs
+        we have not seen before, in batches.
+        """
+        missing = [sha for sha in ordered_unique(shas)
+                   if sha not in self._sha_info]
+        for i in range(0, len(missing), SHA_BATCH_SIZE):
+            self._sha_info.update(shas2info(
+                missing[i:i + SHA_BATCH_SIZE], self.name, self.org, token))
+        return {sha: self._sha_info[sha] for sha in shas}
+
+    @property
+    def merge_prs(self):
+        """ :class:`MergePRIndex` for merge commits in local history
+        """
+        if self._merge_prs is None:
+            out = self.cmd_in_repo(['git', 'log', '--topo-order', '--reverse',
+                                    MERGE_LOG_FORMAT, 'HEAD'])
+            self._merge_prs = MergePRIndex.from_log(out.splitlines(),
+                                                    self.org)
+        return self._merge_prs
+
+    def head_sha(self, rev='HEAD'):
+        return self.cmd_in_repo(['git', 'rev-parse', rev]).strip()
+
+    def can_update(self, old, new='HEAD'):
+        """ True if adding ``old..new`` to contributors at `old` gives `new`
+
+        This is so if `old` is an ancestor of `new`, and the mailmap, which
+        determines the contributor groups, has not changed.
+        """
+        def succeeds(cmd):
+            return call(cmd, cwd=self.path, stdout=DEVNULL, stderr=DEVNULL) == 0
+
+        return (succeeds(['git', 'merge-base', '--is-ancestor', old, new]) and
+                succeeds(['git', 'diff', '--quiet', old, new, '--',
+                          '.mailmap']))
+
+    def contributors(self, rev='HEAD'):
+        # Pass `rev` explicitly; shortlog reads stdin when no revision given.
+        out = self.cmd_in_repo(['git', 'shortlog', '-n', SL_FORMAT, rev])
         parsed = parse_shortlog(out)
         return [self.contrib_maker(commits, self) for commits in parsed]
 
+    def iter_contributors(self, rev='HEAD'):
+        """ Yield contributors one at a time, streaming from ``git shortlog``
+
+        Unlike :meth:`contributors`, we read the git output from a pipe as it
+        arrives, and parse one author block at a time, so memory use depends
+        on the largest contributor rather than the whole history.  Git itself
+        still has to walk the full history before it can sort by commit
+        count.
+        """
+        with Popen(['git', 'shortlog', '-n', SL_FORMAT, rev],
+                   cwd=self.path,
+                   stdout=PIPE,
+                   text=True) as proc:
+            for commits in iter_shortlog(proc.stdout):
+                yield self.contrib_maker(commits, self)
+        if proc.returncode:
+            raise CalledProcessError(proc.returncode, proc.args)
+
 
 def sha2gh_user(sha, repo):
     commit = repo.commit(sha)
@@ -247,11 +1127,101 @@ class NoPR:
     """ Class indicates there were no PRs for this list of commits """
 
 
+# Subject of Github merge commit, with PR number and head repository owner.
+MERGE_PR_RE = re.compile(r'^Merge pull request #(\d+) from ([^/\s]+)/')
+
+# Format for git log to give merge PRs.
+MERGE_LOG_FORMAT = '--format=%H%x00%P%x00%s'
+
+MergePR = namedtuple('MergePR', ('number', 'author', 'shas'))
+
+
+class MergePRIndex:
+    """ Pull requests from "Merge pull request" commits in local history
+
+    The PR author is the owner of the head repository in the merge commit
+    message.  The PR commits are those reachable from the second parent of
+    the merge that we have not already assigned to the mainline (the first
+    parent chain from the tip), or to an earlier merge.  This is
+    ``merge^1..merge^2`` for the usual Github history, but needs only one
+    pass over the log.
+    """
+
+    def __init__(self, prs=()):
+        self.prs = {}
+        self._by_sha = {}
+        for pr in prs:
+            self.add(pr)
+
+    def __len__(self):
+        return len(self.prs)
+
+    def add(self, pr):
+        self.prs[pr.number] = pr
+        for sha in pr.shas:
+            self._by_sha[sha] = pr
+
+    @classmethod
+    def from_log(cls, lines, org=None):
+        """ Build index from lines of git log, parents before children
+
+        Lines are from ``git log --topo-order --reverse`` with format
+        ``MERGE_LOG_FORMAT``.  Ignore PRs from branches in `org`, the
+        repository owner; these do not tell us the PR author.
+        """
+        parents = {}
+        merges = []
+        sha = None
+        for line in lines:
+            sha, parent_str, subject = line.rstrip('\n').split('\0', 2)
+            parents[sha] = parent_str.split()
+            if len(parents[sha]) > 1:
+                merges.append((sha, MERGE_PR_RE.match(subject)))
+        # Commits on mainline belong to no PR.
+        claimed = set()
+        while sha is not None and sha not in claimed:
+            claimed.add(sha)
+            sha = parents[sha][0] if parents.get(sha) else None
+        index = cls()
+        org = None if org is None else org.lower()
+        for sha, match in merges:
+            pr_shas = []
+            stack = parents[sha][1:]
+            while stack:
+                pr_sha = stack.pop()
+                if pr_sha in claimed or pr_sha not in parents:
+                    continue
+                claimed.add(pr_sha)
+                pr_shas.append(pr_sha)
+                stack.extend(parents[pr_sha])
+            if match and match.group(2).lower() != org:
+                index.add(MergePR(int(match.group(1)), match.group(2),
+                                  pr_shas))
+        return index
+
+    def pr_for(self, sha):
+        """ :class:`MergePR` containing commit `sha`, or None
+        """
+        return self._by_sha.get(sha)
+
+    def sha_info(self, sha):
+        """ PR information for `sha` in format of :func:`shas2info`, or None
+        """
+        pr = self.pr_for(sha)
+        if pr is None:
+            return None
+        return {'login': None,
+                'prs': [{'number': pr.number,
+                         'author': pr.author,
+                         'shas': pr.shas}]}
+
+
 def track_pr(shas_to_try, repo, author_shas, token=None):
     """ Get PR from SHAs in `shas_to_try`, return GH user if visible in merge
 
-    Reject PRs where not all commits are in full list of authors commit shas
-    `author_shas`.
+    Reject PRs where not all commits are in full collection of authors commit
+    shas `author_shas`.  Use a set for `author_shas`, for fast membership
+    checks.
     """
     pr = sha2pr(shas_to_try[0], repo, token)
     if pr is None:
@@ -293,20 +1263,142 @@ def sha2pr(sha, repo, token=None):
     return repo.pull_request(prs[0]['node']['number']) if prs else None
 
 
-def gh_user2ev_emails(gh_user):
+# Maximum number of SHAs to resolve in one GraphQL query.
+SHA_BATCH_SIZE = 100
+
+# Maximum number of commits to fetch for each pull request.
+PR_MAX_COMMITS = 100
+
+SHA_INFO_QUERY = """\
+  c%d: object(expression: "%s") {
+    ... on Commit {
+      author { user { login } }
+      associatedPullRequests(first: 2) {
+        nodes {
+          number
+          author { login }
+          commits(first: %d) {
+            totalCount
+            nodes { commit { oid } }
+          }
+        }
+      }
+    }
+  }"""
+
+
+def shas2info(shas, repo_name, owner, token=None):
+    """ Get Github user, pull requests for `shas` in one GraphQL query
+
+    Parameters
+    ----------
+    shas : sequence
+        Commit SHAs in repository.  Use up to about ``SHA_BATCH_SIZE`` SHAs.
+    repo_name : str
+        Github repository name.
+    owner : str
+        Github organization or user owning repository.
+    token : None or str, optional
+        Github token for authentication.
+
+    Returns
+    -------
+    sha_info : dict
+        Keys are SHAs, values are dicts with keys ``login``, for the Github
+        user of the commit author, or None, and ``prs``, a list of
+        associated pull requests.  Each pull request is a dict with keys
+        ``number``, ``author`` (Github user), and ``shas``, a list of PR
+        commit SHAs, or None if the PR has too many commits to list.
+    """
+    if len(shas) == 0:
+        return {}
+    parts = [SHA_INFO_QUERY % (i, sha, PR_MAX_COMMITS)
+             for i, sha in enumerate(shas)]
+    query = '{\n  repository(name: "%s", owner: "%s") {\n%s\n  }\n}' % (
+        repo_name, owner, '\n'.join(parts))
+    answer = graphql_query(query, token)
+    if not answer.get('data'):
+        raise ValueError(f'GraphQL query failed with {answer.get("errors")}')
+    repository = answer['data']['repository']
+    sha_info = {}
+    for i, sha in enumerate(shas):
+        commit = repository[f'c{i}'] or {}
+        author = (commit.get('author') or {}).get('user') or {}
+        prs = []
+        for node in (commit.get('associatedPullRequests') or {}).get(
+            'nodes', []):
+            commits = node['commits']
+            pr_shas = [n['commit']['oid'] for n in commits['nodes']]
+            prs.append({
+                'number': node['number'],
+                'author': (node['author'] or {}).get('login'),
+                'shas': (pr_shas if len(pr_shas) == commits['totalCount']
+                         else None)})
+        sha_info[sha] = {'login': author.get('login'), 'prs': prs}
+    return sha_info
+
+
+def track_pr_info(shas_to_try, sha_info, author_shas):
+    """ Get PR author for ``shas_to_try[0]`` from resolved `sha_info`
+
+    As for :func:`track_pr`, but using `sha_info` from :func:`shas2info` for
+    the first SHA in `shas_to_try`, instead of querying Github.  Removes
+    first SHA and any other PR SHAs from `shas_to_try` in-place.  Returns
+    None if there is not exactly one PR for this SHA, if we don't know all
+    the PR commits, or if any PR commits are not in `author_shas`.
+    """
+    shas_to_try.pop(0)
+    prs = sha_info['prs']
+    if len(prs) != 1 or prs[0]['shas'] is None:
+        return None
+    pr = prs[0]
+    for sha in pr['shas']:
+        if sha in shas_to_try:
+            shas_to_try.remove(sha)
+    if all(sha in author_shas for sha in pr['shas']):
+        return pr['author']
+
+
+def prefetch_sha_info(contribs, n_prs=None, token=None):
+    """ Resolve candidate SHAs for `contribs` in batched queries per repo
+
+    Use before guessing Github users for `contribs`, to save many separate
+    queries.
+    """
+    by_repo = {}
+    for c in contribs:
+        by_repo.setdefault(c.repo, []).extend(c.candidate_shas(n_prs))
+    for repo, shas in by_repo.items():
+        repo.resolve_shas(shas, token)
+
+
+def gh_user2ev_emails(gh_user, email_index=EMAIL_INDEX):
     """ Read any emails in pushes in `gh_user`'s event feed
 
     These can easily be someone else's commits, but it often shows the user's
-    email(s).
+    email(s).  Record emails in `email_index`, if not None, and only read
+    events newer than the ones recorded there.  Return counts of all
+    recorded emails for `gh_user`.
     """
-    user = GH.user(gh_user)
-    emails = []
+    user = get_gh().user(gh_user)
+    names = [user.name] if user.name else []
+    latest = None if email_index is None else email_index.latest_event(
+        gh_user)
+    events = []
+    # Events come newest first.
     for e in user.events():
+        if latest is not None and int(e.id) <= latest:
+            break
         if e.type != 'PushEvent':
             continue
-        for c in e.payload['commits']:
-            emails.append(c['author'].get('email'))
-    return Counter(emails)
+        events.append((int(e.id), [(c['author'].get('name'),
+                                    c['author'].get('email'))
+                                   for c in e.payload['commits']]))
+    if email_index is None:
+        return Counter(email for eid, authors in events
+                       for name, email in authors)
+    email_index.add_events(gh_user, events, names)
+    return email_index.user_emails(gh_user)
 
 
 def merge_dicts(first, second):
@@ -361,62 +1453,526 @@ def get_last_gh_users():
         start_at = sha + '^'
 
 
+def merge_contributors(contribs, new_contribs):
+    """ Add commits from `new_contribs` to matching contributors in `contribs`
+
+    Match contributors on (mailmapped) name, as ``git shortlog`` does.  Assume
+    commits in `new_contribs` are more recent than those in `contribs`.
+    Contributors in `contribs` keep their identity, but get new commits.
+    Returns list of contributors, sorted as for ``git shortlog -n``, with
+    commits for all contributors in one new :class:`CommitTable`.
+    """
+    by_name = {c.name: c for c in contribs}
+    merged = list(contribs)
+    commit_lists = {c.name: [c.commits] for c in contribs}
+    for new_c in new_contribs:
+        if new_c.name in by_name:
+            commit_lists[new_c.name].append(new_c.commits)
+        else:
+            merged.append(new_c)
+            commit_lists[new_c.name] = [new_c.commits]
+    table = CommitTable(capacity=sum(len(c) for c in contribs) +
+                        sum(len(c) for c in new_contribs))
+    lengths = {name: sum(len(v) for v in views)
+               for name, views in commit_lists.items()}
+    # Shortlog sorts by commit count, then by name, comparing bytes.
+    merged.sort(key=lambda c: (-lengths[c.name], c.name.encode('utf-8')))
+    for c in merged:
+        start = len(table)
+        for view in commit_lists[c.name]:
+            table.extend(view)
+        c.commits = table.view(start)
+    return merged
+
+
+def compact_contributors(contribs):
+    """ Copy commits of `contribs` into one new table, modifying in-place
+
+    Use to drop commits of other contributors from the table, for example
+    before sending `contribs` to another process.  Returns `contribs`.
+    """
+    table = CommitTable.from_views(c.commits for c in contribs)
+    start = 0
+    for c in contribs:
+        c.commits = table.view(start, start + len(c))
+        start += len(c)
+    return contribs
+
+
+def save_contributors(contribs, dirname):
+    """ Save commit table and contributor boundaries for `contribs`
+
+    Writes one ``.npy`` file per :class:`CommitTable` column, so we can load
+    them as memory maps with :func:`load_contributors`.
+    """
+    table = CommitTable.from_views(c.commits for c in contribs)
+    tmp_dirname = dirname + '.tmp'
+    if exists(tmp_dirname):
+        shutil.rmtree(tmp_dirname)
+    os.makedirs(tmp_dirname)
+    for name, dtype in CommitTable.columns:
+        np.save(pjoin(tmp_dirname, f'{name}.npy'), getattr(table, name))
+    np.save(pjoin(tmp_dirname, 'bounds.npy'),
+            np.cumsum([0] + [len(c) for c in contribs]))
+    with open(pjoin(tmp_dirname, 'strings.json'), 'wt') as fobj:
+        json.dump({'names': table.names.strings,
+                   'emails': table.emails.strings}, fobj)
+    if exists(dirname):
+        shutil.rmtree(dirname)
+    os.replace(tmp_dirname, dirname)
+
+
+def load_contributors(dirname, repo):
+    """ Load contributors for `repo` saved with :func:`save_contributors`
+    """
+    columns = {name: np.load(pjoin(dirname, f'{name}.npy'), mmap_mode='r')
+               for name, dtype in CommitTable.columns}
+    with open(pjoin(dirname, 'strings.json'), 'rt') as fobj:
+        strings = json.load(fobj)
+    table = CommitTable.from_columns(columns,
+                                     strings['names'],
+                                     strings['emails'])
+    bounds = np.load(pjoin(dirname, 'bounds.npy')).tolist()
+    return [repo.contrib_maker(table.view(start, stop), repo)
+            for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
 class RepoGetter:
     """ Cache and return read data for repositories
+
+    If `cache_dir` is not None, also keep parsed contributors on disk, in
+    `cache_dir`, keyed by repository path and HEAD commit.  If `incremental`
+    is True, and the cache has contributors for an earlier HEAD, only parse
+    the commits since that HEAD, and merge them into the cached contributors.
     """
 
-    def __init__(self):
+    def __init__(self, cache_dir=None, incremental=True):
+        self.cache_dir = cache_dir
+        self.incremental = incremental
         self._rcache = {}
         self._ccache = {}
+        self._icache = {}
 
-    def get_repo(self, repo_name):
+    def get_repo(self, repo_name, org=None):
         if repo_name not in self._rcache:
-            self._rcache[repo_name] = Repo(repo_name)
+            self._rcache[repo_name] = Repo(repo_name, org)
         return self._rcache[repo_name]
 
-    def get_contributors(self, repo_name):
-        repo = self.get_repo(repo_name)
+    def get_contributors(self, repo_name, org=None):
+        repo = self.get_repo(repo_name, org)
         if repo_name not in self._ccache:
-            self._ccache[repo_name] = repo.contributors()
+            self._ccache[repo_name] = self._read_contributors(repo)
         return self._ccache[repo_name]
 
+    def contributor_index(self, repo_name, org=None):
+        """ Dicts mapping names and emails to contributors for `repo_name`
+
+        Returns
+        -------
+        by_name : dict
+            Maps each contributor name to contributor.  Main names
+            (:attr:`RepoContributor.name`) take precedence over other names.
+        by_email : dict
+            Maps each contributor email to contributor.
+        """
+        if repo_name not in self._icache:
+            contribs = self.get_contributors(repo_name, org)
+            by_name = {c.name: c for c in reversed(contribs)}
+            by_email = {}
+            for c in contribs:
+                for name in c.names:
+                    by_name.setdefault(name, c)
+                for email in c.emails:
+                    by_email.setdefault(email, c)
+            self._icache[repo_name] = by_name, by_email
+        return self._icache[repo_name]
+
+    def find_contributor(self, repo_name, name=None, email=None, org=None):
+        """ Contributor to `repo_name` with `name` or `email`, or None
+
+        Look up by `name` first, if given, then by `email`.
+        """
+        by_name, by_email = self.contributor_index(repo_name, org)
+        contrib = by_name.get(name) if name is not None else None
+        if contrib is None and email is not None:
+            contrib = by_email.get(email)
+        return contrib
+
+    def repo_cache_dir(self, repo):
+        """ Directory containing on-disk cache for `repo`
+        """
+        path_key = sha1(repo.path.encode('utf-8')).hexdigest()[:12]
+        return pjoin(self.cache_dir, f'{repo.name}_{path_key}')
+
+    def last_head(self, repo):
+        """ HEAD commit for last contributors cached for `repo`, or None
+        """
+        repo_dir = self.repo_cache_dir(repo)
+        if not exists(repo_dir):
+            return None
+        heads = [f for f in os.listdir(repo_dir) if not f.endswith('.tmp')]
+        return heads[0] if len(heads) == 1 else None
+
+    def _read_contributors(self, repo):
+        if self.cache_dir is None:
+            return repo.contributors()
+        head = repo.head_sha()
+        repo_dir = self.repo_cache_dir(repo)
+        head_dir = pjoin(repo_dir, head)
+        if exists(head_dir):
+            return load_contributors(head_dir, repo)
+        last = self.last_head(repo) if self.incremental else None
+        if last and repo.can_update(last, head):
+            contribs = merge_contributors(
+                load_contributors(pjoin(repo_dir, last), repo),
+                repo.contributors(f'{last}..{head}'))
+        else:
+            contribs = repo.contributors(head)
+        save_contributors(contribs, head_dir)
+        # We only need the cache for the current HEAD.
+        for fname in os.listdir(repo_dir):
+            if fname != head:
+                shutil.rmtree(pjoin(repo_dir, fname))
+        return contribs
+
+
+# Marks missing cache entries; cached user data can be None.
+_MISSING = object()
+
+# Default time in seconds before cached user data are stale.
+USER_TTL = 30 * 24 * 60 * 60
+
+
+def _as_entry(value):
+    if isinstance(value, dict) and value.keys() == {'fetched', 'data'}:
+        return value
+    # Entry from before we recorded fetch times.
+    return {'fetched': None, 'data': value}
+
 
 class UserGetter:
     """ Cache and return Github user data
+
+    Each cache entry records the time at which we fetched the data.  After
+    `ttl` seconds, the entry is stale.  By default, we return stale data
+    straight away, and refresh it in a background thread.  We refresh at
+    most `max_background` entries this way, so that a large stale cache
+    does not cause a burst of requests; use :meth:`refresh_oldest` to
+    refresh more, a few at a time, over several runs.
+
+    Parameters
+    ----------
+    cache_fname : None or str, optional
+        Filename of SQLite database in which to cache user data.  If
+        `cache_fname` ends in ``.json``, use a database with the same name
+        and extension ``.sqlite``, and import the JSON cache into the
+        database the first time we use it.  If None, and `store` is None,
+        cache in memory only.
+    store : None or mapping, optional
+        Mapping in which to cache user data, such as a
+        :class:`kvstore.SQLiteStore`.  Overrides `cache_fname`.
+    ttl : None or float, optional
+        Seconds after fetching until data are stale.  None means data never
+        go stale.
+    on_stale : {'background', 'serve', 'fetch'}, optional
+        What to do for stale entries.  'background' returns stale data and
+        refreshes in the background; 'serve' returns stale data; 'fetch'
+        fetches new data before returning.
+    max_background : int, optional
+        Maximum number of background refreshes for this getter.
+    clock : callable, optional
+        Function returning current time in seconds since the epoch.
     """
 
-    def __init__(self, cache_fname=None):
-        self._GH = GH
+    def __init__(self, cache_fname=None, store=None, ttl=USER_TTL,
+                 on_stale='background', max_background=100,
+                 clock=time.time):
+        if on_stale not in ('background', 'serve', 'fetch'):
+            raise ValueError(f'Invalid on_stale value {on_stale}')
         self.cache_fname = cache_fname
-        if cache_fname:
-            self.load_cache()
-        else:
-            self.clear_cache()
+        self.json_fname = None
+        if store is None and cache_fname:
+            root, ext = splitext(cache_fname)
+            if ext == '.json':
+                self.json_fname = cache_fname
+                cache_fname = root + '.sqlite'
+            store = SQLiteStore(cache_fname, 'users')
+        self._store = {} if store is None else store
+        self._imported = self.json_fname is None
+        self.ttl = ttl
+        self.on_stale = on_stale
+        self.max_background = max_background
+        self.clock = clock
+        self._executor = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._import_lock = threading.Lock()
+
+    @property
+    def _cache(self):
+        if not self._imported:
+            # Other threads wait for the import; retry if the import fails.
+            with self._import_lock:
+                if not self._imported:
+                    self.import_json(self.json_fname)
+                    self._imported = True
+        return self._store
+
+    def import_json(self, json_fname):
+        """ Import user data from JSON file `json_fname`, if not yet cached
+
+        We only import if our store is empty and not yet on disk.  Imported
+        entries have no fetch time, so they are stale.
+        """
+        store = self._store
+        if store.exists if hasattr(store, 'exists') else len(store):
+            return
+        if not exists(json_fname):
+            return
+        with open(json_fname, 'rt') as fobj:
+            store.update((gh_user, {'fetched': None, 'data': data})
+                         for gh_user, data in json.load(fobj).items())
 
     def load_cache(self):
+        # Store reads entries on demand; nothing to do.
         if self.cache_fname is None:
             raise ValueError('No cache_fname to load from')
-        if not exists(self.cache_fname):
-            self._cache = {}
-            return
-        with open(self.cache_fname, 'rt') as fobj:
-            self._cache = json.load(fobj)
 
     def save_cache(self):
+        # Store writes each entry as we fetch it; nothing to do.
         if self.cache_fname is None:
             raise ValueError('No cache_fname to save to')
-        with open(self.cache_fname, 'wt') as fobj:
-            json.dump(self._cache, fobj)
 
     def clear_cache(self):
-        self._cache = {}
+        self._cache.clear()
+
+    def _entry(self, gh_user):
+        entry = self._cache.get(gh_user, _MISSING)
+        return entry if entry is _MISSING else _as_entry(entry)
+
+    def is_stale(self, entry):
+        """ True if cache `entry` is older than our TTL
+        """
+        if self.ttl is None:
+            return False
+        fetched = entry['fetched']
+        return fetched is None or self.clock() - fetched > self.ttl
 
     def __call__(self, gh_user):
-        if gh_user not in self._cache:
-            self._cache[gh_user] = self._get_gh_user(gh_user)
-        return self._cache[gh_user]
+        entry = self._entry(gh_user)
+        if entry is _MISSING:
+            return self._fetch(gh_user)
+        if self.is_stale(entry):
+            if self.on_stale == 'fetch':
+                return self._fetch(gh_user)
+            if self.on_stale == 'background':
+                self._refresh_background(gh_user)
+        return entry['data']
+
+    def _fetch(self, gh_user):
+        data = self._get_gh_user(gh_user)
+        self._cache[gh_user] = {'fetched': self.clock(), 'data': data}
+        return data
+
+    def _refresh_background(self, gh_user):
+        with self._lock:
+            if (gh_user in self._pending or
+                len(self._pending) >= self.max_background):
+                return
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(1)
+            self._pending[gh_user] = self._executor.submit(
+                self._fetch, gh_user)
+
+    def wait(self):
+        """ Wait for background refreshes to finish
+
+        Returns dict with keys of refreshed users, and values of exceptions
+        from refreshes that failed, or None.
+        """
+        with self._lock:
+            pending = dict(self._pending)
+        return {gh_user: future.exception()
+                for gh_user, future in pending.items()}
+
+    def refresh(self, gh_users=None):
+        """ Fetch data again for `gh_users`, default all cached users
+
+        Github requests go through the HTTP cache, so refreshing a user whose
+        data have not changed only costs a conditional request, which does
+        not count against the rate limit.
+        """
+        gh_users = list(self._cache) if gh_users is None else gh_users
+        for gh_user in gh_users:
+            self._fetch(gh_user)
+
+    def oldest(self, n):
+        """ Up to `n` cached users with the oldest data, oldest first
+
+        Users with no fetch time come first.
+        """
+        if n <= 0:
+            return []
+        if hasattr(self._cache, 'keys_by'):
+            # Let the database do the sorting.
+            return self._cache.keys_by('fetched', n)
+        times = {gh_user: _as_entry(value)['fetched']
+                 for gh_user, value in self._cache.items()}
+        return sorted(times, key=lambda u: (times[u] is not None,
+                                            times[u] or 0))[:n]
+
+    def refresh_oldest(self, n, stale_only=True):
+        """ Refresh `n` users with the oldest data
+
+        If `stale_only` is True, only refresh users with stale data.
+        Returns list of refreshed users.
+        """
+        gh_users = self.oldest(n)
+        if stale_only:
+            gh_users = [u for u in gh_users if self.is_stale(self._entry(u))]
+        self.refresh(gh_users)
+        return gh_users
 
     def _get_gh_user(self, gh_user):
         if gh_user.startswith('+') or gh_user in ('None',):
             return None
-        return self._GH.user(gh_user).as_dict()
+        return get_gh().user(gh_user).as_dict()
+
+
+class AsyncGitHub:
+    """ Run Github lookups concurrently from asyncio
+
+    The Github calls in this module are blocking, so we run each in a worker
+    thread, allowing at most `max_concurrency` calls in flight at any one
+    time.
+
+    Examples
+    --------
+    >>> agh = AsyncGitHub(max_concurrency=4)
+    >>> gh_users = asyncio.run(agh.guess_gh_users(contribs))  # doctest: +SKIP
+    """
+
+    def __init__(self, max_concurrency=8):
+        self.max_concurrency = max_concurrency
+        # Semaphores belong to an event loop; make one per loop.
+        self._semaphores = WeakKeyDictionary()
+
+    def _semaphore(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphores[loop]
+
+    async def run(self, func, *args, **kwargs):
+        """ Run blocking `func` with `args`, `kwargs` in worker thread
+        """
+        async with self._semaphore():
+            return await asyncio.to_thread(func, *args, **kwargs)
+
+    async def map(self, func, iterable, *args, **kwargs):
+        """ Run `func` on each value in `iterable`, return results in order
+        """
+        return await asyncio.gather(
+            *(self.run(func, value, *args, **kwargs) for value in iterable))
+
+    async def graphql_query(self, query, token=None):
+        return await self.run(graphql_query, query, token)
+
+    async def sha2gh_user(self, sha, repo):
+        return await self.run(sha2gh_user, sha, repo)
+
+    async def sha2pr(self, sha, repo, token=None):
+        return await self.run(sha2pr, sha, repo, token)
+
+    async def pr_commit_shas(self, pr):
+        return await self.run(lambda: [c.sha for c in pr.commits()])
+
+    async def gh_user2ev_emails(self, gh_user):
+        return await self.run(gh_user2ev_emails, gh_user)
+
+    async def user(self, gh_user, user_getter=None):
+        """ User data for `gh_user` from `user_getter`, or from Github
+        """
+        user_getter = UserGetter() if user_getter is None else user_getter
+        return await self.run(user_getter, gh_user)
+
+    async def guess_gh_user(self, contrib, n_prs=None, token=None):
+        return await self.run(contrib.guess_gh_user, n_prs, token)
+
+    async def guess_gh_users(self, contribs, n_prs=None, token=None):
+        """ Guess Github users for sequence of `contribs`, concurrently
+
+        See :meth:`RepoContributor.guess_gh_user`.
+        """
+        await self.run(prefetch_sha_info, contribs, n_prs, token)
+        return await asyncio.gather(
+            *(self.guess_gh_user(c, n_prs, token) for c in contribs))
+
+
+class IdentityResolver:
+    """ Guess Github users across repositories, once per identity
+
+    Contributors with an email or name already in the shared
+    :class:`IdentityIndex` get the Github user from the index.  Of the
+    others, we look up the first contributor with each email, in the order
+    given, and add the results to the index.  Then we look up any
+    contributors that the index still cannot resolve.  The result does not
+    depend on the order in which lookups finish.
+    """
+
+    def __init__(self, agh, index=None):
+        self.agh = agh
+        self.index = IdentityIndex() if index is None else index
+
+    async def _guess_rounds(self, contribs, rounds):
+        gh_users = [None] * len(contribs)
+        for indices in rounds:
+            indices = [i for i in indices
+                       if self.index.lookup(contribs[i]) is None]
+            guessed = await self.agh.guess_gh_users(
+                [contribs[i] for i in indices])
+            # Add to index in input order.
+            for i, gh_user in zip(indices, guessed):
+                gh_users[i] = gh_user
+                self.index.add(contribs[i], gh_user)
+        return gh_users
+
+    async def guess_gh_users(self, contribs):
+        """ Guess Github users for sequence of `contribs`
+
+        Returns list of Github users (or None), in same order as `contribs`.
+        """
+        leaders, followers = [], []
+        seen = set()
+        for i, c in enumerate(contribs):
+            if self.index.lookup(c) is not None:
+                continue
+            emails = self.index.emails(c)
+            (followers if seen.intersection(emails) else leaders).append(i)
+            seen.update(emails)
+        gh_users = await self._guess_rounds(contribs, (leaders, followers))
+        return [self.index.lookup(c) if gh_user is None else gh_user
+                for c, gh_user in zip(contribs, gh_users)]
+
+
+def run_sync(coro):
+    """ Run coroutine `coro` to completion, return result
+
+    Like :func:`asyncio.run`, but also works when called from a running event
+    loop, as in Jupyter, by running `coro` in a new loop in another thread.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+
+def guess_gh_users(contribs, n_prs=None, token=None, max_concurrency=8):
+    """ Guess Github users for `contribs`, running up to `max_concurrency`
+
+    Returns list of guessed users, in same order as `contribs`.
+    """
+    agh = AsyncGitHub(max_concurrency)
+    return run_sync(agh.guess_gh_users(contribs, n_prs, token))
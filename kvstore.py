@@ -0,0 +1,135 @@
+""" Persistent key-value stores
+"""
+
+import json
+import sqlite3
+import threading
+from os.path import exists
+
+
+class SQLiteStore:
+    """ Persistent mapping from string keys to JSON-serializable values
+
+    Data live in table `table` of SQLite database `fname`.  We commit each
+    write immediately, so the store survives interruption.  We only open the
+    database on first use.  It is safe to use the same store from more than
+    one thread.
+    """
+
+    def __init__(self, fname, table='kv'):
+        self.fname = fname
+        self.table = table
+        self._conn = None
+        self._lock = threading.RLock()
+
+    def __getstate__(self):
+        # Connections and locks don't pickle; reopen on first use.
+        return {'fname': self.fname, 'table': self.table}
+
+    def __setstate__(self, state):
+        self.__init__(state['fname'], state['table'])
+
+    @property
+    def exists(self):
+        """ True if database file exists already
+        """
+        return self._conn is not None or exists(self.fname)
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            if self._conn is None:
+                # Autocommit, except in explicit transactions.
+                self._conn = sqlite3.connect(self.fname,
+                                             isolation_level=None,
+                                             check_same_thread=False)
+                self._conn.execute(
+                    f'CREATE TABLE IF NOT EXISTS "{self.table}" '
+                    '(key TEXT PRIMARY KEY, value TEXT)')
+            return self._conn.execute(sql.format(table=self.table), params)
+
+    def __getitem__(self, key):
+        with self._lock:
+            row = self._execute(
+                'SELECT value FROM "{table}" WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return json.loads(row[0])
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._execute('SELECT 1 FROM "{table}" WHERE key = ?',
+                                 (key,)).fetchone() is not None
+
+    def __setitem__(self, key, value):
+        self.update({key: value})
+
+    def update(self, mapping):
+        """ Set all keys, values in `mapping` in one transaction
+        """
+        items = mapping.items() if hasattr(mapping, 'items') else mapping
+        with self._lock:
+            self._execute('BEGIN')
+            try:
+                for key, value in items:
+                    self._execute(
+                        'INSERT OR REPLACE INTO "{table}" VALUES (?, ?)',
+                        (key, json.dumps(value)))
+            except BaseException:
+                self._execute('ROLLBACK')
+                raise
+            self._execute('COMMIT')
+
+    def __delitem__(self, key):
+        with self._lock:
+            if key not in self:
+                raise KeyError(key)
+            self._execute('DELETE FROM "{table}" WHERE key = ?', (key,))
+
+    def __len__(self):
+        with self._lock:
+            return self._execute('SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        with self._lock:
+            return [r[0] for r in self._execute('SELECT key FROM "{table}"')]
+
+    def items(self):
+        with self._lock:
+            return [(k, json.loads(v)) for k, v in
+                    self._execute('SELECT key, value FROM "{table}"')]
+
+    def keys_by(self, field, n=None):
+        """ Up to `n` keys, in order of `field` of their (dict) values
+
+        Keys with missing or null `field` come first.  `field` should be a
+        Python identifier.  We index the table on `field` on first use.
+        """
+        if not field.isidentifier():
+            raise ValueError(f'Invalid field name {field}')
+        expr = f"json_extract(value, '$.{field}')"
+        with self._lock:
+            self._execute(f'CREATE INDEX IF NOT EXISTS "{{table}}_{field}" '
+                          f'ON "{{table}}" ({expr})')
+            sql = f'SELECT key FROM "{{table}}" ORDER BY {expr}'
+            if n is None:
+                return [r[0] for r in self._execute(sql)]
+            return [r[0] for r in self._execute(sql + ' LIMIT ?', (n,))]
+
+    def clear(self):
+        with self._lock:
+            self._execute('DELETE FROM "{table}"')
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
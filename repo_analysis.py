@@ -3,9 +3,12 @@
 
 import pandas as pd
 
-from gputils import RepoGetter
+from gputils import RepoGetter, REPO_CACHE_DIR, set_offline
 
-REPO_GETTER = RepoGetter()
+# This analysis only needs local data.
+set_offline()
+
+REPO_GETTER = RepoGetter(REPO_CACHE_DIR)
 
 # Load user data
 users = pd.read_csv('users_locations.csv')
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+""" Make synthetic git repositories for scale testing
+
+Build a local repository with ``git fast-import``, with many commits spread
+over authors with Zipf-like weights.  Some commits use an alias name and
+email for their author, and the ``.mailmap`` maps some of these aliases back
+to the main identity.  Some authors have Github noreply emails.  Authors
+have a home timezone, and sometimes travel.  Some runs of commits arrive as
+pull requests, merged into the mainline with Github "Merge pull request"
+commits.
+
+    python synth_repo.py /tmp/big_repo --n-commits 1000000
+"""
+
+from subprocess import check_call, Popen, PIPE
+from collections import namedtuple
+from argparse import ArgumentParser
+
+import numpy as np
+
+# Exponent for Zipf-like spread of commits over authors.
+ZIPF_S = 1.2
+
+# Timezone offsets (minutes) for authors.
+TZ_OFFSETS = np.array([-480, -420, -300, -240, -180, 0, 60, 120, 330, 480,
+                       540, 600])
+
+START_EPOCH = 1_000_000_000
+
+# Identity of Github for merge commits.
+GH_COMMITTER = 'GitHub <noreply@github.com>'
+
+# Number of commits to send to fast-import at a time.
+CHUNK_SIZE = 10_000
+
+SynthAuthor = namedtuple(
+    'SynthAuthor',
+    ('name', 'email', 'alias_name', 'alias_email', 'gh_user', 'tz_offset',
+     'mailmapped'))
+
+SynthInfo = namedtuple('SynthInfo', ('authors', 'commit_authors', 'prs'))
+
+
+def make_authors(n_authors, noreply_frac=0.1, mailmap_frac=0.5, rng=None):
+    """ List of `n_authors` :class:`SynthAuthor`
+
+    A fraction `noreply_frac` of authors have Github noreply emails, and a
+    fraction `mailmap_frac` have their alias in the ``.mailmap``.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    tzs = rng.choice(TZ_OFFSETS, n_authors)
+    noreply = rng.random(n_authors) < noreply_frac
+    mailmapped = rng.random(n_authors) < mailmap_frac
+    authors = []
+    for k in range(n_authors):
+        gh_user = f'author{k}'
+        email = (f'{1000 + k}+{gh_user}@users.noreply.github.com'
+                 if noreply[k] else f'{gh_user}@example{k % 7}.org')
+        authors.append(SynthAuthor(f'Author {k}', email, gh_user,
+                                   f'a{k}@laptop.local', gh_user,
+                                   int(tzs[k]), bool(mailmapped[k])))
+    return authors
+
+
+def zipf_authors(n, n_authors, zipf_s=ZIPF_S, rng=None):
+    """ Array of `n` author indices, with Zipf-like weights
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    weights = 1 / np.arange(1, n_authors + 1) ** zipf_s
+    return rng.choice(n_authors, n, p=weights / weights.sum())
+
+
+def git_tz(offset):
+    """ Offset in minutes as git timezone string, such as ``+0530``
+    """
+    sign = '-' if offset < 0 else '+'
+    hours, minutes = divmod(abs(int(offset)), 60)
+    return f'{sign}{hours:02d}{minutes:02d}'
+
+
+def mailmap(authors):
+    """ Text of ``.mailmap`` mapping aliases for mailmapped `authors`
+    """
+    return ''.join(f'{a.name} <{a.email}> {a.alias_name} <{a.alias_email}>\n'
+                   for a in authors if a.mailmapped)
+
+
+def _data(text):
+    return f'data {len(text.encode("utf-8"))}\n{text}\n'
+
+
+def _commit(mark, author, epoch, tz, message, parents=(), committer=None,
+            files=()):
+    # Commit command for fast-import stream.
+    date = f'{epoch} {git_tz(tz)}'
+    committer = author if committer is None else committer
+    lines = [f'commit refs/heads/main\nmark :{mark}\n'
+             f'author {author} {date}\ncommitter {committer} {date}\n',
+             _data(message)]
+    if parents:
+        lines.append(f'from :{parents[0]}\n')
+    lines += [f'merge :{p}\n' for p in parents[1:]]
+    lines += [f'M 644 inline {fname}\n{_data(text)}'
+              for fname, text in files]
+    return ''.join(lines) + '\n'
+
+
+def make_repo(path, n_commits=10_000, n_authors=None, zipf_s=ZIPF_S,
+              alias_frac=0.2, noreply_frac=0.1, mailmap_frac=0.5,
+              travel_frac=0.05, pr_frac=0.3, max_pr_size=5, n_maintainers=3,
+              seed=0):
+    """ Make git repository at `path` with `n_commits` non-merge commits
+
+    Parameters
+    ----------
+    path : str
+        Directory for new repository.
+    n_commits : int, optional
+        Number of non-merge commits.  There is also one merge commit for
+        each pull request.
+    n_authors : None or int, optional
+        Number of authors.  Default is one author per 50 commits.
+    zipf_s : float, optional
+        Exponent for Zipf-like spread of commits over authors.
+    alias_frac : float, optional
+        Fraction of commits with author alias name and email.
+    noreply_frac : float, optional
+        Fraction of authors with Github noreply emails.
+    mailmap_frac : float, optional
+        Fraction of authors with alias in ``.mailmap``.
+    travel_frac : float, optional
+        Fraction of commits in a random timezone, rather than author's home
+        timezone.
+    pr_frac : float, optional
+        Probability that each run of commits is a pull request.
+    max_pr_size : int, optional
+        Maximum number of commits in a pull request.
+    n_maintainers : int, optional
+        Merge commits come from the top `n_maintainers` authors.
+    seed : int, optional
+        Seed for random number generator.
+
+    Returns
+    -------
+    info : :class:`SynthInfo`
+        With `authors`, the list of :class:`SynthAuthor`; `commit_authors`,
+        the author index for each non-merge commit, in commit order; and
+        `prs`, a list of (PR number, author index, number of commits).
+    """
+    rng = np.random.default_rng(seed)
+    n_authors = max(1, n_commits // 50) if n_authors is None else n_authors
+    authors = make_authors(n_authors, noreply_frac, mailmap_frac, rng)
+    # Runs of commits by one author, some of which are pull requests.
+    is_pr = rng.random(n_commits) < pr_frac
+    is_pr[0] = False  # Root commit on mainline.
+    sizes = np.where(is_pr, rng.integers(1, max_pr_size + 1, n_commits), 1)
+    n_runs = np.searchsorted(np.cumsum(sizes), n_commits) + 1
+    is_pr, sizes = is_pr[:n_runs], sizes[:n_runs]
+    sizes[-1] -= sizes.sum() - n_commits
+    who = np.repeat(zipf_authors(n_runs, n_authors, zipf_s, rng), sizes)
+    tzs = np.array([a.tz_offset for a in authors])[who]
+    travel = rng.random(n_commits) < travel_frac
+    tzs[travel] = rng.choice(TZ_OFFSETS, travel.sum())
+    aliased = rng.random(n_commits) < alias_frac
+    epochs = START_EPOCH + np.cumsum(rng.integers(60, 7200, n_commits))
+    maintainers = rng.integers(min(n_maintainers, n_authors), size=n_runs)
+    idents = [(f'{a.name} <{a.email}>', f'{a.alias_name} <{a.alias_email}>')
+              for a in authors]
+    files = [('README.md', 'Synthetic repository\n'),
+             ('.mailmap', mailmap(authors))]
+    check_call(['git', 'init', '-q', '-b', 'main', path])
+    proc = Popen(['git', 'fast-import', '--quiet'], cwd=path, stdin=PIPE,
+                 text=True, encoding='utf-8')
+    # Python lists are faster to index in the loop below.
+    who, tzs, epochs, aliased = (who.tolist(), tzs.tolist(), epochs.tolist(),
+                                 aliased.tolist())
+    prs = []
+    chunk = []
+    mark = tip = start = 0
+    for run, size in enumerate(sizes.tolist()):
+        stop = start + size
+        k = who[start]
+        parent = tip
+        for i in range(start, stop):
+            mark += 1
+            message = (f'PR {len(prs) + 1} change {i}' if is_pr[run] else
+                       f'Change {i}')
+            chunk.append(_commit(mark, idents[k][aliased[i]], epochs[i],
+                                 tzs[i], message,
+                                 (parent,) if parent else (),
+                                 files=files if mark == 1 else ()))
+            parent = mark
+        if is_pr[run]:
+            number = len(prs) + 1
+            prs.append((number, k, size))
+            mark += 1
+            maintainer = maintainers[run]
+            chunk.append(_commit(
+                mark, idents[maintainer][0], epochs[stop - 1] + 60,
+                authors[maintainer].tz_offset,
+                f'Merge pull request #{number} from '
+                f'{authors[k].gh_user}/branch-{number}\n\nPR {number}',
+                (tip, parent), GH_COMMITTER))
+        tip = mark
+        start = stop
+        if len(chunk) >= CHUNK_SIZE:
+            proc.stdin.write(''.join(chunk))
+            chunk = []
+    proc.stdin.write(''.join(chunk))
+    proc.stdin.close()
+    if proc.wait():
+        raise RuntimeError(f'git fast-import failed for {path}')
+    # Check out files, including .mailmap, for shortlog.
+    check_call(['git', 'reset', '-q', '--hard'], cwd=path)
+    return SynthInfo(authors, np.array(who), prs)
+
+
+def get_parser():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', help='Directory for new repository')
+    parser.add_argument('-n', '--n-commits', type=int, default=10_000,
+                        help='Number of non-merge commits')
+    parser.add_argument('-a', '--n-authors', type=int,
+                        help='Number of authors (default one per 50 '
+                        'commits)')
+    parser.add_argument('--zipf-s', type=float, default=ZIPF_S,
+                        help='Exponent for spread of commits over authors')
+    parser.add_argument('--alias-frac', type=float, default=0.2,
+                        help='Fraction of commits with author alias')
+    parser.add_argument('--noreply-frac', type=float, default=0.1,
+                        help='Fraction of authors with noreply emails')
+    parser.add_argument('--mailmap-frac', type=float, default=0.5,
+                        help='Fraction of authors with alias in .mailmap')
+    parser.add_argument('--travel-frac', type=float, default=0.05,
+                        help='Fraction of commits in random timezone')
+    parser.add_argument('--pr-frac', type=float, default=0.3,
+                        help='Probability a run of commits is a PR')
+    parser.add_argument('--max-pr-size', type=int, default=5,
+                        help='Maximum commits per PR')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random number seed')
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    info = make_repo(args.path, args.n_commits, args.n_authors, args.zipf_s,
+                     args.alias_frac, args.noreply_frac, args.mailmap_frac,
+                     args.travel_frac, args.pr_frac, args.max_pr_size,
+                     seed=args.seed)
+    print(f'{args.path}: {args.n_commits} commits, {len(info.authors)} '
+          f'authors, {len(info.prs)} PRs')
+
+
+if __name__ == '__main__':
+    main()
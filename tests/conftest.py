@@ -0,0 +1,128 @@
+""" Shared fixtures and helpers for tests
+"""
+
+import re
+import sys
+import threading
+from os.path import join as pjoin, abspath, dirname
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+HERE = dirname(__file__)
+sys.path.append(abspath(pjoin(HERE, '..')))
+
+import gputils
+from gputils import (Repo, RepoContributor, UserGetter, MergePRIndex,
+                     parse_sl_line)
+
+H5PY_PATH = pjoin(HERE, 'data', 'h5py')
+
+
+def sl_line(sha, name, email, dt='2018-08-28T23:27:25+00:00'):
+    """ Line of ``git shortlog`` output for commit by `name` and `email`
+    """
+    return f'{sha}||{name}||{email}||{name}||{email}||{dt}'
+
+
+def make_contrib(name, *emails, repo=None):
+    """ Contributor `name` with one commit for each email in `emails`
+    """
+    return RepoContributor(
+        [parse_sl_line(sl_line(f'a{i}', name, email))
+         for i, email in enumerate(emails)], repo)
+
+
+def h5py_contrib(lines, probe_cache=None, email_index=None):
+    """ Contributor to h5py from shortlog `lines`, with no local merge PRs
+    """
+    repo = Repo('h5py', path=H5PY_PATH)
+    repo._merge_prs = MergePRIndex()
+    contrib = RepoContributor([parse_sl_line(L) for L in lines], repo)
+    contrib.probe_cache = probe_cache
+    contrib.email_index = email_index
+    return contrib
+
+
+def pr_node(number, login, shas, total=None):
+    """ PR node from GraphQL query
+    """
+    total = len(shas) if total is None else total
+    return {'number': number,
+            'author': {'login': login},
+            'commits': {'totalCount': total,
+                        'nodes': [{'commit': {'oid': s}} for s in shas]}}
+
+
+class FakeGraphQL:
+    """ Answer commit queries from dicts keyed by SHA
+
+    `logins` maps SHAs to Github commit authors, and `prs` maps SHAs to lists
+    of PR nodes (see :func:`pr_node`).  `queried` records SHAs we were asked
+    about.
+    """
+
+    def __init__(self):
+        self.logins = {}
+        self.prs = {}
+        self.queried = []
+
+    def __call__(self, query, token=None):
+        shas = re.findall(r'object\(expression: "(\w+)"\)', query)
+        self.queried.extend(shas)
+        return {'data': {'repository': {
+            f'c{i}': {'author': {'user': (
+                {'login': self.logins[sha]} if sha in self.logins
+                else None)},
+                      'associatedPullRequests': {
+                          'nodes': self.prs.get(sha, [])}}
+            for i, sha in enumerate(shas)}}}
+
+
+@pytest.fixture
+def fake_graphql(monkeypatch):
+    """ :class:`FakeGraphQL` standing in for ``gputils.graphql_query``
+    """
+    fake = FakeGraphQL()
+    monkeypatch.setattr(gputils, 'graphql_query', fake)
+    return fake
+
+
+class FakeUserGetter(UserGetter):
+    """ User getter with settable clock, recording fetches
+
+    Fetched data have the login, the number of fetches so far, and any
+    fields for the user in dict `users`.
+    """
+
+    def __init__(self, users=None, **kwargs):
+        self.now = 1000
+        super().__init__(clock=lambda: self.now, **kwargs)
+        self.users = {} if users is None else users
+        self.fetched = []
+
+    def _get_gh_user(self, gh_user):
+        self.fetched.append(gh_user)
+        return {'login': gh_user, 'version': len(self.fetched),
+                **self.users.get(gh_user, {})}
+
+
+@pytest.fixture
+def stub_server():
+    """ Factory starting local HTTP server(s), returning base URL
+
+    Servers shut down at end of test.
+    """
+    servers = []
+
+    def start(handler):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        host, port = server.server_address
+        return f'http://{host}:{port}'
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,37 @@
+""" Tests for benchmarks
+"""
+
+import sys
+from os.path import join as pjoin, abspath, dirname
+
+HERE = dirname(__file__)
+sys.path.append(abspath(pjoin(HERE, '..', 'benchmarks')))
+
+from bench import (synth_shortlog, Inputs, run_benchmarks, BENCHMARKS,
+                   tz_suffix)
+from gputils import parse_shortlog, RepoContributor
+
+
+def test_synth_shortlog():
+    text = synth_shortlog(1000, n_authors=20, alias_frac=0.5)
+    views = parse_shortlog(text)
+    assert sum(len(v) for v in views) == 1000
+    lengths = [len(v) for v in views]
+    # As for ``git shortlog -n``.
+    assert lengths == sorted(lengths, reverse=True)
+    contrib = RepoContributor(views[0], None)
+    assert contrib.name == 'Author 0'
+    assert list(contrib.names) == ['Author 0', 'author0']
+    assert len(contrib.emails) == 2
+    assert synth_shortlog(1000, n_authors=20, alias_frac=0.5) == text
+    assert tz_suffix(-300) == '-05:00'
+    assert tz_suffix(330) == '+05:30'
+
+
+def test_run_benchmarks():
+    results = run_benchmarks('small', repeat=1,
+                             inputs=Inputs(n_commits=500, n_locations=100))
+    assert list(results) == list(BENCHMARKS)
+    for result in results.values():
+        assert result['time'] >= 0
+        assert result['peak'] >= 0
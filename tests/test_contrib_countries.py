@@ -0,0 +1,233 @@
+""" Tests for contrib_countries module
+"""
+
+import re
+import sys
+import asyncio
+from os.path import join as pjoin, abspath, dirname
+
+import numpy as np
+import pandas as pd
+
+import contrib_countries
+
+HERE = dirname(__file__)
+sys.path.append(abspath(pjoin(HERE, '..')))
+
+from contrib_countries import (LocationMatcher, COUNTRY_REGEXPS,
+                               LOCATION_MATCHER, GH_USER2LOCATION, tw,
+                               required_literal, CountryResolver,
+                               COUNTRY_RESOLVER, COUNTRY_CODES,
+                               COUNTRY_NAMES, EXTRA_COUNTRIES, fold,
+                               LocationCache, resolve_location,
+                               resolve_locations, normalize_location,
+                               locate_users)
+from gazetteer import Gazetteer, add_countries, ADMIN
+from conftest import FakeUserGetter
+
+
+def naive_match(location, rules=COUNTRY_REGEXPS):
+    for reg, country in rules:
+        if re.search(reg, location):
+            return country
+
+
+def test_required_literal():
+    assert required_literal(tw('New York')) == 'New York'
+    assert required_literal(tw('[Ii]stanbul')) is None
+    assert required_literal('Brazil$') == 'Brazil'
+    assert required_literal('Washington[, ]*DC') is None
+
+
+def test_location_matcher():
+    matcher = LocationMatcher([(tw('Paris'), 'FRA'),
+                               ('Texas$', 'USA'),
+                               (tw('Paris, Texas'), 'XXX')])
+    # First rule wins, wherever it matches.
+    assert matcher('Paris, Texas') == 'FRA'
+    assert matcher.rule_index('Austin, Texas') == 1
+    assert matcher('Texas, USA') is None
+    assert matcher('Parisian') is None
+    assert matcher('') is None
+
+
+def test_location_matcher_naive():
+    users = pd.read_csv(pjoin(HERE, '..', 'users_locations.csv'))
+    locations = (list(users['location'].dropna()) +
+                 list(GH_USER2LOCATION.values()) +
+                 ['London, Ontario', 'Berlin', 'Berlin, Germany',
+                  'IBM T.J. Watson Research Lab', 'Seoul, South Korea',
+                  'Washington DC', 'new york', '\nNew York\n'])
+    for location in locations:
+        assert LOCATION_MATCHER(location) == naive_match(location)
+    series = pd.Series(locations + [None])
+    expected = [naive_match(L) for L in locations] + [None]
+    assert list(LOCATION_MATCHER.match_series(series)) == expected
+    indices = LOCATION_MATCHER.rule_series(series)
+    assert list(indices) == [LOCATION_MATCHER.rule_index(L)
+                             for L in locations] + [None]
+
+
+def mask_find_country(candidate):
+    # Original implementation with pandas masks.
+    is_iso = COUNTRY_CODES == candidate
+    if np.any(is_iso):
+        return COUNTRY_CODES.loc[is_iso].item()
+    is_country = COUNTRY_NAMES == candidate
+    if np.any(is_country):
+        return COUNTRY_CODES.loc[is_country].item()
+    if candidate in EXTRA_COUNTRIES:
+        return EXTRA_COUNTRIES[candidate]
+
+
+def test_fold():
+    assert fold('  Côte  d\'Ivoire ') == "cote d'ivoire"
+    assert fold('GÖTEBORG') == 'goteborg'
+
+
+def test_country_resolver():
+    candidates = (list(COUNTRY_CODES) + list(COUNTRY_NAMES) +
+                  list(EXTRA_COUNTRIES) + ['Narnia', 'N/K', ''])
+    for candidate in candidates:
+        assert COUNTRY_RESOLVER(candidate) == mask_find_country(candidate)
+    resolver = CountryResolver(['DEU', 'FRA'], ['Germany', 'France'],
+                               {'Deutschland': 'DEU'})
+    assert resolver('DEU') == 'DEU'
+    assert resolver('germany ') == 'DEU'
+    assert resolver('DEUTSCHLAND') == 'DEU'
+    assert resolver('Frånce') == 'FRA'
+    # Codes must match exactly.
+    assert resolver('deu') is None
+    assert resolver(None) is None
+    series = pd.Series(['France', 'france', None, 'Narnia', 'france'])
+    assert list(resolver.resolve(series)) == ['FRA', 'FRA', None, None,
+                                              'FRA']
+    resolved = COUNTRY_RESOLVER.resolve(pd.Series(candidates))
+    assert list(resolved) == [mask_find_country(c) for c in candidates]
+
+
+def test_resolve_location():
+    assert resolve_location('Berkeley, CA') == ('USA', tw('Berkeley'))
+    assert resolve_location('Somewhere, Germany') == ('DEU', 'country')
+    assert resolve_location('N/K') == ('N/K', 'country')
+    assert resolve_location('Narnia') == (None, None)
+    # Without GeoNames data, leave these for review.
+    for location in ('Germany / Earth', 'Lebanon, NH', 'Cuba, Missouri',
+                     'Peru, Indiana', 'Jamaica Plain, MA',
+                     'Panama City, Florida', 'New Mexico', 'Georgia Tech',
+                     'Chad Smith', 'Niger Delta University'):
+        assert resolve_location(location) == (None, None)
+    assert normalize_location(' Paris,\n  France ') == 'Paris, France'
+
+
+def test_resolve_location_geonames(monkeypatch):
+    gaz = Gazetteer({'USA': 327e6, 'LBN': 6.9e6})
+    add_countries(gaz, contrib_countries.country_data, EXTRA_COUNTRIES)
+    gaz.add('Utah', 'USA', kind=ADMIN)
+    gaz.add('New Hampshire', 'USA', kind=ADMIN)
+    gaz.add('Logan', 'USA', 50000)
+    monkeypatch.setitem(contrib_countries._STATE, 'gazetteer', gaz)
+    assert resolve_location('Logan, Utah') == ('USA', 'gazetteer')
+    assert resolve_location('Logan / Earth') == ('USA', 'gazetteer')
+    # Only the last part of the location.
+    assert resolve_location('Utah, Earth') == (None, None)
+    # A region outvotes a country name.
+    assert resolve_location('Lebanon New Hampshire') == ('USA', 'gazetteer')
+    locations = ['Logan, Utah', 'Utah, Earth', 'Berkeley, CA', 'N/K',
+                 'Somewhere, Germany', 'Lebanon New Hampshire', 'Narnia']
+    assert resolve_locations(pd.Series(locations)) == [
+        resolve_location(L) for L in locations]
+
+
+def test_resolve_locations():
+    users = pd.read_csv(pjoin(HERE, '..', 'users_locations.csv'))
+    locations = (list(users['location'].dropna().map(normalize_location)) +
+                 ['N/K', 'N/A', 'Narnia', 'Lebanon, NH', ''])
+    assert resolve_locations(pd.Series(locations)) == [
+        resolve_location(L) for L in locations]
+    assert resolve_locations(pd.Series([], dtype=object)) == []
+
+
+def test_location_cache():
+    calls = []
+
+    def func(location):
+        calls.append(location)
+        return [location.upper(), 'rule']
+
+    store = {}
+    fingerprint = ['v1']
+    cache = LocationCache(func, store, lambda: fingerprint[0], maxsize=2)
+    assert cache('Paris') == ('PARIS', 'rule')
+    assert cache(' Paris ') == ('PARIS', 'rule')
+    assert calls == ['Paris']
+    assert store == {cache.fingerprint_key: 'v1', 'Paris': ['PARIS', 'rule']}
+    cache('Oslo')
+    cache('Rome')
+    # Paris dropped from memory, but still in store.
+    assert list(cache._lru) == ['Oslo', 'Rome']
+    assert cache('Paris') == ('PARIS', 'rule')
+    assert calls == ['Paris', 'Oslo', 'Rome']
+    # New cache, same fingerprint, reuses store.
+    cache = LocationCache(func, store, lambda: fingerprint[0])
+    cache('Oslo')
+    assert calls == ['Paris', 'Oslo', 'Rome']
+    # Changed fingerprint clears store.
+    fingerprint[0] = 'v2'
+    cache = LocationCache(func, store, lambda: fingerprint[0])
+    cache('Oslo')
+    assert calls == ['Paris', 'Oslo', 'Rome', 'Oslo']
+    assert store == {cache.fingerprint_key: 'v2', 'Oslo': ['OSLO', 'rule']}
+    # Batch of locations; one call for all new locations.
+    batches = []
+
+    def batch_func(locations):
+        batches.append(list(locations))
+        return [[L.lower(), 'batch'] for L in locations]
+
+    cache = LocationCache(func, store, lambda: fingerprint[0],
+                          batch_func=batch_func)
+    series = pd.Series([' Oslo', None, 'Rome', 'Paris', 'Rome '])
+    assert list(cache.resolve(series)) == [
+        ('OSLO', 'rule'), None, ('rome', 'batch'), ('paris', 'batch'),
+        ('rome', 'batch')]
+    assert batches == [['Rome', 'Paris']]
+    assert cache('Paris') == ('paris', 'batch')
+
+
+def test_locate_users(monkeypatch, capsys):
+    getter = FakeUserGetter({'mb': {'location': 'Oxford, UK'},
+                             'jd': {'location': None},
+                             'rr': {'location': 'Narnia'}})
+    monkeypatch.setattr(contrib_countries, 'USER_GETTER', getter)
+    monkeypatch.setattr(contrib_countries, 'LOCATION_CACHE', LocationCache(
+        resolve_location, {}, lambda: 'test',
+        batch_func=resolve_locations))
+    # eric-wieser has location in GH_USER2LOCATION.
+    gh_users = pd.Series(['mb', 'jd', 'mb', 'rr', 'eric-wieser', 'mb'])
+    locations, countries = locate_users(gh_users, max_concurrency=2)
+    assert sorted(getter.fetched) == ['jd', 'mb', 'rr']
+    assert [v if isinstance(v, str) else None for v in locations] == [
+        'Oxford, UK', None, 'Oxford, UK', 'Narnia', 'Cambridge, UK',
+        'Oxford, UK']
+    assert [v if isinstance(v, str) else None for v in countries] == [
+        'GBR', None, 'GBR', None, 'GBR', 'GBR']
+    assert capsys.readouterr().out == ('jd has no location\n'
+                                       'rr has location Narnia but no '
+                                       'country\n')
+
+
+def test_locate_users_in_loop(monkeypatch):
+    getter = FakeUserGetter({'mb': {'location': 'Oxford, UK'}})
+    monkeypatch.setattr(contrib_countries, 'USER_GETTER', getter)
+    monkeypatch.setattr(contrib_countries, 'LOCATION_CACHE', LocationCache(
+        resolve_location, {}, lambda: 'test',
+        batch_func=resolve_locations))
+
+    async def in_loop():
+        # As from Jupyter, with event loop already running.
+        return locate_users(pd.Series(['mb']))
+
+    locations, countries = asyncio.run(in_loop())
+    assert list(countries) == ['GBR']
+    assert getter.fetched == ['mb']
@@ -0,0 +1,102 @@
+""" Tests for find_gh_users module
+"""
+
+import sys
+import random
+import asyncio
+from os.path import join as pjoin, abspath, dirname
+
+HERE = dirname(__file__)
+sys.path.append(abspath(pjoin(HERE, '..')))
+
+from gputils import AsyncGitHub, IdentityResolver
+from find_gh_users import resolve_all
+from conftest import make_contrib
+
+
+class ShuffledAsyncGitHub(AsyncGitHub):
+    """ Guess Github users from fixed map, finishing in random order
+    """
+
+    def __init__(self, logins, seed):
+        super().__init__()
+        self.logins = logins
+        self.rng = random.Random(seed)
+
+    async def run(self, func, *args, **kwargs):
+        return None
+
+    async def guess_gh_user(self, contrib, n_prs=None, token=None):
+        await asyncio.sleep(self.rng.random() / 100)
+        for email in contrib.emails:
+            if email in self.logins:
+                return self.logins[email]
+
+
+def make_map():
+    return {'numpy': [make_contrib('Ann', 'ann@foo.com'),
+                      make_contrib('David M Cooke', 'dmc@foo.com'),
+                      make_contrib('Bob', 'bob@foo.com')],
+            'scipy': [make_contrib('Ann', 'ann@bar.org', 'ann@foo.com'),
+                      make_contrib('cookedm', 'dmc@foo.com'),
+                      make_contrib('B', 'bob@foo.com', 'bob@baz.org'),
+                      make_contrib('Cat', 'cat@foo.com')],
+            'h5py': [make_contrib('Ann', 'ann@baz.org'),
+                     make_contrib('Bob B', 'bob@baz.org')]}
+
+
+async def parsed(contribs, rng, after=None):
+    # Parsing result, ready in random order, maybe after event `after`.
+    await asyncio.sleep(rng.random() / 100)
+    if after is not None:
+        await after.wait()
+    return contribs
+
+
+def test_resolve_all():
+    # Lookups for different emails of same person disagree.
+    logins = {'ann@foo.com': 'ann', 'ann@bar.org': 'ann2',
+              'bob@baz.org': 'bob', 'cat@foo.com': 'cat'}
+    expected = {'numpy': ['ann', 'dmcooke', 'bob'],
+                'scipy': ['ann', 'dmcooke', 'bob', 'cat'],
+                'h5py': ['ann', 'bob']}
+    outputs = []
+    for seed in range(10):
+        agh = ShuffledAsyncGitHub(logins, seed)
+        contrib_map = asyncio.run(resolve_all(
+            make_map(), {}, IdentityResolver(agh)))
+        outputs.append({repo: [c.gh_user for c in contribs]
+                        for repo, contribs in contrib_map.items()})
+    assert all(output == expected for output in outputs)
+    # Repositories arrive in random order while parsing.
+    for seed in range(10):
+        rng = random.Random(seed)
+        agh = ShuffledAsyncGitHub(logins, seed)
+        contrib_map = asyncio.run(resolve_all(
+            {repo: parsed(contribs, rng)
+             for repo, contribs in make_map().items()},
+            {}, IdentityResolver(agh)))
+        assert {repo: [c.gh_user for c in contribs]
+                for repo, contribs in contrib_map.items()} == expected
+
+
+def test_resolve_all_pipelined():
+    # Later repositories only finish parsing after first lookups.
+    class RecordingGitHub(ShuffledAsyncGitHub):
+
+        async def guess_gh_user(self, contrib, n_prs=None, token=None):
+            looked_up.set()
+            return await super().guess_gh_user(contrib, n_prs, token)
+
+    async def run():
+        rng = random.Random(0)
+        contrib_map = make_map()
+        return await asyncio.wait_for(resolve_all(
+            {'numpy': parsed(contrib_map['numpy'], rng),
+             'scipy': parsed(contrib_map['scipy'], rng, looked_up),
+             'h5py': parsed(contrib_map['h5py'], rng, looked_up)},
+            {}, IdentityResolver(RecordingGitHub({}, 0))), 5)
+
+    looked_up = asyncio.Event()
+    contrib_map = asyncio.run(run())
+    assert list(contrib_map) == ['numpy', 'scipy', 'h5py']
@@ -0,0 +1,92 @@
+""" Tests for gazetteer module
+"""
+
+import sys
+from os.path import join as pjoin, abspath, dirname
+
+import pandas as pd
+
+HERE = dirname(__file__)
+ROOT = abspath(pjoin(HERE, '..'))
+sys.path.append(ROOT)
+
+from gazetteer import (Gazetteer, tokenize, load_country_populations,
+                       load_gazetteer, COUNTRY, ADMIN)
+
+
+def test_tokenize():
+    assert tokenize('Logan, Utah; USA') == ['logan', 'utah', 'usa']
+    assert tokenize('São Paulo/BRAZIL') == ['sao', 'paulo', 'brazil']
+    assert tokenize(' ,; ') == []
+
+
+def test_gazetteer():
+    gaz = Gazetteer({'USA': 327e6, 'GEO': 3.7e6, 'AUS': 25e6})
+    gaz.add('Logan', 'AUS', 300000)
+    gaz.add('Logan', 'USA', 50000)
+    gaz.add('Utah', 'USA', kind=ADMIN)
+    gaz.add('Georgia', 'GEO', kind=COUNTRY)
+    gaz.add('Georgia', 'USA', kind=ADMIN)
+    gaz.add('Australia', 'AUS', kind=COUNTRY)
+    gaz.add('United States', 'USA', kind=COUNTRY)
+    assert gaz.n_names == 7
+    assert gaz.has_places
+    assert [m[:2] for m in gaz.matches('Logan, Utah; United States')] == [
+        (0, 1), (1, 2), (2, 4)]
+    # Bigger city wins on its own.
+    assert gaz('Logan') == 'AUS'
+    # Region tips the balance.
+    assert gaz('Logan, Utah') == 'USA'
+    # Country name decides.
+    assert gaz('Logan, Australia') == 'AUS'
+    assert gaz('Australia / United States') == 'USA'
+    # Ambiguous country name weighted by population.
+    assert gaz('Georgia') == 'USA'
+    assert gaz('Narnia') is None
+    # A region outvotes a country-only name.
+    gaz.add('Lebanon', 'LBN', kind=COUNTRY)
+    assert gaz('Lebanon') == 'LBN'
+    assert gaz('Lebanon Utah') == 'USA'
+    locations = pd.Series(['Logan', None, 'Logan, Utah', 'Logan'])
+    assert list(gaz.resolve(locations)) == ['AUS', None, 'USA', 'AUS']
+
+
+def test_load_gazetteer(tmp_path):
+    pops = load_country_populations(pjoin(ROOT, 'pop_surface.csv'),
+                                    pjoin(ROOT, 'un_stats_division_countries.csv'))
+    assert 1e9 < pops['CHN'] < 2e9
+    country_data = pd.read_csv(pjoin(ROOT, 'country_data.csv'))
+    geonames_dir = tmp_path / 'geonames'
+    geonames_dir.mkdir()
+    (geonames_dir / 'countryInfo.txt').write_text(
+        '#ISO\tISO3\tISO-Numeric\n'
+        'US\tUSA\t840\n'
+        'AU\tAUS\t036\n')
+    (geonames_dir / 'admin1CodesASCII.txt').write_text(
+        'US.UT\tUtah\tUtah\t5549030\n')
+    city = ['0'] * 19
+    city[1:3] = ['Logan', 'Logan']
+    city[8], city[14] = 'AU', '300000'
+    other = list(city)
+    other[8], other[14] = 'US', '50000'
+    (geonames_dir / 'cities15000.txt').write_text(
+        '\t'.join(city) + '\n' + '\t'.join(other) + '\n')
+    gaz = load_gazetteer(country_data,
+                         {'UK': 'GBR'},
+                         pop_fname=pjoin(ROOT, 'pop_surface.csv'),
+                         un_fname=pjoin(ROOT,
+                                        'un_stats_division_countries.csv'),
+                         geonames_dir=str(geonames_dir))
+    assert gaz('Logan, Utah') == 'USA'
+    assert gaz('Logan') == 'AUS'
+    assert gaz('London, UK') == 'GBR'
+    assert gaz('Somewhere in Germany') == 'DEU'
+    # Without GeoNames files, only countries.
+    gaz = load_gazetteer(country_data,
+                         pop_fname=pjoin(ROOT, 'pop_surface.csv'),
+                         un_fname=pjoin(ROOT,
+                                        'un_stats_division_countries.csv'),
+                         geonames_dir=str(tmp_path / 'missing'))
+    assert gaz('Logan, Utah') is None
+    assert gaz('Berlin, Germany') == 'DEU'
+    assert not gaz.has_places
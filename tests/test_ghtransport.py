@@ -0,0 +1,216 @@
+""" Tests for ghtransport module
+"""
+
+import sys
+from os.path import join as pjoin, abspath, dirname
+from http.server import BaseHTTPRequestHandler
+
+import requests
+
+HERE = dirname(__file__)
+sys.path.append(abspath(pjoin(HERE, '..')))
+
+from ghtransport import (url_resource, is_rate_limited, RateLimitScheduler,
+                         GitHubAdapter, HTTPCache)
+from kvstore import SQLiteStore
+
+
+class FakeClock:
+
+    def __init__(self, now=1000.):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakeResponse:
+
+    def __init__(self, status_code=200, headers=None, content=b'',
+                 url='https://api.github.com/users/foo'):
+        self.status_code = status_code
+        self.headers = {} if headers is None else headers
+        self.content = content
+        self.url = url
+
+
+def limit_headers(remaining, reset, limit=5000, resource='core'):
+    return {'X-RateLimit-Limit': str(limit),
+            'X-RateLimit-Remaining': str(remaining),
+            'X-RateLimit-Reset': str(reset),
+            'X-RateLimit-Resource': resource}
+
+
+def test_url_resource():
+    assert url_resource('https://api.github.com/graphql') == 'graphql'
+    assert url_resource('https://api.github.com/search/users?q=f') == 'search'
+    assert url_resource('https://api.github.com/repos/h5py/h5py') == 'core'
+
+
+def test_is_rate_limited():
+    assert not is_rate_limited(FakeResponse())
+    assert not is_rate_limited(FakeResponse(403, content=b'Forbidden'))
+    assert is_rate_limited(FakeResponse(403, limit_headers(0, 2000)))
+    assert is_rate_limited(FakeResponse(429, {'Retry-After': '10'}))
+    assert is_rate_limited(FakeResponse(
+        403, content=b'You have exceeded a secondary rate limit'))
+
+
+def test_scheduler_rotation():
+    clock = FakeClock()
+    sched = RateLimitScheduler(['tok1', 'tok2'], min_interval=0,
+                               clock=clock, sleep=clock.sleep)
+    # Unknown budgets; no waiting.
+    assert sched.reserve() == ('tok1', 0)
+    sched.update('tok1', FakeResponse(headers=limit_headers(0, 1100)))
+    # First token exhausted; rotate to second.
+    assert sched.reserve() == ('tok2', 0)
+    sched.update('tok2', FakeResponse(headers=limit_headers(10, 1100)))
+    # Second token spreads 10 requests over 100 seconds.
+    assert sched.reserve() == ('tok2', 0)
+    assert sched.acquire() == 'tok2'
+    assert clock.now == 1010
+    budget = sched.budget()
+    assert budget['...tok1']['core'] == dict(limit=5000, remaining=0,
+                                             reset=1100)
+    assert budget['...tok2']['core']['remaining'] == 8
+    # Resources have separate budgets.
+    assert sched.reserve('graphql') == ('tok1', 0)
+    # Secondary limit blocks token.
+    sched.update('tok1', FakeResponse(429, {'Retry-After': '30'},
+                                      url='https://api.github.com/graphql'))
+    assert sched.reserve('graphql') == ('tok2', 0)
+    # After budget reset, first token is usable again.
+    clock.now = 1200
+    assert sched.reserve() == ('tok1', 0)
+
+
+def test_scheduler_min_interval():
+    clock = FakeClock()
+    sched = RateLimitScheduler(['tok1', 'tok2'], min_interval=0.5,
+                               clock=clock, sleep=clock.sleep)
+    assert sched.reserve() == ('tok1', 0)
+    assert sched.reserve() == ('tok2', 0.5)
+    assert sched.reserve() == ('tok1', 1.0)
+    # Responses for tokens not in scheduler are ignored.
+    sched.update('other', FakeResponse(headers=limit_headers(0, 2000)))
+    assert None not in sched.budget()
+
+
+def test_scheduler_burst():
+    clock = FakeClock()
+    sched = RateLimitScheduler(['tok1'], min_interval=0,
+                               clock=clock, sleep=clock.sleep)
+    sched.update('tok1', FakeResponse(headers=limit_headers(4999, 4600)))
+    # Plenty of budget; no pacing.
+    for i in range(200):
+        assert sched.acquire() == 'tok1'
+    assert clock.now == 1000
+    assert sched.budget()['...tok1']['core']['remaining'] == 4799
+    # Near the end of the budget, spread requests until reset.
+    sched.update('tok1', FakeResponse(headers=limit_headers(100, 4600)))
+    assert sched.reserve() == ('tok1', 0)
+    assert sched.reserve() == ('tok1', 36)
+
+
+def test_scheduler_blocked_budget():
+    clock = FakeClock()
+    sched = RateLimitScheduler(['tok1'], min_interval=0.5,
+                               clock=clock, sleep=clock.sleep)
+    sched.update('tok1', FakeResponse(
+        headers=limit_headers(0, 4600, resource='graphql')))
+    # Requests waiting for GraphQL budget are spaced from each other...
+    assert sched.reserve('graphql') == ('tok1', 3600)
+    assert sched.reserve('graphql') == ('tok1', 3600.5)
+    # ... but don't hold up requests with budget left.
+    assert sched.reserve('core') == ('tok1', 0)
+    assert sched.reserve('core') == ('tok1', 0.5)
+
+
+class LimitedHandler(BaseHTTPRequestHandler):
+    """ Refuse first request with secondary rate limit
+    """
+
+    auths = []
+
+    def do_GET(self):
+        self.auths.append(self.headers.get('Authorization'))
+        if len(self.auths) == 1:
+            self.send_response(403)
+            self.send_header('Retry-After', '0')
+            body = b'secondary rate limit'
+        else:
+            self.send_response(200)
+            body = b'{}'
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_adapter_retries(stub_server):
+    url = stub_server(LimitedHandler)
+    sched = RateLimitScheduler(['tok1', 'tok2'], min_interval=0)
+    session = requests.Session()
+    session.mount('http://', GitHubAdapter(sched))
+    response = session.get(f'{url}/users/foo')
+    # Explicit token not in scheduler is left alone.
+    session.get(f'{url}/users/foo', headers={'Authorization': 'token mine'})
+    assert response.status_code == 200
+    assert LimitedHandler.auths == ['token tok1', 'token tok2', 'token mine']
+
+
+class ETagHandler(BaseHTTPRequestHandler):
+    """ Serve JSON with ETag, honoring If-None-Match
+    """
+
+    body = b'{"login": "foo"}'
+    etag = '"v1"'
+    statuses = []
+
+    def do_GET(self):
+        if self.headers.get('If-None-Match') == self.etag:
+            self.statuses.append(304)
+            self.send_response(304)
+            self.send_header('ETag', self.etag)
+            self.end_headers()
+            return
+        self.statuses.append(200)
+        self.send_response(200)
+        self.send_header('ETag', self.etag)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_http_cache(tmp_path, stub_server):
+    url = stub_server(ETagHandler) + '/users/foo'
+    store = SQLiteStore(str(tmp_path / 'http.sqlite'))
+    sched = RateLimitScheduler([], min_interval=0)
+
+    def get():
+        session = requests.Session()
+        session.mount('http://', GitHubAdapter(sched, HTTPCache(store)))
+        return session.get(url)
+
+    first = get()
+    second = get()
+    ETagHandler.etag = '"v2"'
+    ETagHandler.body = b'{"login": "bar"}'
+    third = get()
+    assert ETagHandler.statuses == [200, 304, 200]
+    assert not getattr(first, 'from_cache', False)
+    assert second.from_cache
+    assert second.status_code == 200
+    assert first.json() == second.json() == {'login': 'foo'}
+    assert third.json() == {'login': 'bar'}
+    assert len(store) == 1
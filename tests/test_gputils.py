@@ -1,24 +1,84 @@
 """ Tests for gputils module
 """
 
+import os
 import sys
+import json
+import time
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler
 from os.path import join as pjoin, abspath, dirname
 from datetime import datetime
+from subprocess import check_output, DEVNULL
+
+import numpy as np
+import pytest
 
 HERE = dirname(__file__)
 DATA_PATH = pjoin(HERE, 'data')
 sys.path.append(abspath(pjoin(HERE, '..')))
 
-from gputils import (Repo, parse_shortlog, ordered_unique,
+import gputils
+from gputils import (Repo, RepoContributor, AsyncGitHub, parse_shortlog, iter_shortlog,
+                     CommitTable, ordered_unique, save_contributors,
+                     load_contributors, merge_contributors,
+                     compact_contributors,
                      emails2gh_user, parse_sl_line, sha2gh_user,
                      merge_dicts, update_subdicts,
-                     lupdate)
+                     lupdate, shas2info, track_pr_info, set_offline,
+                     OfflineError, UserGetter, ProbeCache,
+                     IdentityIndex, IdentityResolver, MergePRIndex,
+                     MergePR, MERGE_LOG_FORMAT, EmailIndex,
+                     RepoGetter, run_sync)
+from synth_repo import make_repo
+from conftest import (sl_line, make_contrib, h5py_contrib, pr_node,
+                      FakeUserGetter)
 
 TEST_REPO = Repo('h5py', path=pjoin(DATA_PATH, 'h5py'))
 
+# Output of ``git shortlog`` with ``--format=%H||%aN||%aE||%an||%ae||%aI``.
+EG_SHORTLOG = """\
+M Brett (2):
+      bcdd3e7e11b||M Brett||mb@foo.com||M Brett||mb@foo.com||2018-08-28T23:27:25-04:00
+      acdd3e7e11b||M Brett||mb@foo.com||Matthew||mb@bar.org||2018-08-29T23:27:25+01:00
+
+J Doe (1):
+      0cdd3e7e11b||J Doe||jd@foo.com||J Doe||jd@foo.com||2018-08-30T23:27:25+00:00
+"""
+
 
 def test_ordered_unique():
     assert ordered_unique([3, 2, 1]) == (3, 2, 1)
+    assert ordered_unique([3, 2, 3, 1, 2]) == (3, 2, 1)
+    assert ordered_unique([1, 4, 2], (2, 3)) == (2, 3, 1, 4)
+
+
+def test_contributor_index():
+    lines = ['a1||M Brett||mb@foo.com||Matthew||mb@bar.org||'
+             '2018-08-28T23:27:25-04:00',
+             'a2||M Brett||mb@foo.com||M Brett||mb@foo.com||'
+             '2018-08-29T23:27:25+00:00',
+             'a3||M Brett||mb@foo.com||Matthew||mb@bar.org||'
+             '2018-08-30T23:27:25-04:00']
+    table = CommitTable()
+    for line in lines:
+        table.append_line(line)
+    for commits in (table.view(), [parse_sl_line(L) for L in lines]):
+        contrib = RepoContributor(commits, TEST_REPO)
+        assert contrib.names == ('M Brett', 'Matthew')
+        assert contrib.emails == ('mb@foo.com', 'mb@bar.org')
+        assert contrib.timezone_counts == (('UTC-04:00', 2), ('UTC', 1))
+        assert contrib.shas_by_email == {'mb@foo.com': ['a2'],
+                                         'mb@bar.org': ['a1', 'a3']}
+        # Returned lists are copies.
+        contrib.shas_by_email['mb@foo.com'].pop()
+        assert contrib.shas_by_email['mb@foo.com'] == ['a2']
+        assert contrib.index.shas == {'a1', 'a2', 'a3'}
+        # Index rebuilt when commits change.
+        contrib.commits = commits[:1]
+        assert contrib.emails == ('mb@foo.com', 'mb@bar.org')
+        assert contrib.timezone_counts == (('UTC-04:00', 1),)
 
 
 def test_sha2gh_user():
@@ -43,6 +103,364 @@ def test_sha_prs2gh_user():
     assert gh_user == 'jakirkham'
 
 
+def test_shas2info(monkeypatch):
+    queries = []
+
+    def fake_query(query, token=None):
+        queries.append(query)
+        return {'data': {'repository': {
+            'c0': {'author': {'user': {'login': 'mb'}},
+                   'associatedPullRequests': {'nodes': [
+                       pr_node(10, 'mb', ['a1', 'a2'])]}},
+            'c1': {'author': {'user': None},
+                   'associatedPullRequests': {'nodes': [
+                       pr_node(11, 'jd', ['b1'], 200)]}},
+            'c2': None}}}
+
+    monkeypatch.setattr(gputils, 'graphql_query', fake_query)
+    info = shas2info(['a1', 'b1', 'c1'], 'h5py', 'h5py')
+    assert len(queries) == 1
+    assert 'c2: object(expression: "c1")' in queries[0]
+    assert info == {
+        'a1': {'login': 'mb',
+               'prs': [{'number': 10, 'author': 'mb', 'shas': ['a1', 'a2']}]},
+        'b1': {'login': None,
+               'prs': [{'number': 11, 'author': 'jd', 'shas': None}]},
+        'c1': {'login': None, 'prs': []}}
+    shas = ['a1', 'a3', 'a2']
+    assert track_pr_info(shas, info['a1'], {'a1', 'a2', 'a3'}) == 'mb'
+    assert shas == ['a3']
+    shas = ['a1', 'a2']
+    # Mixed PR.
+    assert track_pr_info(shas, info['a1'], {'a1', 'a3'}) is None
+    assert shas == []
+    # Too many commits to check.
+    shas = ['b1', 'b2']
+    assert track_pr_info(shas, info['b1'], {'b1', 'b2'}) is None
+    assert shas == ['b2']
+    assert shas2info([], 'h5py', 'h5py') == {}
+    assert len(queries) == 1
+
+
+def test_probe_cache(fake_graphql):
+    lines = [sl_line(sha, 'J Doe', email)
+             for sha, email in (('a1', 'jd@a.org'), ('a2', 'jd@a.org'),
+                                ('a3', 'jd@a.org'), ('b1', 'jd@b.org'))]
+    clock = [1000]
+    probes = ProbeCache({}, ttl=10, clock=lambda: clock[0])
+
+    def guess():
+        contrib = h5py_contrib(lines, probes)
+        fake_graphql.queried.clear()
+        assert contrib.guess_gh_user(n_prs=2) is None
+        return sorted(set(fake_graphql.queried))
+
+    assert guess() == ['a1', 'a2', 'b1']
+    assert probes.is_fruitless('login', TEST_REPO, 'jd@a.org', 'a1')
+    assert not probes.is_fruitless('login', TEST_REPO, 'jd@a.org', 'a2')
+    # Rerun only tries new SHA.
+    assert guess() == ['a3']
+    assert guess() == []
+    # Try all again after TTL.
+    clock[0] = 1011
+    assert guess() == ['a1', 'a2', 'b1']
+
+
+def test_probe_cache_pr(fake_graphql):
+    # a1 and a2 are in a PR with someone else's commit.
+    fake_graphql.prs = {sha: [pr_node(10, 'mb', ['a1', 'a2', 'z9'])]
+                        for sha in ('a1', 'a2')}
+    lines = [sl_line(sha, 'J Doe', 'jd@a.org') for sha in ('a1', 'a2', 'a3')]
+    probes = ProbeCache({}, ttl=10, clock=lambda: 1000)
+
+    def guess():
+        contrib = h5py_contrib(lines, probes)
+        fake_graphql.queried.clear()
+        assert contrib.guess_gh_user(n_prs=1) is None
+        return sorted(set(fake_graphql.queried))
+
+    assert guess() == ['a1']
+    # Both SHAs of the fruitless PR recorded.
+    assert probes.is_fruitless('pr', TEST_REPO, 'jd@a.org', 'a2')
+    assert guess() == ['a3']
+
+
+def test_identity_index():
+    index = IdentityIndex()
+    index.add(make_contrib('M Brett', 'MB@foo.com '), 'matthew-brett')
+    index.add(make_contrib('J Doe', 'jd@foo.com'), None)
+    index.add(make_contrib('R Roe', 'rr@foo.com'), 'rroe')
+    index.add(make_contrib('R Roe', 'rr@bar.org'), 'rroe2')
+    assert len(index) == 3
+    assert index.lookup(make_contrib('Matthew', 'mb@foo.com')) == (
+        'matthew-brett')
+    # Fall back to unique name.
+    assert index.lookup(make_contrib('m  brett', 'm@baz.org')) == (
+        'matthew-brett')
+    # Ambiguous name, no name for missing user.
+    assert index.lookup(make_contrib('R Roe', 'r@baz.org')) is None
+    assert index.lookup(make_contrib('J Doe', 'jd@foo.com')) is None
+    # Conflicting emails.
+    assert index.lookup(make_contrib('R Roe', 'rr@foo.com',
+                                     'rr@bar.org')) is None
+
+
+def test_find_contributor():
+    getter = RepoGetter()
+    getter._rcache['h5py'] = TEST_REPO
+    ann = make_contrib('Ann', 'ann@foo.com', 'ann@bar.org')
+    ann.commits[1] = ann.commits[1]._replace(c_name='Ann B')
+    bob = make_contrib('Ann B', 'bob@foo.com')
+    getter._ccache['h5py'] = [ann, bob]
+    assert getter.find_contributor('h5py', 'Ann') is ann
+    # Main name wins over other names.
+    assert getter.find_contributor('h5py', 'Ann B') is bob
+    assert getter.find_contributor('h5py', email='ann@bar.org') is ann
+    assert getter.find_contributor('h5py', 'Cat', 'bob@foo.com') is bob
+    assert getter.find_contributor('h5py', 'Cat') is None
+
+
+class FakeAsyncGitHub(AsyncGitHub):
+
+    def __init__(self):
+        super().__init__()
+        self.guessed = []
+
+    async def run(self, func, *args, **kwargs):
+        return None
+
+    async def guess_gh_user(self, contrib, n_prs=None, token=None):
+        self.guessed.append(contrib.name)
+        await asyncio.sleep(0.01)
+        return contrib.name.lower()
+
+
+def test_identity_resolver():
+    agh = FakeAsyncGitHub()
+    resolver = IdentityResolver(agh)
+    contribs = [make_contrib('Ann', 'ann@foo.com'),
+                make_contrib('Bob', 'bob@foo.com'),
+                make_contrib('Ann B', 'ann@foo.com', 'ann@bar.org')]
+    assert asyncio.run(resolver.guess_gh_users(contribs)) == [
+        'ann', 'bob', 'ann']
+    # Each identity looked up once.
+    assert agh.guessed == ['Ann', 'Bob']
+    assert asyncio.run(resolver.guess_gh_users(
+        [make_contrib('A', 'bob@foo.com')])) == ['bob']
+    assert agh.guessed == ['Ann', 'Bob']
+
+
+def test_merge_pr_index(tmp_path):
+    def git(*args):
+        return check_output(['git', '-c', 'user.name=A', '-c',
+                             'user.email=a@foo.com', *args],
+                            cwd=str(tmp_path), text=True,
+                            stdin=DEVNULL).strip()
+
+    def commit(msg):
+        git('commit', '--allow-empty', '-q', '-m', msg)
+        return git('rev-parse', 'HEAD')
+
+    git('init', '-q', '-b', 'main')
+    root = commit('root')
+    git('checkout', '-q', '-b', 'feature')
+    f1, f2 = commit('f1'), commit('f2')
+    git('checkout', '-q', 'main')
+    m1 = commit('m1')
+    git('merge', '-q', '--no-ff', '-m',
+        'Merge pull request #12 from jdoe/feature', 'feature')
+    git('checkout', '-q', '-b', 'other', root)
+    o1 = commit('o1')
+    # Merge main into branch, before merging back.
+    git('merge', '-q', '--no-ff', '-m', 'Merge main', 'main')
+    back = git('rev-parse', 'HEAD')
+    o2 = commit('o2')
+    git('checkout', '-q', 'main')
+    git('merge', '-q', '--no-ff', '-m',
+        'Merge pull request #13 from h5py/other', 'other')
+    git('checkout', '-q', '-b', 'third')
+    t1 = commit('t1')
+    git('checkout', '-q', 'main')
+    git('merge', '-q', '--no-ff', '-m',
+        'Merge pull request #14 from rroe/third\n\nA fix', 'third')
+    out = git('log', '--topo-order', '--reverse', MERGE_LOG_FORMAT, 'HEAD')
+    index = MergePRIndex.from_log(out.splitlines(), 'h5py')
+    assert sorted(index.prs) == [12, 14]
+    assert index.prs[12] == MergePR(12, 'jdoe', [f2, f1])
+    assert index.prs[14] == MergePR(14, 'rroe', [t1])
+    for sha in (root, m1, o1, back, o2):
+        assert index.pr_for(sha) is None
+    assert index.sha_info(t1) == {
+        'login': None,
+        'prs': [{'number': 14, 'author': 'rroe', 'shas': [t1]}]}
+    # Repo builds same index.
+    repo = Repo('h5py', path=str(tmp_path))
+    assert repo.merge_prs.prs == index.prs
+    # Local PRs need no Github repo.
+    shas = [f1, f2]
+    assert track_pr_info(shas, index.sha_info(f1), {f1, f2}) == 'jdoe'
+    assert shas == []
+    assert track_pr_info([t1], index.sha_info(t1), {f1}) is None
+    contrib = RepoContributor(
+        [parse_sl_line(f'{sha}||J Doe||jd@foo.com||J Doe||jd@foo.com||'
+                       '2018-08-28T23:27:25+00:00') for sha in (f1, f2, m1)],
+        repo)
+    assert contrib.local_prs2gh_user() == 'jdoe'
+    assert contrib.candidate_shas() == []
+
+
+def test_email_index():
+    index = EmailIndex({}, {})
+    index.add_events('mb', [(3, [('M Brett', 'mb@foo.com'),
+                                 ('m  brett', 'MB@foo.com ')]),
+                            (2, [('mb', 'mb@bar.org'),
+                                 ('J Doe', 'jd@foo.com'),
+                                 ('M Brett', None)])], ['M Brett'])
+    index.add_events('jd', [(5, [('J Doe', 'jd@foo.com')] * 10)], ['J Doe'])
+    assert index.logins('mb@FOO.com') == {'mb': 2}
+    # Only commits with matching author name count.
+    assert index.logins('jd@foo.com') == {'jd': 10}
+    assert index.user_emails('mb') == {'mb@foo.com': 1, 'MB@foo.com ': 1,
+                                       'mb@bar.org': 1, 'jd@foo.com': 1}
+    # Events already seen are ignored.
+    index.add_events('mb', [(4, [('M Brett', 'mb@foo.com')]),
+                            (3, [('M Brett', 'mb@foo.com')])], ['M Brett'])
+    assert index.logins('mb@foo.com') == {'mb': 3}
+    assert index.latest_event('mb') == 4
+    assert index.lookup(['mb@foo.com', 'mb@bar.org']) == 'mb'
+    # Too few sightings.
+    assert index.lookup(['mb@bar.org']) is None
+    assert index.lookup(['mb@bar.org'], min_count=1) == 'mb'
+    assert index.lookup(['jd@foo.com', 'other@foo.com']) == 'jd'
+    index.add_events('jd2', [(1, [('J Doe', 'jd@foo.com')])], ['J Doe'])
+    assert index.lookup(['jd@foo.com']) == 'jd'
+    assert index.lookup(['jd@foo.com'], min_share=0.95) is None
+    # Conflicting owners.
+    assert index.lookup(['jd@foo.com', 'mb@foo.com']) is None
+    assert emails2gh_user(['mb@foo.com']) is None
+    assert emails2gh_user(['mb@foo.com'], index) == 'mb'
+    assert emails2gh_user(['foo@users.noreply.github.com'], index) == 'foo'
+
+
+def test_email_index_after_commit_author(fake_graphql):
+    # Maintainer "mb" pushed commits by "jd".
+    index = EmailIndex({}, {})
+    index.add_events('mb', [(1, [('J Doe', 'jd@foo.com')] * 10)],
+                     ['M Brett'])
+    fake_graphql.logins = {'a1': 'jd'}
+
+    def guess():
+        contrib = h5py_contrib([sl_line('a1', 'J Doe', 'jd@foo.com')],
+                               email_index=index)
+        return contrib.guess_gh_user(n_prs=1)
+
+    # Github's commit author wins over push events.
+    assert guess() == 'jd'
+    # Maintainer pushing jd's commits does not make them jd.
+    fake_graphql.logins.clear()
+    assert guess() is None
+    # Push events only used when Github does not know the author.
+    index.add_events('jd', [(2, [('J Doe', 'jd@foo.com')] * 3)], ['J Doe'])
+    assert guess() == 'jd'
+
+
+def test_offline():
+    set_offline()
+    try:
+        with pytest.raises(OfflineError):
+            gputils.get_gh()
+        with pytest.raises(OfflineError):
+            gputils.graphql_query('{ viewer { login } }')
+    finally:
+        set_offline(False)
+
+
+def test_user_getter(tmp_path):
+    json_fname = str(tmp_path / 'users.json')
+    with open(json_fname, 'wt') as fobj:
+        json.dump({'matthew-brett': {'location': 'Oxford'}, 'None': None},
+                  fobj)
+    # Imported entries are stale; serve them without refreshing from Github.
+    ug = UserGetter(json_fname, on_stale='serve')
+    # Import JSON on first use.
+    assert not (tmp_path / 'users.sqlite').exists()
+    assert ug('matthew-brett') == {'location': 'Oxford'}
+    assert ug('None') is None
+    assert ug('+manual') is None
+    # Each entry written as we go; new getter sees all entries.
+    assert len(UserGetter(json_fname)._cache) == 3
+    assert ug.wait() == {}
+    # Oldest first, sorted by database.
+    assert ug.oldest(3)[-1] == '+manual'
+    assert sorted(ug.oldest(2)) == ['None', 'matthew-brett']
+    # Don't import JSON again.
+    with open(json_fname, 'wt') as fobj:
+        json.dump({'other': {}}, fobj)
+    assert 'other' not in UserGetter(json_fname)._cache
+    ug = UserGetter(clock=lambda: 100)
+    assert ug('+manual') is None
+    assert dict(ug._cache) == {'+manual': {'fetched': 100, 'data': None}}
+
+
+def test_user_getter_import(tmp_path, monkeypatch):
+    json_fname = str(tmp_path / 'users.json')
+    with open(json_fname, 'wt') as fobj:
+        json.dump({'mb': {'location': 'Oxford'}}, fobj)
+    ug = UserGetter(json_fname)
+    original = ug.import_json
+    calls = []
+
+    def slow_import(fname):
+        calls.append(fname)
+        if len(calls) == 1:
+            raise OSError('Failed import')
+        time.sleep(0.1)
+        original(fname)
+
+    monkeypatch.setattr(ug, 'import_json', slow_import)
+    with pytest.raises(OSError):
+        ug('mb')
+    # Retry after failure; other threads wait for import.
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(ug('mb')))
+               for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [{'location': 'Oxford'}] * 4
+    assert len(calls) == 2
+
+
+def test_user_getter_ttl():
+    # Legacy entry without fetch time is stale.
+    ug = FakeUserGetter(store={'old': {'login': 'old'}}, ttl=10)
+    assert ug('new') == {'login': 'new', 'version': 1}
+    assert ug('old') == {'login': 'old'}
+    assert ug.wait() == {'old': None}
+    assert ug('old') == {'login': 'old', 'version': 2}
+    ug.now = 1011
+    # Serve stale data.
+    ug.on_stale = 'serve'
+    assert ug('new')['version'] == 1
+    assert ug.fetched == ['new', 'old']
+    # Fetch stale data.
+    ug.on_stale = 'fetch'
+    assert ug('new')['version'] == 3
+    assert ug.oldest(2) == ['old', 'new']
+    assert ug.oldest(0) == []
+    assert ug.refresh_oldest(2) == ['old']
+    assert ug.fetched == ['new', 'old', 'new', 'old']
+    ug.refresh(['new'])
+    assert ug('new')['version'] == 5
+    # Background refreshes are limited.
+    ug = FakeUserGetter(store={'a': {}, 'b': {}}, max_background=1)
+    assert ug('a') == ug('b') == {}
+    assert list(ug.wait()) == ['a']
+    with pytest.raises(ValueError):
+        UserGetter(on_stale='never')
+
+
 def test_parse_sl_line():
     L = ('bcdd3e7e11b||M Brett, no Ph.D||mb@foo.com||'
          'M Brett, not Ph.D||mb@bar.org||2018-08-28T23:27:25-04:00')
@@ -55,6 +473,165 @@ def test_parse_sl_line():
     assert commit.dt == datetime.fromisoformat('2018-08-28T23:27:25-04:00')
 
 
+def test_CommitTable():
+    lines = ['bcdd3e7e11b||M Brett||mb@foo.com||'
+             'M Brett, not Ph.D||mb@bar.org||2018-08-28T23:27:25-04:00',
+             'acdd3e7e11b||J Doe||jd@foo.com||'
+             'M Brett||mb@foo.com||2018-08-29T10:00:00+00:00']
+    table = CommitTable(capacity=1)
+    for line in lines:
+        table.append_line(line)
+    assert len(table) == 2
+    assert [table[i] for i in range(2)] == [parse_sl_line(L) for L in lines]
+    assert table[-1].dt.tzname() == 'UTC'
+    assert table.names.strings == ['M Brett', 'M Brett, not Ph.D', 'J Doe']
+    assert table.emails.strings == ['mb@foo.com', 'mb@bar.org', 'jd@foo.com']
+    assert list(table.o_name) == [1, 0]
+    assert list(table.tz_offset) == [-240, 0]
+    view = table.view(1)
+    assert len(view) == 1
+    assert list(view.sha) == [b'acdd3e7e11b']
+    assert view == [parse_sl_line(lines[1])]
+    # Block of lines gives same commits.
+    lines += [sl_line('b1', 'R Roe', 'rr@foo.com', '1969-12-31T20:30:00-03:30'),
+              sl_line('b2', 'J Doe', 'jd@foo.com', '2020-02-29T23:59:59+05:45')]
+    block_table = CommitTable(capacity=1)
+    block_table.extend_lines(lines)
+    block_table.extend_lines([])
+    assert list(block_table.view()) == [parse_sl_line(L) for L in lines]
+    assert list(block_table.tz_offset) == [-240, 0, -210, 345]
+    # Other ISO formats go through datetime.
+    lines = [sl_line('c1', 'A', 'a@foo.com', '2018-08-29T10:00:00Z'),
+             sl_line('c2', 'A', 'a@foo.com', '2018-08-29T10:00:00+0100')]
+    block_table.extend_lines(lines)
+    assert block_table.view(4) == [parse_sl_line(L) for L in lines]
+
+
+def test_save_load_contributors(tmp_path):
+    contribs = [RepoContributor(commits, TEST_REPO) for commits in
+                parse_shortlog(EG_SHORTLOG)]
+    cache_dir = str(tmp_path / 'cache')
+    save_contributors(contribs, cache_dir)
+    loaded = load_contributors(cache_dir, TEST_REPO)
+    assert [len(c) for c in loaded] == [2, 1]
+    for c, L in zip(contribs, loaded):
+        assert L.repo is TEST_REPO
+        assert L.commits == c.commits
+        assert L.emails == c.emails
+        assert L.timezone_counts == c.timezone_counts
+    # Saving again overwrites.
+    save_contributors(contribs[1:], cache_dir)
+    assert [len(c) for c in load_contributors(cache_dir, TEST_REPO)] == [1]
+
+
+def test_compact_contributors():
+    contribs = [RepoContributor(commits, TEST_REPO) for commits in
+                parse_shortlog(EG_SHORTLOG)]
+    # Drop M Brett; compact table only has J Doe's commit.
+    expected = list(contribs[1].commits)
+    compacted = compact_contributors(contribs[1:])
+    assert compacted[0] is contribs[1]
+    assert list(contribs[1].commits) == expected
+    assert len(contribs[1].commits.table) == 1
+
+
+def contrib_summary(contribs):
+    # Comparable summary of contributors, in name order.
+    return sorted((c.name, c.names, c.emails, [co.sha for co in c.commits],
+                   dict(c.timezone_counts)) for c in contribs)
+
+
+def test_repo_getter_cache(tmp_path):
+    path = str(tmp_path / 'repo')
+    make_repo(path, n_commits=200, n_authors=10, seed=0)
+    repo = Repo('repo', 'org', path=path)
+    cache_dir = str(tmp_path / 'cache')
+    revs = []
+    full_parse = repo.contributors
+
+    def contributors(rev='HEAD'):
+        revs.append(rev)
+        return full_parse(rev)
+
+    repo.contributors = contributors
+
+    def git(*args):
+        return check_output(['git', '-c', 'user.name=A', '-c',
+                             'user.email=a@foo.com', *args], cwd=path,
+                            text=True, stdin=DEVNULL).strip()
+
+    def check(expected_revs, incremental=True):
+        revs.clear()
+        getter = RepoGetter(cache_dir, incremental)
+        contribs = getter._read_contributors(repo)
+        assert revs == expected_revs
+        head = repo.head_sha()
+        assert getter.last_head(repo) == head
+        assert os.listdir(getter.repo_cache_dir(repo)) == [head]
+        assert contrib_summary(contribs) == contrib_summary(full_parse())
+        return contribs
+
+    first = repo.head_sha()
+    # Cold cache; full parse.
+    check([first])
+    # Warm cache; load from memory-mapped arrays.
+    contribs = check([])
+    assert isinstance(contribs[0].commits.table.sha, np.memmap)
+    # New commits; parse only these.
+    git('commit', '-q', '--allow-empty', '--author',
+        'Author 1 <author1@example1.org>', '-m', 'New 1')
+    git('commit', '-q', '--allow-empty', '--author',
+        'New Person <new@foo.com>', '-m', 'New 2')
+    second = repo.head_sha()
+    check([f'{first}..{second}'])
+    # Unless we ask for full parses.
+    git('commit', '-q', '--allow-empty', '-m', 'New 3')
+    check([repo.head_sha()], incremental=False)
+    # Changed mailmap; full parse.
+    with open(pjoin(path, '.mailmap'), 'at') as fobj:
+        fobj.write('New Person <new@foo.com> Author 1 '
+                   '<author1@example1.org>\n')
+    git('commit', '-q', '-am', 'Mailmap')
+    check([repo.head_sha()])
+    # Rewritten history; full parse.
+    git('reset', '-q', '--hard', second)
+    git('commit', '-q', '--allow-empty', '-m', 'Rewritten')
+    check([repo.head_sha()])
+
+
+def test_merge_contributors():
+    old_out = """\
+M Brett (1):
+      a1||M Brett||mb@foo.com||M Brett||mb@foo.com||2018-08-28T23:27:25-04:00
+
+J Doe (1):
+      b1||J Doe||jd@foo.com||J Doe||jd@foo.com||2018-08-30T23:27:25+00:00
+"""
+    new_out = """\
+J Doe (2):
+      b2||J Doe||jd@foo.com||J Doe||jd@foo.com||2018-09-01T23:27:25+00:00
+      b3||J Doe||jd@foo.com||J Doe||jd@bar.com||2018-09-02T23:27:25+00:00
+
+A Person (1):
+      c1||A Person||ap@foo.com||A Person||ap@foo.com||2018-09-03T23:27:25+00:00
+"""
+    old = [RepoContributor(commits, TEST_REPO) for commits in
+           parse_shortlog(old_out)]
+    new = [RepoContributor(commits, TEST_REPO) for commits in
+           parse_shortlog(new_out)]
+    brett, doe = old
+    doe.gh_user = 'jdoe'
+    merged = merge_contributors(old, new)
+    assert [c.name for c in merged] == ['J Doe', 'A Person', 'M Brett']
+    # Existing contributors keep identity.
+    assert merged[0] is doe and merged[0].gh_user == 'jdoe'
+    assert merged[2] is brett
+    assert [c.sha for c in doe.commits] == ['b1', 'b2', 'b3']
+    assert doe.emails == ('jd@foo.com', 'jd@bar.com')
+    assert [c.sha for c in brett.commits] == ['a1']
+    assert len(set(c.commits.table for c in merged)) == 1
+
+
 def test_parse_shortlog():
     eg_out = TEST_REPO.cmd_in_repo(
         ['git', 'shortlog', '-n', "--format=%H||%aN||%aE||%an||%ae||%aI"])
@@ -78,6 +655,33 @@ def test_parse_shortlog():
         assert c.c_email == 'joydeepubuntu@gmail.com'
 
 
+def test_iter_shortlog():
+    read = []
+
+    def lines():
+        for line in EG_SHORTLOG.splitlines(keepends=True):
+            read.append(line)
+            yield line
+
+    blocks = iter_shortlog(lines())
+    first = next(blocks)
+    assert [c.sha for c in first] == ['bcdd3e7e11b', 'acdd3e7e11b']
+    assert first[1].o_email == 'mb@bar.org'
+    # Commits of second block not yet read from input.
+    assert read[-1] == 'J Doe (1):\n'
+    assert parse_shortlog(EG_SHORTLOG) == [first, [parse_sl_line(
+        '0cdd3e7e11b||J Doe||jd@foo.com||J Doe||jd@foo.com||'
+        '2018-08-30T23:27:25+00:00')]]
+
+
+def test_Repo_iter_contributors():
+    contribs = TEST_REPO.contributors()
+    streamed = TEST_REPO.iter_contributors()
+    for c, s in zip(contribs, streamed):
+        assert c.commits == s.commits
+    assert len(list(streamed)) == 0
+
+
 def test_Repo_contributors():
     contribs = list(TEST_REPO.contributors())
     assert len(contribs) == 117
@@ -160,3 +764,55 @@ def test_lupdate():
     assert lupdate(a, b) is None
     # Modified a in-place.  Only updates values present in left
     assert a == dict(one=11, two=2)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """ Answer GraphQL POST with query string, tracking concurrent requests
+    """
+
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+
+    def do_POST(self):
+        cls = type(self)
+        with cls.lock:
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        query = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        time.sleep(0.05)
+        body = json.dumps({'data': query}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with cls.lock:
+            cls.in_flight -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+def test_async_github(monkeypatch, stub_server):
+    url = stub_server(StubHandler)
+    monkeypatch.setattr(gputils, 'GRAPHQL_URL', f'{url}/graphql')
+    monkeypatch.setattr(gputils, '_GH_STATE', {'tokens': ['stub-token']})
+    agh = AsyncGitHub(max_concurrency=3)
+    queries = [f'query {i}' for i in range(10)]
+    answers = asyncio.run(agh.map(gputils.graphql_query, queries))
+    assert [a['data']['query'] for a in answers] == queries
+    assert 1 < StubHandler.max_in_flight <= 3
+
+
+def test_run_sync():
+    async def answer():
+        await asyncio.sleep(0)
+        return 42
+
+    async def in_loop():
+        # As from Jupyter, with event loop already running.
+        return run_sync(answer())
+
+    assert run_sync(answer()) == 42
+    assert asyncio.run(in_loop()) == 42
@@ -0,0 +1,63 @@
+""" Tests for kvstore module
+"""
+
+import sys
+import pickle
+from os.path import join as pjoin, abspath, dirname
+
+import pytest
+
+HERE = dirname(__file__)
+sys.path.append(abspath(pjoin(HERE, '..')))
+
+from kvstore import SQLiteStore
+
+
+def test_sqlite_store(tmp_path):
+    fname = str(tmp_path / 'store.sqlite')
+    store = SQLiteStore(fname)
+    # Database only created on first use.
+    assert not store.exists
+    assert 'foo' not in store
+    assert store.exists
+    store['foo'] = {'location': 'Paris', 'n': 1}
+    store.update({'bar': None, 'baz': [1, 2]})
+    assert store['foo'] == {'location': 'Paris', 'n': 1}
+    assert store.get('bar', 'default') is None
+    assert store.get('missing', 'default') == 'default'
+    assert sorted(store) == ['bar', 'baz', 'foo']
+    assert len(store) == 3
+    del store['bar']
+    with pytest.raises(KeyError):
+        store['bar']
+    with pytest.raises(KeyError):
+        del store['bar']
+    # Another table in the same file is separate.
+    other = SQLiteStore(fname, 'other')
+    assert len(other) == 0
+    # Persists across instances, and pickles.
+    store.close()
+    again = pickle.loads(pickle.dumps(SQLiteStore(fname)))
+    assert dict(again.items()) == {'foo': {'location': 'Paris', 'n': 1},
+                                   'baz': [1, 2]}
+    again.clear()
+    assert len(again) == 0
+
+
+def test_update_atomic(tmp_path):
+    store = SQLiteStore(str(tmp_path / 'store.sqlite'))
+    store['foo'] = 1
+    with pytest.raises(TypeError):
+        store.update({'foo': 2, 'bar': object()})
+    assert dict(store.items()) == {'foo': 1}
+
+
+def test_keys_by(tmp_path):
+    store = SQLiteStore(str(tmp_path / 'store.sqlite'))
+    store.update({'a': {'fetched': 30}, 'b': {'fetched': None},
+                  'c': {'fetched': 10}, 'd': {'other': 1}})
+    assert store.keys_by('fetched')[2:] == ['c', 'a']
+    assert sorted(store.keys_by('fetched', 2)) == ['b', 'd']
+    assert store.keys_by('fetched', 0) == []
+    with pytest.raises(ValueError):
+        store.keys_by('fetched); DROP TABLE kv')
@@ -0,0 +1,60 @@
+""" Tests for synth_repo module
+"""
+
+import sys
+from os.path import join as pjoin, abspath, dirname
+from collections import Counter
+
+import numpy as np
+
+HERE = dirname(__file__)
+sys.path.append(abspath(pjoin(HERE, '..')))
+
+from synth_repo import make_repo, make_authors, git_tz, mailmap
+from gputils import Repo
+
+
+def test_make_authors():
+    authors = make_authors(100, noreply_frac=0.5, mailmap_frac=0.5,
+                           rng=np.random.default_rng(0))
+    assert len(authors) == 100
+    noreply = [a for a in authors if a.email.endswith('noreply.github.com')]
+    assert 30 < len(noreply) < 70
+    assert len(mailmap(authors).splitlines()) == sum(
+        a.mailmapped for a in authors)
+    assert git_tz(-300) == '-0500'
+    assert git_tz(330) == '+0530'
+
+
+def test_make_repo(tmp_path):
+    path = str(tmp_path / 'repo')
+    info = make_repo(path, n_commits=300, n_authors=10, alias_frac=0.3,
+                     seed=1)
+    assert len(info.commit_authors) == 300
+    assert info.prs
+    repo = Repo('repo', 'org', path=path)
+    contribs = repo.contributors()
+    assert sum(len(c) for c in contribs) == 300 + len(info.prs)
+    by_name = {c.name: c for c in contribs}
+    # Merges come from maintainers, at the top of the Zipf list.
+    n_merges = Counter()
+    for author in info.authors[:3]:
+        n_merges[author.name] = len(by_name[author.name]) - np.sum(
+            info.commit_authors == info.authors.index(author))
+    assert sum(n_merges.values()) == len(info.prs)
+    # Mailmap merges aliases; other aliases are separate contributors.
+    for author in info.authors:
+        if author.name not in by_name:
+            continue
+        emails = by_name[author.name].emails
+        if author.mailmapped:
+            assert author.alias_name not in by_name
+        else:
+            assert author.alias_email not in emails
+    # PR authors from merge commits.
+    merge_prs = repo.merge_prs
+    assert len(merge_prs) == len(info.prs)
+    for number, k, size in info.prs:
+        pr = merge_prs.prs[number]
+        assert pr.author == info.authors[k].gh_user
+        assert len(pr.shas) == size